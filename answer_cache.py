@@ -0,0 +1,98 @@
+# answer_cache.py
+# [DAY 25] Cache câu trả lời Gemini cho các câu hỏi lặp lại
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+from db_collector import run_db
+from text_utils import normalize_key
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """
+    Cache 2 tầng đứng trước lời gọi Gemini.
+    - Khóa = câu hỏi đã chuẩn hóa (chữ thường, gộp khoảng trắng, giữ nguyên dấu) + hash `history_window` tin trước đó.
+    - Tầng RAM: LRU có TTL, giới hạn cả số mục lẫn tổng dung lượng (byte).
+    - Tầng DB (tùy chọn): bảng answer_cache, giữ được qua các lần khởi động lại.
+    """
+
+    def __init__(self, db=None, max_entries=5000, max_bytes=8 * 1024 * 1024, ttl_seconds=86400, history_window=2):
+        self.db = db
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.history_window = history_window
+        self._entries = OrderedDict()  # key -> (expires_at, answer, size)
+        self._bytes = 0
+        self.stats = {"hits": 0, "db_hits": 0, "misses": 0, "evictions": 0}
+
+    def make_key(self, message_text, history=None):
+        context = ""
+        if history and self.history_window:
+            context = "\n".join(
+                f"{msg['role']}:{normalize_key(msg['content'])}" for msg in history[-self.history_window:]
+            )
+        raw = normalize_key(message_text) + "\x00" + hashlib.sha1(context.encode("utf-8")).hexdigest()
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # --- TẦNG RAM ---
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, answer):
+        size = len(key) + len(answer.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, answer, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry[2]
+
+    # --- API CHO BOT (RAM -> DB) ---
+    async def lookup(self, message_text, history=None):
+        key = self.make_key(message_text, history)
+        answer = self.get(key)
+        if answer is not None:
+            self.stats["hits"] += 1
+            return answer
+
+        if self.db is not None:
+            answer = await run_db(self.db.get_cached_answer, key, self.ttl_seconds)
+            if answer is not None:
+                self.stats["db_hits"] += 1
+                self.put(key, answer)
+                return answer
+
+        self.stats["misses"] += 1
+        return None
+
+    async def store(self, message_text, history, answer):
+        if not answer:
+            return
+        key = self.make_key(message_text, history)
+        self.put(key, answer)
+        if self.db is not None:
+            await run_db(self.db.save_cached_answer, key, answer)
+
+    def __len__(self):
+        return len(self._entries)
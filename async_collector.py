@@ -0,0 +1,141 @@
+# async_collector.py
+# [DAY 42] CollectorV2 trên engine asyncio của SQLAlchemy (asyncpg cho Postgres, aiosqlite khi chạy local)
+
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import greenlet_spawn
+
+from db_collector import Base, CollectorV2
+from instrumentation import DB_POOL_IN_USE, DB_POOL_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def to_async_url(database_url, statement_cache_size=500):
+    """postgres:// / postgresql:// -> postgresql+asyncpg://, sqlite:/// -> sqlite+aiosqlite:///"""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend in ("postgres", "postgresql"):
+        query = dict(url.query)
+        # asyncpg không hiểu sslmode (kiểu libpq, Render / Heroku hay gắn vào URL) -> đổi sang ssl
+        sslmode = query.pop("sslmode", None)
+        if sslmode and sslmode != "disable":
+            query["ssl"] = sslmode
+        # Cache prepared statement của asyncpg (0 = tắt, cần khi đi qua pgbouncer chế độ transaction)
+        query.setdefault("prepared_statement_cache_size", str(statement_cache_size))
+        return url.set(drivername="postgresql+asyncpg", query=query)
+    if backend == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+
+class TimedAsyncPool(AsyncAdaptedQueuePool):
+    """Pool ghi lại thời gian lấy connection (chờ slot trống + pre-ping + mở kết nối mới nếu cần)"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+
+class _GreenletCollector(CollectorV2):
+    """Thân method của CollectorV2 giữ nguyên, chỉ đổi engine sang phía sync của AsyncEngine"""
+
+    def __init__(self, sync_engine):
+        self.engine = sync_engine
+        self.Session = sessionmaker(bind=sync_engine)
+
+
+class AsyncCollector:
+    """
+    Cùng các method public với CollectorV2, truy vấn chạy bằng driver async trong event loop riêng của DB
+    (thread "db-loop"): không chặn event loop của Telegram, không giữ thread nào của pool to_thread khi chờ DB.
+    - Gọi trên event loop: `await run_db(db.method, ...)` (hoặc `await db.run_async("method", ...)`).
+      Gọi thẳng `db.method(...)` trên thread đang có event loop chạy -> RuntimeError (sẽ chặn cả loop).
+    - Gọi từ thread khác (asyncio.to_thread, LogWriter, LogRetention): chạy đồng bộ, chờ kết quả như CollectorV2.
+    Mỗi lời gọi chạy nguyên code của CollectorV2 trong greenlet (greenlet_spawn), nên lỗi DB vẫn được
+    từng method bắt và trả giá trị mặc định như bản sync. Phần dựng object / dict chạy trên db-loop, không
+    chiếm event loop chính. Method nào có bản `_async_<tên>` (ví dụ setup_database) thì chạy bản async đó.
+    """
+
+    def __init__(self, database_url, pool_size=10, max_overflow=10, pool_timeout=10, pool_recycle=1800,
+                 statement_cache_size=500):
+        url = to_async_url(database_url, statement_cache_size)
+        options = {"pool_pre_ping": True, "query_cache_size": statement_cache_size}
+        if url.get_backend_name() != "sqlite" or url.database not in (None, "", ":memory:"):
+            options.update(poolclass=TimedAsyncPool, pool_size=pool_size, max_overflow=max_overflow,
+                           pool_timeout=pool_timeout, pool_recycle=pool_recycle)
+        self.engine = create_async_engine(url, **options)
+        self._sync = _GreenletCollector(self.engine.sync_engine)
+        DB_POOL_IN_USE.set_function(self.engine.sync_engine.pool.checkedout)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="db-loop", daemon=True)
+        self._thread.start()
+        logger.info(f"Kết nối SQLAlchemy (async, {url.drivername}) tới database thành công.")
+
+    async def _run(self, name, args, kwargs):
+        native = getattr(self, f"_async_{name}", None)
+        if native is not None:
+            return await native(*args, **kwargs)
+        return await greenlet_spawn(getattr(self._sync, name), *args, **kwargs)
+
+    async def _async_setup_database(self):
+        """DDL chạy trên AsyncConnection; dọn trùng / ALTER / backfill vẫn là code của CollectorV2"""
+        try:
+            async with self.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            await greenlet_spawn(self._sync._migrate_database)
+            logger.info("SQLAlchemy (async): Đã tạo/kiểm tra các bảng thành công.")
+            return True
+        except Exception as e:
+            logger.error(f"Lỗi setup_database (SQLAlchemy async): {e}", exc_info=True)
+            return False
+
+    async def run_async(self, name, *args, **kwargs):
+        """Chạy method `name` trên db-loop, chờ kết quả mà không chặn event loop đang chạy (run_db dùng hàm này)"""
+        future = asyncio.run_coroutine_threadsafe(self._run(name, args, kwargs), self._loop)
+        return await asyncio.wrap_future(future)
+
+    def _submit(self, name, args, kwargs):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Thread thường -> chờ đồng bộ
+            return asyncio.run_coroutine_threadsafe(self._run(name, args, kwargs), self._loop).result()
+        raise RuntimeError(
+            f"AsyncCollector.{name}() được gọi đồng bộ trên thread đang chạy event loop: "
+            f"dùng `await run_db(db.{name}, ...)` hoặc gọi từ thread khác (asyncio.to_thread)"
+        )
+
+    def close(self):
+        """Đóng hết connection trong pool và dừng db-loop (gọi khi tắt bot)"""
+        if not self._loop.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self.engine.dispose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+
+def _make_method(name, sync_method):
+    @functools.wraps(sync_method)
+    def method(self, *args, **kwargs):
+        return self._submit(name, args, kwargs)
+    method.__async_collector__ = True  # run_db() nhận ra -> await run_async() thay vì asyncio.to_thread
+    return method
+
+
+for _name, _func in list(vars(CollectorV2).items()):
+    if not _name.startswith("_") and inspect.isfunction(_func):
+        setattr(AsyncCollector, _name, _make_method(_name, _func))
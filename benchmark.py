@@ -0,0 +1,490 @@
+# benchmark.py
+# [DAY 36] Bộ benchmark offline cho các đường nóng (không cần Telegram / Gemini / DB từ xa)
+#
+#   python benchmark.py                                  -> chạy tất cả, ghi bench_results/<commit>-<thời gian>.json
+#   python benchmark.py --sizes 1000,10000 --only suggestion,gemini
+#   python benchmark.py --compare old.json new.json      -> so sánh 2 lần chạy, exit 1 nếu chậm đi quá ngưỡng
+#   python benchmark.py --write-fixtures                 -> sinh lại trang HTML giả lập (bench_fixtures/synthetic_*.html)
+#   DATABASE_URL=postgresql://... python benchmark.py    -> chạy phần DB trên Postgres local thay vì SQLite tạm
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(ROOT, "bench_fixtures")
+RESULT_DIR = os.path.join(ROOT, "bench_results")
+sys.path.insert(0, ROOT)
+
+WORDS = ("python loi bug sua mang no ron hoc sau may tinh du lieu pandas numpy ham vong lap lop doi tuong "
+         "ke thua api web flask django sql truy van index toi uu bo nho thuat toan sap xep docker git").split()
+QUERIES = [
+    "Mình bị lỗi IndexError trong python, sửa sao ạ?",
+    "làm sao tối ưu câu truy vấn sql chạy chậm",
+    "giải thích giúp mình mạng nơ ron tích chập",
+    "pandas dataframe lọc dữ liệu theo điều kiện",
+    "hôm nay trời đẹp quá, đi chơi không?",
+    "git merge bị conflict phải làm gì",
+]
+
+
+# ==============================================================================
+# ĐO ĐẠC
+# ==============================================================================
+
+def summarize(latencies, wall_seconds=None, **extra):
+    """p50/p95/p99 (ms) + throughput (thao tác/giây)"""
+    arr = np.asarray(latencies, dtype=np.float64) * 1000
+    wall = wall_seconds if wall_seconds is not None else float(arr.sum()) / 1000
+    result = {
+        "n": int(arr.size),
+        "mean_ms": round(float(arr.mean()), 4),
+        "p50_ms": round(float(np.percentile(arr, 50)), 4),
+        "p95_ms": round(float(np.percentile(arr, 95)), 4),
+        "p99_ms": round(float(np.percentile(arr, 99)), 4),
+        "max_ms": round(float(arr.max()), 4),
+        "throughput_per_s": round(arr.size / wall, 2) if wall > 0 else 0.0,
+    }
+    result.update(extra)
+    return result
+
+
+def timed(fn, repeat, *args):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def make_records(n, seed=42):
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        keyword = " ".join(rng.sample(WORDS, 2)) + f" {i}"
+        records.append({
+            "suggestion_id": f"BENCH_{i}",
+            "keyword": keyword,
+            "suggestion_text": " ".join(rng.choices(WORDS, k=10)),
+            "suggestion_link": f"https://example.com/bench/{i}",
+            "rating_score": rng.randint(-5, 20),
+            "updated_at": datetime.datetime(2024, 1, 1),
+        })
+    return records
+
+
+# ==============================================================================
+# CÁC BENCHMARK
+# ==============================================================================
+
+def bench_suggestion(bot, sizes, repeat):
+    """bot.get_suggestion_engine trên kho 1k/10k/100k gợi ý (automaton -> BM25 -> vector)"""
+    from content_cache import ContentCache
+    from vector_index import VectorIndex
+
+    results = {}
+    for size in sizes:
+        records = make_records(size)
+        cache = ContentCache(bm25_threshold=bot.BM25_THRESHOLD, vectors=VectorIndex(f"BenchVectors{size}"),
+                             semantic_threshold=bot.SEMANTIC_THRESHOLD)
+        start = time.perf_counter()
+        cache.load(records)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        cache.sync_vectors(records)
+        vector_seconds = time.perf_counter() - start
+        bot.content_cache = cache
+
+        rng = random.Random(size)
+        queries = QUERIES + [f"cho mình hỏi về {records[rng.randrange(size)]['keyword']}" for _ in range(20)]
+        for query in queries:
+            bot.get_suggestion_engine(query)  # Làm nóng
+        latencies = []
+        hits = 0
+        for _ in range(repeat):
+            for query in queries:
+                start = time.perf_counter()
+                found = bot.get_suggestion_engine(query)[2]
+                latencies.append(time.perf_counter() - start)
+                hits += found is not None
+        results[f"suggestion_engine_{size}"] = summarize(
+            latencies, load_s=round(load_seconds, 3), vector_build_s=round(vector_seconds, 3),
+            hit_rate=round(hits / len(latencies), 3)
+        )
+    return results
+
+
+def bench_import(db, batches, batch_size):
+    """db.import_content_batch: mỗi lô ~50% link đã có (chống trùng) + 50% link mới"""
+    latencies = []
+    inserted = 0
+    seen = 0
+    rng = random.Random(1)
+    for b in range(batches):
+        items = []
+        for i in range(batch_size):
+            n = rng.randrange(seen) if seen and i % 2 else seen + i
+            items.append({"keyword": "Bench", "text": f"[Bench] Bài số {n}", "link": f"https://example.com/import/{n}"})
+        seen += batch_size
+        start = time.perf_counter()
+        inserted += db.import_content_batch(items)
+        latencies.append(time.perf_counter() - start)
+    return {"import_content_batch": summarize(
+        latencies, batch_size=batch_size, rows_per_s=round(batches * batch_size / sum(latencies), 1),
+        inserted=inserted
+    )}
+
+
+def bench_retry(n):
+    """RetryManager: add_message, pop_batch + ack"""
+    from retry_manager import RetryManager
+
+    mgr = RetryManager(db_file="BenchRetry.db")
+    chat_ids = iter(range(1000, 1000 + n))
+    add = timed(lambda: mgr.add_message(next(chat_ids), "Bench retry", reason="bench"), n)
+    pop_latencies = []
+    while True:
+        start = time.perf_counter()
+        batch = mgr.pop_batch(limit=50)
+        for item in batch:
+            mgr.ack(item["id"])
+        if not batch:
+            break
+        pop_latencies.append(time.perf_counter() - start)
+    return {
+        "retry_add_message": summarize(add),
+        "retry_pop_ack_50": summarize(pop_latencies, messages_per_s=round(n / sum(pop_latencies), 1)),
+    }
+
+
+def fixture_path(source):
+    name = re.sub(r"[^a-z0-9]+", "_", source["name"].lower()).strip("_")
+    return os.path.join(FIXTURE_DIR, f"synthetic_{name}.html")
+
+
+def make_synthetic_page(source, rng, n_items=40):
+    """
+    Trang listing GIẢ LẬP cho `source` (không phải trang thật đã lưu): container / title / link đúng selector
+    trong SOURCES, xen với head, CSS, JSON-LD, nav, sidebar, footer và markup lồng nhau có nội dung thay đổi
+    theo `rng` -> đo được chi phí parse, nhưng con số chỉ mang tính tương đối so với trang thật.
+    """
+    def attrs(spec):
+        return f' class="{spec["class_"]}"' if spec.get("class_") else ""
+
+    def phrase(k):
+        return " ".join(rng.choice(WORDS) for _ in range(k))
+
+    css = "\n".join(
+        f".{rng.choice(WORDS)}-{i} {{ margin: {rng.randint(0, 24)}px; padding: {rng.randint(0, 16)}px "
+        f"{rng.randint(0, 16)}px; color: #{rng.randrange(16 ** 6):06x}; }}"
+        for i in range(200)
+    )
+    ld_json = json.dumps({"@context": "https://schema.org", "@type": "ItemList", "itemListElement": [
+        {"@type": "ListItem", "position": i, "name": phrase(6)} for i in range(n_items)
+    ]}, ensure_ascii=False)
+    nav = "".join(f'<li class="nav-item"><a href="/{rng.choice(WORDS)}/{i}">{phrase(2).title()}</a></li>'
+                  for i in range(rng.randint(20, 40)))
+
+    container, title, link = source["container"], source["title"], source["link"]
+    items = []
+    for i in range(n_items):
+        headline = phrase(rng.randint(5, 12)).capitalize()
+        href = f"/{rng.choice(WORDS)}/{rng.randint(10 ** 5, 10 ** 6)}-{headline.lower().replace(' ', '-')}"
+        meta = (f'<span class="byline">{phrase(2).title()}</span> <time datetime="2024-0{rng.randint(1, 9)}-1{i % 10}">'
+                f'{rng.randint(1, 59)} min ago</time>')
+        if title:
+            # Title là thẻ riêng, link là thẻ khác trong cùng container
+            inner = (f'<{title["tag"]}{attrs(title)}>{headline}</{title["tag"]}>'
+                     f'<div class="meta">{meta}</div><p class="excerpt">{phrase(rng.randint(20, 40))}</p>'
+                     f'<{link["tag"]} href="{href}"{attrs(link)}>Read more</{link["tag"]}>')
+        else:
+            inner = f'<{link["tag"]} href="{href}"{attrs(link)}>{headline}</{link["tag"]}>'
+        items.append(f'<{container["tag"]}{attrs(container)}>{inner}</{container["tag"]}>')
+        if not title:
+            items.append(f'<div class="meta">{meta}</div><p class="excerpt">{phrase(rng.randint(20, 40))}</p>')
+        items.append(f'<div class="promo" data-slot="{i}"><img src="/img/{i}.jpg" alt="{phrase(3)}"></div>')
+
+    sidebar = "".join(f'<li><a href="/tag/{w}">{w}</a> <span class="count">{rng.randint(1, 999)}</span></li>'
+                      for w in rng.sample(WORDS, len(WORDS)))
+    footer = "".join(f'<div class="col"><h4>{phrase(2).title()}</h4><ul>'
+                     + "".join(f'<li><a href="/about/{j}">{phrase(2)}</a></li>' for j in range(8))
+                     + "</ul></div>" for _ in range(4))
+    table = (container["tag"] == "tr")
+    body = f"<table><tbody>{''.join(items)}</tbody></table>" if table else f"<main>{''.join(items)}</main>"
+    return (f'<!DOCTYPE html>\n<html lang="en"><head><meta charset="utf-8"><title>{source["name"]}</title>\n'
+            f'<meta name="description" content="{phrase(20)}">\n<style>\n{css}\n</style>\n'
+            f'<script type="application/ld+json">{ld_json}</script>\n</head>\n'
+            f'<body><header class="site-header"><nav><ul>{nav}</ul></nav></header>\n{body}\n'
+            f'<aside class="sidebar"><ul>{sidebar}</ul></aside>\n<footer>{footer}</footer></body></html>\n')
+
+
+def write_fixtures():
+    """Sinh lại bench_fixtures/synthetic_*.html (cố định seed -> file giống nhau giữa các lần chạy)"""
+    from scrapers import SOURCES
+
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    for i, source in enumerate(SOURCES):
+        with open(fixture_path(source), "w", encoding="utf-8") as f:
+            f.write(make_synthetic_page(source, random.Random(i)))
+        print(f"Đã ghi {fixture_path(source)}")
+
+
+def bench_scraper_parse(repeat):
+    """
+    scrapers.parse_source trên các trang GIẢ LẬP trong bench_fixtures/ (sinh bởi --write-fixtures, không phải
+    trang thật đã lưu). Dùng để so sánh giữa các commit; không phản ánh thời gian parse trang thật.
+    """
+    from scrapers import SOURCES, parse_source
+
+    pages = []
+    for source in SOURCES:
+        path = fixture_path(source)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                pages.append((source, f.read()))
+    latencies = []
+    parsed = 0
+    for _ in range(repeat):
+        for source, html in pages:
+            start = time.perf_counter()
+            parsed += len(parse_source(source, html))
+            latencies.append(time.perf_counter() - start)
+    total_bytes = sum(len(html) for _, html in pages) * repeat
+    return {"scraper_parse": summarize(
+        latencies, pages=len(pages), fixtures="synthetic", mb_per_s=round(total_bytes / sum(latencies) / 1e6, 2),
+        items_per_page=round(parsed / max(len(latencies), 1), 2)
+    )}
+
+
+class StubGemini:
+    """Thay model Gemini: trả lời sau `latency` giây (± `jitter` tỉ lệ), stream thành `chunks` đoạn"""
+
+    def __init__(self, latency=0.05, chunks=8, jitter=0.0, seed=0):
+        self.base_latency = latency
+        self.chunks = chunks
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+
+    @property
+    def latency(self):
+        if not self.jitter:
+            return self.base_latency
+        return self.base_latency * self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def start_chat(self, history=None):
+        return self
+
+    async def send_message_async(self, message_text, stream=False):
+        stub = self
+        latency = self.latency
+
+        class _Chunk:
+            def __init__(self, text):
+                self.text = text
+
+        class _Response:
+            text = f"Trả lời mẫu cho: {message_text}. " * 10
+
+            def __aiter__(self):
+                return self._iterate()
+
+            async def _iterate(self):
+                piece = len(self.text) // stub.chunks + 1
+                for i in range(0, len(self.text), piece):
+                    await asyncio.sleep(latency / stub.chunks)
+                    yield _Chunk(self.text[i:i + piece])
+
+        if not stream:
+            await asyncio.sleep(latency)
+        return _Response()
+
+
+def bench_gemini(bot, requests, concurrency, latency):
+    """bot.get_gemini_feedback_v3 với model giả: overhead cache + governor + stream, và lượt cache hit"""
+    bot.model_v3 = StubGemini(latency=latency)
+
+    class _Reply:
+        async def start(self):
+            pass
+
+        async def update(self, partial_text):
+            pass
+
+    async def run(prefix, stream):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                await bot.get_gemini_feedback_v3(f"{prefix} câu hỏi số {i}", [{"role": "user", "content": "xin chào"}],
+                                                 stream_reply=_Reply() if stream else None)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        return latencies, time.perf_counter() - start
+
+    results = {}
+    for name, stream in (("gemini_path", False), ("gemini_path_stream", True)):
+        # Lượt 1: câu hỏi mới -> gọi model giả. Lượt 2: hỏi lại y hệt -> trả từ AnswerCache
+        misses, wall = asyncio.run(run(name, stream))
+        results[name] = summarize(misses, wall, stub_latency_ms=latency * 1000, concurrency=concurrency,
+                                  overhead_p50_ms=round(float(np.percentile(misses, 50)) * 1000 - latency * 1000, 4))
+        hits, wall = asyncio.run(run(name, stream))
+        results[f"{name}_cache_hit"] = summarize(hits, wall)
+    return results
+
+
+# ==============================================================================
+# CHẠY / SO SÁNH
+# ==============================================================================
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def import_bot(workdir, **env_overrides):
+    """
+    Import bot.py với cấu hình giả, mọi file runtime (SQLite, retry, journal...) nằm trong thư mục tạm.
+    `env_overrides`: biến môi trường thay cho giá trị mặc định của benchmark (ví dụ GEMINI_RPM="15").
+    """
+    os.chdir(workdir)
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    env = {
+        "ANSWER_CACHE_PERSIST": "0",
+        "SEMANTIC_SEARCH": "0",  # Benchmark tự dựng index vector cho từng kích thước
+        "GEMINI_RPM": "1000000",
+        "GEMINI_TPM": "1000000000",
+        "GEMINI_MAX_CONCURRENCY": "64",
+        "GEMINI_MAX_QUEUE": "100000",
+    }
+    env.update(env_overrides)
+    os.environ.update(env)
+    import bot
+    # [DAY 39] bot.py không còn tạo bảng lúc import (warm_up_database chạy ở nền khi khởi động)
+    bot.db.setup_database()
+    # Bỏ log INFO/WARNING của từng thao tác (ví dụ mỗi lần add_message) để không làm sai số đo
+    logging.getLogger().setLevel(logging.ERROR)
+    return bot
+
+
+def run_all(args):
+    out = os.path.abspath(args.out) if args.out else None
+    workdir = tempfile.mkdtemp(prefix="aimentor-bench-")
+    bot = import_bot(workdir)
+    only = set(args.only.split(",")) if args.only else None
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = {}
+
+    def want(name):
+        return only is None or name in only
+
+    steps = [
+        ("suggestion", lambda: bench_suggestion(bot, sizes, args.repeat)),
+        ("import", lambda: bench_import(bot.db, args.import_batches, 500)),
+        ("retry", lambda: bench_retry(args.retry_messages)),
+        ("scraper", lambda: bench_scraper_parse(args.repeat)),
+        ("gemini", lambda: bench_gemini(bot, args.gemini_requests, 16, args.stub_latency)),
+    ]
+    for name, step in steps:
+        if not want(name):
+            continue
+        print(f"▶ {name}...", flush=True)
+        results.update(step())
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": bot.db.engine.dialect.name,
+        },
+        "results": results,
+    }
+    print_table(results)
+    out = out or os.path.join(
+        RESULT_DIR, f"{report['meta']['commit']}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Đã ghi kết quả: {out}")
+
+
+def print_table(results):
+    print(f"\n{'benchmark':<32}{'n':>8}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'ops/s':>12}")
+    for name, r in results.items():
+        print(f"{name:<32}{r['n']:>8}{r['p50_ms']:>11.3f}{r['p95_ms']:>11.3f}{r['p99_ms']:>11.3f}"
+              f"{r['throughput_per_s']:>12.1f}")
+
+
+def compare(old_path, new_path, threshold):
+    """In chênh lệch p50/p95 giữa 2 file kết quả, trả về số benchmark bị chậm hơn `threshold`"""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"So sánh {old['meta']['commit']} -> {new['meta']['commit']} (ngưỡng +{threshold:.0%})\n")
+    print(f"{'benchmark':<32}{'p50 cũ':>10}{'p50 mới':>10}{'Δp50':>9}{'p95 cũ':>10}{'p95 mới':>10}{'Δp95':>9}")
+    regressions = 0
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        o, n = old["results"][name], new["results"][name]
+        d50 = n["p50_ms"] / o["p50_ms"] - 1 if o["p50_ms"] else 0.0
+        d95 = n["p95_ms"] / o["p95_ms"] - 1 if o["p95_ms"] else 0.0
+        flag = ""
+        if d50 > threshold or d95 > threshold:
+            regressions += 1
+            flag = "  ⚠️ CHẬM HƠN"
+        print(f"{name:<32}{o['p50_ms']:>10.3f}{n['p50_ms']:>10.3f}{d50:>+9.1%}"
+              f"{o['p95_ms']:>10.3f}{n['p95_ms']:>10.3f}{d95:>+9.1%}{flag}")
+    for name in sorted(set(old["results"]) ^ set(new["results"])):
+        print(f"{name:<32}(chỉ có ở 1 trong 2 lần chạy)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline AI Mentor Bot")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.15, help="Chậm hơn bao nhiêu thì coi là regression")
+    parser.add_argument("--only", help="suggestion,import,retry,scraper,gemini")
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--import-batches", type=int, default=20)
+    parser.add_argument("--retry-messages", type=int, default=2000)
+    parser.add_argument("--gemini-requests", type=int, default=400)
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="Độ trễ giả lập của Gemini (giây)")
+    parser.add_argument("--out")
+    parser.add_argument("--write-fixtures", action="store_true", help="Sinh lại các trang HTML giả lập cho scraper")
+    args = parser.parse_args()
+
+    if args.write_fixtures:
+        write_fixtures()
+        return
+    if args.compare:
+        regressions = compare(args.compare[0], args.compare[1], args.threshold)
+        sys.exit(1 if regressions else 0)
+    run_all(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# bm25_index.py
+# [DAY 31] Tìm kiếm xếp hạng BM25 trên keyword + suggestion_text (đã bỏ dấu tiếng Việt)
+
+import logging
+import math
+import re
+
+import numpy as np
+
+from text_utils import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Hư từ phổ biến (đã bỏ dấu) -> không mang nghĩa khi tìm kiếm
+STOPWORDS = {
+    "la", "va", "cua", "co", "khong", "cho", "toi", "ban", "minh", "nao", "gi", "thi", "nhu", "the",
+    "de", "voi", "mot", "cac", "nhung", "duoc", "trong", "ve", "nay", "do", "a", "oi", "nhe", "ha",
+    "an", "and", "or", "of", "to", "in", "is", "for", "on", "how", "what",
+}
+
+
+def tokenize(text):
+    return [tok for tok in _TOKEN_RE.findall(normalize_text(text)) if tok not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inverted index: mỗi term giữ 2 mảng NumPy (chỉ số tài liệu, trọng số BM25 đã tính sẵn).
+    Truy vấn = cộng dồn các mảng posting vào 1 vector điểm -> không có vòng lặp Python theo tài liệu.
+    Điểm cuối = BM25 + rating_weight * tanh(rating_score / rating_scale).
+    """
+
+    def __init__(self, records, k1=1.2, b=0.75, keyword_boost=2, rating_weight=0.5, rating_scale=5.0):
+        self.k1 = k1
+        self.rating_weight = rating_weight
+        self.rating_scale = rating_scale
+        self.records = list(records)
+        self.positions = {rec['suggestion_id']: i for i, rec in enumerate(self.records)}
+        self.ratings = np.array([rec.get('rating_score') or 0 for rec in self.records], dtype=np.float32)
+
+        n_docs = len(self.records)
+        term_docs = {}
+        doc_len = np.zeros(n_docs, dtype=np.float32)
+        for i, rec in enumerate(self.records):
+            # Từ khóa quan trọng hơn tiêu đề -> lặp lại `keyword_boost` lần
+            tokens = tokenize(rec.get('keyword') or '') * keyword_boost + tokenize(rec.get('suggestion_text') or '')
+            doc_len[i] = len(tokens)
+            counts = {}
+            for tok in tokens:
+                counts[tok] = counts.get(tok, 0) + 1
+            for tok, tf in counts.items():
+                term_docs.setdefault(tok, []).append((i, tf))
+
+        avgdl = float(doc_len.mean()) if n_docs else 1.0
+        norm = k1 * (1 - b + b * doc_len / max(avgdl, 1e-6))
+        self.max_idf = math.log(1 + n_docs) if n_docs else 0.0
+        self.idf = {}
+        self.postings = {}
+        for tok, entries in term_docs.items():
+            docs = np.fromiter((d for d, _ in entries), dtype=np.int32, count=len(entries))
+            tf = np.fromiter((t for _, t in entries), dtype=np.float32, count=len(entries))
+            df = len(entries)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            self.idf[tok] = idf
+            self.postings[tok] = (docs, (idf * tf * (k1 + 1) / (tf + norm[docs])).astype(np.float32))
+
+    def set_rating(self, sugg_id, rating_score):
+        pos = self.positions.get(sugg_id)
+        if pos is not None:
+            self.ratings[pos] = rating_score or 0
+
+    def search(self, message_text):
+        """
+        Trả về (record, confidence) tốt nhất hoặc (None, 0.0).
+        confidence = BM25 của kết quả / BM25 tối đa có thể đạt với câu hỏi này (0..1).
+        """
+        terms = set(tokenize(message_text))
+        if not terms or not self.records:
+            return None, 0.0
+
+        scores = np.zeros(len(self.records), dtype=np.float32)
+        upper = 0.0
+        matched = False
+        for term in terms:
+            posting = self.postings.get(term)
+            # Term không có trong kho vẫn tính vào mẫu số -> câu hỏi lạc đề sẽ có confidence thấp
+            upper += self.idf.get(term, self.max_idf) * (self.k1 + 1)
+            if posting is None:
+                continue
+            docs, weights = posting
+            scores[docs] += weights  # chỉ số trong 1 posting là duy nhất -> cộng vector hóa an toàn
+            matched = True
+        if not matched:
+            return None, 0.0
+
+        blended = scores + self.rating_weight * np.tanh(self.ratings / self.rating_scale)
+        blended[scores <= 0] = -np.inf
+        best = int(np.argmax(blended))
+        confidence = float(scores[best]) / upper if upper else 0.0
+        return self.records[best], min(confidence, 1.0)
+
+    def __len__(self):
+        return len(self.records)
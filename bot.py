@@ -1,26 +1,113 @@
 # FILE BOT CHÍNH (CHUẨN DAY 21 - Multi-Source Scraper)
 
 import sqlite3
-from db_collector import CollectorV2
-# [DAY 21] Import hàm cào đa nguồn
-from scrapers import scrape_all_sources
+from db_collector import CollectorV2, run_db
+# [DAY 21] Import hàm cào đa nguồn ([DAY 23] bản async, quét song song)
+from scrapers import scrape_all_sources_async, ResponseCache
 from retry_manager import RetryManager
+# [DAY 23] Ghi log theo batch (write-behind)
+from log_writer import LogWriter
+# [DAY 25] Cache câu trả lời Gemini
+from answer_cache import AnswerCache
+# [DAY 26] Giới hạn tốc độ gọi Gemini
+from rate_limiter import GeminiGovernor, QueueFullError, RateLimitTimeout
+from text_utils import estimate_tokens
+# [DAY 27] Stream câu trả lời Gemini bằng cách edit tin nhắn
+from streaming_reply import ProgressiveReply
+# [DAY 29] Gửi nhắc nhở hàng loạt theo rate limit của Telegram
+from broadcast import BroadcastEngine
+# [DAY 30] Gom vote, ghi điểm theo batch
+from vote_aggregator import VoteAggregator
+# [DAY 22] Cache gợi ý (automaton Aho-Corasick + delta refresh)
+from content_cache import ContentCache
+# [DAY 32] Tìm kiếm ngữ nghĩa trên index vector memory-map
+from vector_index import VectorIndex
+# [DAY 33] Bộ nhớ hội thoại theo ngân sách token
+from conversation_memory import ConversationMemory
+# [DAY 34] Dọn log theo lô + lưu trữ ra file nén
+from retention import LogRetention
+# [DAY 35] Bộ đếm gộp theo giờ cho báo cáo
+from metrics_rollup import MetricsRollup
+# [DAY 38] Histogram độ trễ + endpoint /metrics cho Prometheus
+from instrumentation import (
+    HANDLER_STAGE_SECONDS, MESSAGES_TOTAL, JOB_SECONDS, JOB_ERRORS, MetricsServer, instrument_methods, timed
+)
+# [DAY 40] Nhận update qua webhook thay cho long polling
+from webhook_server import WebhookServer
+# [DAY 41] Mỗi job định kỳ chỉ chạy trên 1 replica (lease trong DB)
+from job_coordinator import JobCoordinator, LeaseLost
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
     ContextTypes, CallbackQueryHandler
 )
+import asyncio
 import datetime
 import logging
 import os
+import re
+import signal
+import sys
+import threading
 import httpx
-import google.generativeai as genai
+# [DAY 39] google.generativeai (~0.5s import) được nạp lười trong get_gemini_model()
+from google.api_core.exceptions import ResourceExhausted
 
 # --- CẤU HÌNH ---
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# [DAY 25] Lưu cache câu trả lời Gemini xuống DB (0 = chỉ giữ trong RAM)
+ANSWER_CACHE_PERSIST = os.getenv("ANSWER_CACHE_PERSIST", "1") == "1"
+# [DAY 26] Quota Gemini của API key (mặc định theo gói free của Flash)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "15"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "50"))
+GEMINI_MAX_WAIT = float(os.getenv("GEMINI_MAX_WAIT", "15"))
+# [DAY 27] Bật stream câu trả lời (0 = chờ trả lời đầy đủ rồi mới gửi)
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "1") == "1"
+# [DAY 31] Ngưỡng tự tin của BM25 (0..1): thấp hơn -> chuyển câu hỏi cho Gemini
+BM25_THRESHOLD = float(os.getenv("BM25_THRESHOLD", "0.3"))
+# [DAY 32] Tìm kiếm ngữ nghĩa (0 = tắt) + ngưỡng cosine tối thiểu
+SEMANTIC_SEARCH = os.getenv("SEMANTIC_SEARCH", "1") == "1"
+SEMANTIC_THRESHOLD = float(os.getenv("SEMANTIC_THRESHOLD", "0.5"))
+# [DAY 37] Số update xử lý song song (1 = tuần tự). Gemini trả lời mất vài giây -> nên > 1 khi đông user
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))
+# [DAY 33] Ngữ cảnh gửi Gemini tối đa bao nhiêu token (ước lượng), số user giữ lịch sử trong RAM
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+MEMORY_MAX_USERS = int(os.getenv("MEMORY_MAX_USERS", "5000"))
+MEMORY_IDLE_SECONDS = int(os.getenv("MEMORY_IDLE_SECONDS", "1800"))
+# [DAY 34] Số ngày giữ log trong DB + thư mục lưu trữ log cũ
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "archive")
+# [DAY 38] Cổng HTTP cho Prometheus scrape /metrics (0 = tắt)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+# [DAY 39] Khởi động nhanh: "snapshot" = nạp cache gợi ý từ file cục bộ, polling ngay, đồng bộ với DB ở nền;
+# "blocking" = chờ DB (tạo bảng + tải content_db) xong mới polling
+STARTUP_MODE = os.getenv("STARTUP_MODE", "snapshot")
+CONTENT_SNAPSHOT_PATH = os.getenv("CONTENT_SNAPSHOT_PATH", "snapshot/content_snapshot.json.gz")
+# [DAY 40] Cách nhận update: "polling" (getUpdates) hoặc "webhook" (Telegram POST tới WEBHOOK_URL + WEBHOOK_PATH)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # URL public, ví dụ https://aimentor.onrender.com (trống = tự gọi setWebhook)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # 1-256 ký tự A-Z a-z 0-9 _ -
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Số update đã nhận nhưng chưa bắt đầu xử lý tối đa; vượt -> trả 503 để Telegram gửi lại sau
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+# [DAY 41] Lease job: replica chết -> replica khác nhận job sau tối đa JOB_LEASE_TTL giây
+JOB_LEASE_TTL = int(os.getenv("JOB_LEASE_TTL", "120"))
+# [DAY 42] DB_ASYNC=1 -> AsyncCollector (asyncpg / aiosqlite trên event loop riêng) thay cho CollectorV2 + to_thread
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Số câu SQL đã biên dịch giữ lại (SQLAlchemy) + prepared statement mỗi connection (asyncpg, 0 = tắt khi dùng pgbouncer)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
 
 # ⚠️ THAY BẰNG ID TELEGRAM CỦA BẠN
 ADMIN_IDS = [5929406140]
@@ -39,50 +126,99 @@ logging.getLogger("urllib3").setLevel(logging.WARNING)
 
 logger = logging.getLogger("AI_Mentor_Bot")
 
-# --- BIẾN CỜ (LOCKS) ---
-job_locks = {
-    "scheduler": False,
-    "scraper": False
-}
-
 # --- KHỞI TẠO ---
-if not TELEGRAM_BOT_TOKEN or not GEMINI_API_KEY:
-    logger.error("Lỗi: Thiếu API Key.")
-    exit()
-
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
 # 1. Database
+# [DAY 38] Đo thời gian mọi method public của CollectorV2 (aimentor_db_method_seconds)
+instrument_methods(CollectorV2)
+# [DAY 39] create_engine chưa mở kết nối nào; tạo bảng + tải content_db nằm trong warm_up_database()
 try:
-    db = CollectorV2(DATABASE_URL)
-    db.setup_database()
-    content_records = db.get_all_content()
-    logger.info(f"DB: Đã tải {len(content_records)} gợi ý từ cache.")
+    if DB_ASYNC:
+        from async_collector import AsyncCollector
+        db = AsyncCollector(DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                            pool_timeout=DB_POOL_TIMEOUT, statement_cache_size=DB_STATEMENT_CACHE_SIZE)
+    else:
+        db = CollectorV2(DATABASE_URL)
 except Exception as e:
     logger.error(f"LỖI KHỞI ĐỘNG DB: {e}", exc_info=True)
-    exit()
+    sys.exit(1)
+content_cache = ContentCache(
+    bm25_threshold=BM25_THRESHOLD,
+    vectors=VectorIndex() if SEMANTIC_SEARCH else None,
+    semantic_threshold=SEMANTIC_THRESHOLD
+)
+vote_aggregator = VoteAggregator(db, content_cache)
+db_ready = False  # True khi setup_database() đã chạy thành công
+warm_up_task = None
+snapshot_lock = asyncio.Lock()
 
 # 2. Retry Manager
 retry_mgr = RetryManager()
 
-# 3. Gemini AI
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    system_prompt = """
-    Bạn là AI Mentor, trợ lý học tập chuyên nghiệp.
-    1. Trả lời bằng tiếng Việt.
-    2. Giải thích ngắn gọn, dễ hiểu.
-    3. Nếu có code, hãy để trong block code.
-    4. Thân thiện và khuyến khích người học.
+# 2b. [DAY 23] Log Writer (khởi động/dừng cùng Application)
+log_writer = LogWriter(db)
+
+# 2c. [DAY 25] Cache câu trả lời Gemini
+answer_cache = AnswerCache(db=db if ANSWER_CACHE_PERSIST else None)
+
+# 2d. [DAY 26] Bộ điều phối lời gọi Gemini (RPM/TPM + hàng chờ có giới hạn)
+gemini_governor = GeminiGovernor(
+    rpm=GEMINI_RPM, tpm=GEMINI_TPM, max_concurrency=GEMINI_MAX_CONCURRENCY,
+    max_queue=GEMINI_MAX_QUEUE, max_wait=GEMINI_MAX_WAIT
+)
+
+# 2e. [DAY 33] Lịch sử hội thoại (RAM có giới hạn + bảng conversation_state)
+conversation_memory = ConversationMemory(
+    db=db, max_users=MEMORY_MAX_USERS, idle_seconds=MEMORY_IDLE_SECONDS, token_budget=HISTORY_TOKEN_BUDGET
+)
+
+# 2f. [DAY 34] Dọn log: lưu trữ tin nhắn/feedback ra file trước khi xóa
+log_retention = LogRetention(db, archive_dir=LOG_ARCHIVE_DIR, days_keep=LOG_RETENTION_DAYS)
+
+# 2g. [DAY 35] Bộ đếm theo giờ (+ đếm mọi log ERROR theo component)
+metrics = MetricsRollup(db)
+logging.getLogger().addHandler(metrics.error_handler())
+
+# 2h. [DAY 38] Endpoint /metrics (chạy cùng event loop của bot)
+metrics_server = MetricsServer(host=METRICS_HOST, port=METRICS_PORT) if METRICS_PORT else None
+
+# 2i. [DAY 41] Điều phối job giữa các replica (thay cho job_locks trong RAM của từng tiến trình)
+job_coordinator = JobCoordinator(db, ttl=JOB_LEASE_TTL)
+
+# 3. Gemini AI ([DAY 39] khởi tạo lười: get_gemini_model())
+system_prompt = """
+Bạn là AI Mentor, trợ lý học tập chuyên nghiệp.
+1. Trả lời bằng tiếng Việt.
+2. Giải thích ngắn gọn, dễ hiểu.
+3. Nếu có code, hãy để trong block code.
+4. Thân thiện và khuyến khích người học.
+"""
+model_v3 = None
+_gemini_lock = threading.Lock()
+_gemini_tried = False
+
+
+def get_gemini_model():
     """
-    model_v3 = genai.GenerativeModel(
-        model_name="models/gemini-flash-latest",
-        system_instruction=system_prompt
-    )
-except Exception:
-    model_v3 = None
-    logger.warning("Gemini Error: Fallback Mode.")
+    Import + cấu hình google.generativeai ở lần dùng đầu (Day 39), chạy trong thread (asyncio.to_thread).
+    Lỗi cấu hình -> None (Fallback Mode) như trước, không thử lại.
+    """
+    global model_v3, _gemini_tried
+    with _gemini_lock:
+        if model_v3 is None and not _gemini_tried:
+            _gemini_tried = True
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+                model_v3 = genai.GenerativeModel(
+                    model_name="models/gemini-flash-latest",
+                    system_instruction=system_prompt
+                )
+            except Exception:
+                logger.warning("Gemini Error: Fallback Mode.")
+    return model_v3
 
 
 # ==============================================================================
@@ -99,17 +235,85 @@ async def send_message_safe(bot, chat_id, text, parse_mode=None):
         return False
 
 
+async def refresh_content_cache():
+    """Chỉ kéo các dòng content_db thay đổi kể từ lần trước (Day 22)"""
+    # Truy vấn DB chạy ngoài event loop (thread hoặc db-loop), phần áp dụng vào cache chạy trên event loop (không tranh chấp với handler)
+    changes, watermark = await run_db(db.get_content_changes, content_cache.watermark)
+    applied = content_cache.apply_changes(changes, watermark, score_offsets=vote_aggregator.unflushed())
+    if content_cache.bm25_dirty:
+        # [DAY 31] Dựng lại BM25 ngoài event loop, xong mới thay index cũ
+        await asyncio.to_thread(content_cache.rebuild_bm25, list(content_cache.records.values()))
+    if applied:
+        logger.info(f"CACHE: Cập nhật {applied} gợi ý (tổng {len(content_cache)}).")
+        await save_content_snapshot()
+        await sync_vector_index()
+    return applied
+
+
+async def save_content_snapshot():
+    """[DAY 39] Ghi snapshot cache gợi ý cho lần khởi động sau (serialize + nén trong thread)"""
+    if not CONTENT_SNAPSHOT_PATH:
+        return
+    async with snapshot_lock:
+        try:
+            records, watermark = list(content_cache.records.values()), content_cache.watermark
+            await asyncio.to_thread(content_cache.save_snapshot, CONTENT_SNAPSHOT_PATH, records, watermark)
+        except Exception as e:
+            logger.error(f"Lỗi ghi snapshot cache: {e}")
+
+
+async def warm_up_database():
+    """
+    [DAY 39] Tạo/kiểm tra bảng rồi đồng bộ cache gợi ý với DB: chỉ kéo phần thay đổi kể từ mốc của snapshot,
+    chưa có snapshot thì tải toàn bộ. DB chưa kết nối được -> thử lại (backoff), bot vẫn trả lời bằng cache đang có.
+    """
+    global db_ready
+    if content_cache.bm25_dirty:
+        # Snapshot chỉ dựng automaton từ khóa, BM25 dựng ở đây (trong thread) trước khi chờ DB
+        await asyncio.to_thread(content_cache.rebuild_bm25, list(content_cache.records.values()))
+    delay = 5
+    while not await run_db(db.setup_database):
+        logger.warning(f"DB: Chưa sẵn sàng, thử lại sau {delay}s (cache hiện có {len(content_cache)} gợi ý).")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 300)
+    db_ready = True
+
+    if content_cache.watermark is None:
+        # Dựng automaton + BM25 trong thread, load() thay cả bộ index cùng lúc
+        records, watermark = await run_db(db.get_content_changes, None)
+        await asyncio.to_thread(content_cache.load, records, watermark)
+        logger.info(f"DB: Đã tải {len(content_cache)} gợi ý từ DB.")
+        await save_content_snapshot()
+        await sync_vector_index()
+    elif not await refresh_content_cache():
+        # [DAY 32] Bổ sung vector còn thiếu (index build offline đã cũ, hoặc chưa build)
+        await sync_vector_index()
+
+
+async def sync_vector_index():
+    """[DAY 32] Ghi nối vector cho các gợi ý mới / đổi text (encode + I/O chạy trong thread)"""
+    if content_cache.vectors is None:
+        return 0
+    try:
+        added = await asyncio.to_thread(content_cache.sync_vectors, list(content_cache.records.values()))
+        if added:
+            logger.info(f"VECTOR: Đã thêm {added} vector (tổng {len(content_cache.vectors)}).")
+        return added
+    except Exception as e:
+        logger.error(f"Lỗi cập nhật index vector: {e}")
+        return 0
+
+
+def count_outcome(outcome):
+    """Ghi nhận cách trả lời 1 tin nhắn: bảng rollup theo giờ (Day 35) + counter Prometheus (Day 38)"""
+    metrics.incr(outcome)
+    MESSAGES_TOTAL.inc(outcome=outcome)
+
+
 def get_suggestion_engine(message_text: str) -> tuple:
-    lower_message = message_text.lower()
-    found_suggestions = []
-    for record in content_records:
-        keyword = str(record.get('Keyword', '')).lower()
-        if keyword and keyword in lower_message:
-            found_suggestions.append(record)
-    if not found_suggestions: return None, None, None
-    found_suggestions.sort(key=lambda x: x.get('Rating_Score', 0), reverse=True)
-    best = found_suggestions[0]
-    return (best.get('Suggestion_Text'), best.get('Suggestion_Link'), best.get('Suggestion_ID'))
+    best = content_cache.search(message_text)
+    if not best: return None, None, None
+    return (best.get('suggestion_text'), best.get('suggestion_link'), best.get('suggestion_id'))
 
 
 def get_ai_feedback_v1_0(message_text: str) -> str:
@@ -117,15 +321,48 @@ def get_ai_feedback_v1_0(message_text: str) -> str:
     return "Cảm ơn bạn đã chia sẻ. Mình đã ghi nhận thông tin này."
 
 
-async def get_gemini_feedback_v3(message_text: str, history: list) -> str:
-    if not model_v3: raise Exception("Gemini chưa sẵn sàng.")
+async def get_gemini_feedback_v3(message_text: str, history: list, stream_reply=None) -> str:
+    """
+    Gọi Gemini (có cache + rate limit).
+    [DAY 27] Truyền stream_reply (ProgressiveReply) để nhận câu trả lời theo từng đoạn.
+    """
+    # [DAY 25] Câu hỏi lặp lại -> trả lời từ cache, không tốn quota
+    cache_context = history[:-1] if history and history[-1].get("content") == message_text else history
+    cached = await answer_cache.lookup(message_text, cache_context)
+    if cached is not None:
+        logger.info("-> Cache hit (Gemini)")
+        metrics.incr("gemini_cache_hit")
+        return cached
+
+    model = model_v3 or await asyncio.to_thread(get_gemini_model)
+    if not model: raise Exception("Gemini chưa sẵn sàng.")
     gemini_history = []
     for msg in history:
         role = "user" if msg["role"] == "user" else "model"
         gemini_history.append({"role": role, "parts": [msg["content"]]})
-    chat_session = model_v3.start_chat(history=gemini_history)
-    response = await chat_session.send_message_async(message_text)
-    return response.text
+    chat_session = model.start_chat(history=gemini_history)
+
+    # Ước lượng token = prompt + lịch sử + ~500 token trả lời
+    estimated = estimate_tokens(message_text) + sum(estimate_tokens(m["content"]) for m in history) + 500
+    if stream_reply:
+        # Gửi placeholder ngay, kể cả khi còn đang chờ lượt gọi
+        await stream_reply.start()
+    async with gemini_governor.slot(estimated):
+        try:
+            if stream_reply:
+                response = await chat_session.send_message_async(message_text, stream=True)
+                answer = ""
+                async for chunk in response:
+                    answer += chunk.text
+                    await stream_reply.update(answer)
+            else:
+                response = await chat_session.send_message_async(message_text)
+                answer = response.text
+        except ResourceExhausted:
+            gemini_governor.backoff(30)
+            raise
+    await answer_cache.store(message_text, cache_context, answer)
+    return answer
 
 
 # ==============================================================================
@@ -133,29 +370,51 @@ async def get_gemini_feedback_v3(message_text: str, history: list) -> str:
 # ==============================================================================
 
 # 1. Nhắc nhở học tập
+# [DAY 41] Job có tác dụng phụ (gửi tin, ghi DB) -> chỉ 1 replica chạy; trả về False = bỏ qua, chưa tính là đã chạy
+@job_coordinator.exclusive("scheduler", min_interval=20 * 3600)
+@timed(JOB_SECONDS, JOB_ERRORS, job="scheduler")
 async def smart_scheduler_job(context: ContextTypes.DEFAULT_TYPE):
-    if job_locks["scheduler"]: return
-    job_locks["scheduler"] = True
+    if not db_ready: return False
     try:
         current_hour = datetime.datetime.now().hour
-        if current_hour < 8 or current_hour > 21: return
+        if current_hour < 8 or current_hour > 21: return False
 
         logger.info("SCHEDULER: Quét người dùng...")
-        inactive_users = db.get_inactive_users(days_inactive=3)
+        inactive_users = await run_db(db.get_inactive_users, days_inactive=3)
         if inactive_users:
-            count = 0
             msg = "Chào bạn, đã lâu không thấy bạn tương tác. Tiếp tục học nhé! 🚀"
-            for user in inactive_users:
-                if await send_message_safe(context.bot, user['user_id'], msg):
-                    count += 1
-            logger.info(f"SCHEDULER: Đã nhắc nhở {count} người.")
+            # [DAY 29] Gửi song song qua BroadcastEngine (rate limit của Telegram)
+            # [DAY 28] Đánh dấu đã nhắc trong DB theo từng lô: gồm cả user chặn bot và tin lỗi (đã giao RetryManager),
+            # nên crash giữa chừng / replica khác nhận job / ngày mai đều không nhắc lại cùng người
+            async def mark_progress(results):
+                if not await run_db(db.mark_reminded, [chat_id for chat_id, _ in results]):
+                    # Không ghi nhận được -> dừng gửi, tránh lần chạy sau nhắc trùng cả loạt
+                    raise RuntimeError("mark_reminded thất bại")
+                # [DAY 41] Mất lease -> dừng trước lô kế tiếp, replica khác sẽ nhắc phần còn lại
+                job_coordinator.assert_owner("scheduler")
+
+            engine = BroadcastEngine(
+                context.bot,
+                on_failure=lambda chat_id, text, error: retry_mgr.add_message(chat_id, text, reason=error),
+                on_progress=mark_progress
+            )
+            job_id = f"reminder-{datetime.date.today().isoformat()}"
+            stats = await engine.run(job_id, [user['user_id'] for user in inactive_users], msg)
+
+            summary = (f"Nhắc {stats['sent']}/{stats['total']} (chặn bot {stats['blocked']}, lỗi {stats['failed']}, "
+                       f"flood-wait {stats['retry_after']}) "
+                       f"trong {stats['duration']}s - {stats['throughput']} tin/s")
+            log_writer.log_health("Broadcast", "OK" if not stats['failed'] else "WARNING", summary)
+            logger.info(f"SCHEDULER: {summary}")
+    except LeaseLost:
+        raise
     except Exception as e:
         logger.error(f"Lỗi Scheduler: {e}")
-    finally:
-        job_locks["scheduler"] = False
+        return False  # [DAY 41] Không tính là đã chạy -> lượt sau (replica nào cũng được) chạy lại
 
 
 # 2. Retry Job
+@timed(JOB_SECONDS, JOB_ERRORS, job="retry")
 async def retry_job(context: ContextTypes.DEFAULT_TYPE):
     messages = retry_mgr.pop_batch(limit=5)
     if messages:
@@ -163,68 +422,148 @@ async def retry_job(context: ContextTypes.DEFAULT_TYPE):
         for item in messages:
             try:
                 await context.bot.send_message(chat_id=item['chat_id'], text=item['text'], parse_mode="Markdown")
+                retry_mgr.ack(item['id'])
                 logger.info(f"RETRY: Thành công cho {item['chat_id']}")
             except Exception as e:
-                logger.error(f"RETRY Fail: {e}")
+                # Không ack -> tin sẽ quay lại hàng đợi khi hết lease
+                logger.error(f"RETRY Fail (lần {item['attempts']}): {e}")
 
 
 # 3. [DAY 21] Auto Feed Scraper (ĐA NGUỒN)
+@job_coordinator.exclusive("scraper", min_interval=5 * 3600)
+@timed(JOB_SECONDS, JOB_ERRORS, job="auto_feed")
 async def auto_feed_job(context: ContextTypes.DEFAULT_TYPE):
-    if job_locks["scraper"]:
-        logger.warning("SCRAPER: Job trước chưa xong. Bỏ qua.")
-        return
-
-    job_locks["scraper"] = True
+    if not db_ready:
+        return False
     try:
         logger.info("SCRAPER: Bắt đầu quét dữ liệu đa nguồn (10 Web)...")
 
-        # Gọi hàm cào đa nguồn từ scrapers.py
-        items = scrape_all_sources()
+        # Gọi hàm cào đa nguồn từ scrapers.py (song song, không chặn handler)
+        # [DAY 24] Validator (ETag / hash) chỉ được lưu sau khi import thành công -> lỗi thì lượt sau quét lại
+        scraper_cache = ResponseCache()
+        items = await scrape_all_sources_async(cache=scraper_cache)
 
         if items:
-            count = db.import_content_batch(items)
+            job_coordinator.assert_owner("scraper")
+            count = await run_db(db.import_content_batch, items)
+            if count is None:
+                log_writer.log_health("Scraper", "ERROR", f"Import {len(items)} bài thất bại, lượt sau quét lại.")
+                return False
+            scraper_cache.commit()
+            await asyncio.to_thread(scraper_cache.save)
             msg = f"📥 Đã quét xong. Tìm thấy {len(items)} bài, lưu mới {count} bài."
             logger.info(msg)
-            db.log_health("Scraper", "OK", msg)
+            log_writer.log_health("Scraper", "OK", msg)
 
-            # Reload cache
-            global content_records
-            content_records = db.get_all_content()
+            # Chỉ cập nhật các dòng mới vào cache
+            await refresh_content_cache()
         else:
-            db.log_health("Scraper", "WARNING", "Không tìm thấy dữ liệu nào.")
+            scraper_cache.commit()
+            await asyncio.to_thread(scraper_cache.save)
+            log_writer.log_health("Scraper", "WARNING", "Không tìm thấy dữ liệu nào.")
 
+    except LeaseLost:
+        raise
     except Exception as e:
         logger.error(f"Lỗi Scraper: {e}")
-        db.log_health("Scraper", "ERROR", str(e))
-    finally:
-        job_locks["scraper"] = False
+        log_writer.log_health("Scraper", "ERROR", str(e))
+        return False
 
 
 # 4. Alive Check
+@timed(JOB_SECONDS, JOB_ERRORS, job="alive_check")
 async def alive_check_job(context: ContextTypes.DEFAULT_TYPE):
-    db.log_health("System", "ALIVE", "Bot Running")
+    log_writer.log_health("System", "ALIVE", "Bot Running")
+
+
+# 4a. [DAY 30] Ghi điểm vote tích lũy xuống DB
+@timed(JOB_SECONDS, JOB_ERRORS, job="vote_flush")
+async def vote_flush_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await vote_aggregator.flush()
+    except Exception as e:
+        logger.error(f"Lỗi Vote Flush: {e}")
+
+
+# 4b. [DAY 22] Đồng bộ cache gợi ý (điểm đánh giá, bài mới từ replica khác...)
+@timed(JOB_SECONDS, JOB_ERRORS, job="cache_refresh")
+async def cache_refresh_job(context: ContextTypes.DEFAULT_TYPE):
+    # [DAY 39] Lần đồng bộ đầu tiên do warm_up_database() làm
+    if not db_ready:
+        return
+    try:
+        await refresh_content_cache()
+    except Exception as e:
+        logger.error(f"Lỗi Cache Refresh: {e}")
+
+
+# 4c. [DAY 33] Đẩy lịch sử hội thoại của user rảnh lâu xuống DB
+@timed(JOB_SECONDS, JOB_ERRORS, job="memory_evict")
+async def memory_evict_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        evicted = await conversation_memory.evict_idle()
+        if evicted:
+            logger.info(f"MEMORY: Giải phóng {evicted} user rảnh (còn {len(conversation_memory)} trong RAM).")
+    except Exception as e:
+        logger.error(f"Lỗi Memory Evict: {e}")
+
+
+# 4d. [DAY 35] Ghi bộ đếm theo giờ
+@timed(JOB_SECONDS, JOB_ERRORS, job="metrics_flush")
+async def metrics_flush_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await metrics.flush()
+    except Exception as e:
+        logger.error(f"Lỗi Metrics Flush: {e}")
 
 
 # 5. Báo cáo Admin
+@job_coordinator.exclusive("daily_report", min_interval=20 * 3600)
+@timed(JOB_SECONDS, JOB_ERRORS, job="daily_report")
 async def daily_report_job(context: ContextTypes.DEFAULT_TYPE):
     logger.info("REPORT: Tạo báo cáo...")
-    errors = db.get_recent_errors(hours=24)
-    total_content = len(content_records) if 'content_records' in globals() else 0
+    # [DAY 35] Đọc bảng rollup theo giờ (+ phần chưa flush) thay vì quét bảng log
+    totals = await run_db(db.get_metric_totals, 24)
+    for metric, n in metrics.snapshot().items():
+        totals[metric] = totals.get(metric, 0) + n
+    errors = {metric.split(":", 1)[1]: n for metric, n in totals.items() if metric.startswith("error:")}
+    total_content = len(content_cache) if 'content_cache' in globals() else 0
 
     report = f"📊 **BÁO CÁO NGÀY** ({datetime.datetime.now().strftime('%d/%m')})\n"
     report += f"- Tổng bài học (DB): {total_content}\n"
+    report += (f"- Tin nhắn: {totals.get('messages', 0)} (gợi ý DB {totals.get('db_suggestion', 0)}, "
+               f"Gemini {totals.get('gemini', 0)}, bận {totals.get('busy', 0)}, dự phòng {totals.get('fallback', 0)})\n")
+    report += f"- Đánh giá: 👍 {totals.get('feedback_good', 0)} / 👎 {totals.get('feedback_bad', 0)}\n"
+    cache_stats = answer_cache.stats
+    report += (f"- Cache Gemini: {cache_stats['hits'] + cache_stats['db_hits']} hit / "
+               f"{cache_stats['misses']} miss ({len(answer_cache)} mục trong RAM)\n")
+    gov = gemini_governor.metrics()
+    report += (f"- Gemini: {gov['granted']} lượt, từ chối {gov['rejected']}, quá hạn {gov['timeouts']}, "
+               f"chờ TB {gov['avg_wait']:.2f}s (p95 {gov['p95_wait']:.2f}s)\n")
     if not errors:
         report += "✅ Hệ thống ổn định."
     else:
-        report += f"⚠️ Có {len(errors)} lỗi trong 24h qua."
+        detail = ", ".join(f"{name}: {n}" for name, n in sorted(errors.items(), key=lambda item: -item[1]))
+        report += f"⚠️ Có {sum(errors.values())} lỗi trong 24h qua ({detail})."
 
+    job_coordinator.assert_owner("daily_report")
     for admin_id in ADMIN_IDS:
         await send_message_safe(context.bot, admin_id, report, parse_mode="Markdown")
 
 
 # 6. Dọn dẹp
+@job_coordinator.exclusive("maintenance", min_interval=6 * 86400)
+@timed(JOB_SECONDS, JOB_ERRORS, job="maintenance")
 async def maintenance_job(context: ContextTypes.DEFAULT_TYPE):
-    count = db.clean_old_logs(days_keep=30)
+    if not db_ready:
+        return False
+    # [DAY 34] Xóa theo lô trong thread, không chặn handler; mất lease thì dừng ở lô kế tiếp (Day 41)
+    counts = await asyncio.to_thread(log_retention.run, lambda: job_coordinator.still_owner("maintenance"))
+    job_coordinator.assert_owner("maintenance")
+    count = sum(counts.values())
+    await run_db(db.purge_conversations, days_keep=30)
+    if ANSWER_CACHE_PERSIST:
+        await run_db(db.purge_answer_cache, max_age_seconds=answer_cache.ttl_seconds)
     if count > 0:
         msg = f"🧹 Đã dọn dẹp {count} dòng log cũ."
         for admin_id in ADMIN_IDS:
@@ -235,6 +574,7 @@ async def maintenance_job(context: ContextTypes.DEFAULT_TYPE):
 # HANDLERS & MAIN
 # ==============================================================================
 
+@timed(HANDLER_STAGE_SECONDS, stage="handle_message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
     user_id = message.from_user.id
@@ -242,43 +582,64 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_text = message.text
 
     logger.info(f"Msg from [{username}]: {message_text}")
-    history = context.user_data.setdefault('history', [])
-    history.append({"role": "user", "content": message_text})
-
-    sugg_text, sugg_link, sugg_id = get_suggestion_engine(message_text)
+    metrics.incr("messages")
+    # [DAY 33] Ngữ cảnh = các lượt trước, cắt theo ngân sách token (chừa chỗ cho câu hỏi hiện tại)
+    with HANDLER_STAGE_SECONDS.time(stage="history_load"):
+        await conversation_memory.load(user_id)
+        history = conversation_memory.window(user_id, reserve_tokens=estimate_tokens(message_text))
+
+    with HANDLER_STAGE_SECONDS.time(stage="suggestion_lookup"):
+        sugg_text, sugg_link, sugg_id = get_suggestion_engine(message_text)
     final_feedback = ""
     callback_type = "std"
     callback_id = ""
+    stream_reply = ProgressiveReply(message) if GEMINI_STREAMING else None
 
     if sugg_id:
         final_feedback = f"Gợi ý từ DB:\n\n💡 **{sugg_text}**\n{sugg_link}"
         callback_type = "sugg"
         callback_id = sugg_id
+        count_outcome("db_suggestion")
         logger.info(f"-> DB Suggestion: {sugg_id}")
     else:
         try:
-            final_feedback = await get_gemini_feedback_v3(message_text, history[-10:])
+            with HANDLER_STAGE_SECONDS.time(stage="gemini"):
+                final_feedback = await get_gemini_feedback_v3(message_text, history, stream_reply=stream_reply)
+            count_outcome("gemini")
             logger.info("-> Gemini Answer")
+        except (QueueFullError, RateLimitTimeout) as e:
+            # [DAY 26] Quá tải -> báo bận ngay, không chờ Google trả 429
+            logger.warning(f"Gemini quá tải: {e}")
+            final_feedback = "⏳ Hiện có nhiều bạn hỏi cùng lúc, bạn thử lại sau ít phút nhé!"
+            count_outcome("busy")
+            logger.info("-> Busy Answer")
         except Exception as e:
             logger.error(f"Gemini Error: {e}")
-            final_feedback = get_ai_feedback_v1_0(message_text)
+            with HANDLER_STAGE_SECONDS.time(stage="fallback"):
+                final_feedback = get_ai_feedback_v1_0(message_text)
+            count_outcome("fallback")
             logger.info("-> Fallback Answer")
 
-    history.append({"role": "ai", "content": final_feedback})
-    context.user_data['history'] = history[-20:]
+    conversation_memory.append(user_id, "user", message_text)
+    conversation_memory.append(user_id, "ai", final_feedback)
 
-    try:
-        db.log_message(user_id, username, message_text, final_feedback)
-    except Exception:
-        pass
+    # [DAY 23] Chỉ đẩy vào hàng đợi, LogWriter sẽ ghi theo batch (thời gian ghi DB thật: bulk_insert_logs)
+    with HANDLER_STAGE_SECONDS.time(stage="log_enqueue"):
+        log_writer.log_message(user_id, username, message_text, final_feedback)
 
     keyboard = [[
         InlineKeyboardButton("👍 Hữu ích", callback_data=f"fb_{callback_type}_{callback_id}_good"),
         InlineKeyboardButton("👎 Không hữu ích", callback_data=f"fb_{callback_type}_{callback_id}_bad"),
     ]]
-    await message.reply_text(final_feedback, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+    with HANDLER_STAGE_SECONDS.time(stage="telegram_reply"):
+        if stream_reply:
+            # Edit lần cuối (gắn bàn phím feedback), hoặc gửi mới nếu chưa có placeholder
+            await stream_reply.finish(final_feedback, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+        else:
+            await message.reply_text(final_feedback, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
 
 
+@timed(HANDLER_STAGE_SECONDS, stage="button_click")
 async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -292,15 +653,11 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if feedback_type == "sugg":
         sugg_id_logged = "_".join(parts[2:])
-        try:
-            db.update_suggestion_score(sugg_id_logged, rating)
-        except:
-            pass
+        # [DAY 30] Cập nhật ranking trong RAM ngay, vote_flush_job ghi xuống DB theo batch
+        vote_aggregator.add_vote(sugg_id_logged, rating)
 
-    try:
-        db.log_feedback(user_id, ai_text, rating, sugg_id_logged)
-    except:
-        pass
+    log_writer.log_feedback(user_id, ai_text, rating, sugg_id_logged)
+    metrics.incr(f"feedback_{rating}")
 
     await query.edit_message_text(text=f"{ai_text}\n\n[Cảm ơn bạn đã đánh giá!]")
 
@@ -309,31 +666,134 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Chào bạn! AI Mentor v3.3 (Multi-Source) sẵn sàng!")
 
 
-def main():
-    logger.info("--- KHỞI ĐỘNG AI MENTOR BOT v3.3 (Day 21) ---")
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-
-    jq = application.job_queue
-    # Đặt lịch (Giây)
-    # 1. Nhắc nhở: 24h
-    jq.run_repeating(smart_scheduler_job, interval=86400, first=10)
-    # 2. Retry: 5 phút
-    jq.run_repeating(retry_job, interval=300, first=15)
-    # 3. Alive Check: 1h
-    jq.run_repeating(alive_check_job, interval=3600, first=20)
-    # 4. [DAY 21] Auto Feed (6h) - first=30s để test ngay khi khởi động
-    jq.run_repeating(auto_feed_job, interval=21600, first=30)
-    # 5. Báo cáo: 24h
-    jq.run_repeating(daily_report_job, interval=86400, first=60)
-    # 6. Dọn dẹp: 1 tuần
-    jq.run_repeating(maintenance_job, interval=604800, first=120)
+async def on_startup(application: Application):
+    global warm_up_task
+    await log_writer.start()
+    if metrics_server:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.error(f"METRICS: Không mở được cổng {METRICS_PORT}: {e}")
+    if STARTUP_MODE == "blocking":
+        await warm_up_database()
+    else:
+        # [DAY 39] Snapshot là file cục bộ (không chạm DB) -> trả lời gợi ý được ngay từ tin nhắn đầu
+        loaded = await asyncio.to_thread(content_cache.load_snapshot, CONTENT_SNAPSHOT_PATH)
+        logger.info(f"CACHE: Đã nạp {loaded} gợi ý từ snapshot, đồng bộ với DB ở nền.")
+        warm_up_task = asyncio.create_task(warm_up_database())
+    # Import + cấu hình Gemini ở nền, tin nhắn đầu tiên cần Gemini không phải chờ
+    asyncio.create_task(asyncio.to_thread(get_gemini_model))
+
+
+async def on_shutdown(application: Application):
+    if warm_up_task and not warm_up_task.done():
+        warm_up_task.cancel()
+    # Flush nốt các log / vote còn trong hàng đợi trước khi thoát
+    await vote_aggregator.flush()
+    await conversation_memory.flush_all()
+    await metrics.flush()
+    await log_writer.stop()
+    if metrics_server:
+        await metrics_server.stop()
+    if DB_ASYNC:
+        await asyncio.to_thread(db.close)
+
+
+def build_application(token=None, request=None, with_jobs=True, concurrent_updates=None):
+    """
+    Dựng Application với đầy đủ handler (+ job nếu with_jobs) nhưng chưa chạy (Day 37).
+    `request`: BaseRequest thay thế (ví dụ Bot API giả của load_test.py).
+    `concurrent_updates`: số update xử lý song song (1 = tuần tự như mặc định của python-telegram-bot).
+    """
+    builder = (
+        Application.builder()
+        .token(token or TELEGRAM_BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(concurrent_updates or CONCURRENT_UPDATES)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+
+    if with_jobs:
+        jq = application.job_queue
+        # Đặt lịch (Giây)
+        # 1. Nhắc nhở: 24h
+        jq.run_repeating(smart_scheduler_job, interval=86400, first=10)
+        # 2. Retry: 5 phút
+        jq.run_repeating(retry_job, interval=300, first=15)
+        # 3. Alive Check: 1h
+        jq.run_repeating(alive_check_job, interval=3600, first=20)
+        # 4. [DAY 21] Auto Feed (6h) - first=30s để test ngay khi khởi động
+        jq.run_repeating(auto_feed_job, interval=21600, first=30)
+        # 5. Báo cáo: 24h
+        jq.run_repeating(daily_report_job, interval=86400, first=60)
+        # 6. Dọn dẹp: 1 tuần
+        jq.run_repeating(maintenance_job, interval=604800, first=120)
+        # 7. [DAY 22] Delta refresh cache gợi ý: 5 phút
+        jq.run_repeating(cache_refresh_job, interval=300, first=45)
+        # 8. [DAY 30] Ghi điểm vote: 10 giây
+        jq.run_repeating(vote_flush_job, interval=10, first=10)
+        # 9. [DAY 33] Giải phóng lịch sử hội thoại của user rảnh: 5 phút
+        jq.run_repeating(memory_evict_job, interval=300, first=300)
+        # 10. [DAY 35] Ghi bộ đếm theo giờ: 1 phút
+        jq.run_repeating(metrics_flush_job, interval=60, first=60)
 
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CallbackQueryHandler(button_click, pattern="^fb_"))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
 
-    logger.info("Bot đang chạy...")
-    application.run_polling()
+
+async def run_webhook(application, server=None):
+    """
+    [DAY 40] Vòng đời Application khi nhận update qua webhook (thay cho run_polling): WebhookServer đẩy update
+    vào application.update_queue, Application.start() lấy ra chạy handler như khi polling. Dừng bằng SIGINT/SIGTERM.
+    """
+    server = server or WebhookServer(application, secret_token=WEBHOOK_SECRET, path=WEBHOOK_PATH,
+                                     host=WEBHOOK_HOST, port=WEBHOOK_PORT, max_pending=WEBHOOK_MAX_PENDING)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    try:
+        await on_startup(application)
+        await application.start()
+        await server.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES, max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+            logger.info(f"WEBHOOK: Đã đăng ký {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH} với Telegram.")
+        await stop_event.wait()
+    finally:
+        # Ngừng nhận trước, xử lý nốt update đã nhận rồi mới flush log / vote
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await on_shutdown(application)
+        await application.shutdown()
+
+
+def main():
+    if not TELEGRAM_BOT_TOKEN or not GEMINI_API_KEY:
+        logger.error("Lỗi: Thiếu API Key.")
+        sys.exit(1)
+    if BOT_MODE == "webhook" and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET or ""):
+        logger.error("Lỗi: BOT_MODE=webhook cần WEBHOOK_SECRET (1-256 ký tự A-Z a-z 0-9 _ -).")
+        sys.exit(1)
+    logger.info("--- KHỞI ĐỘNG AI MENTOR BOT v3.3 (Day 21) ---")
+    application = build_application()
+    if BOT_MODE == "webhook":
+        logger.info(f"Bot đang chạy (webhook, cổng {WEBHOOK_PORT})...")
+        asyncio.run(run_webhook(application))
+    else:
+        logger.info("Bot đang chạy...")
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+# broadcast.py
+# [DAY 29] Gửi tin hàng loạt: song song có giới hạn, tôn trọng rate limit của Telegram, chạy tiếp được sau khi restart
+
+import asyncio
+import logging
+import time
+
+from telegram.error import Forbidden, RetryAfter, BadRequest
+
+from rate_limiter import TokenBucket
+from streaming_reply import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastEngine:
+    """
+    Gửi 1 nội dung tới nhiều chat.
+    - Bucket toàn cục (~30 tin/giây của Telegram, để dư một chút) + bucket riêng từng chat (1 tin/giây).
+    - `concurrency` worker gửi song song.
+    - Gặp RetryAfter: tạm dừng toàn bộ đúng số giây Telegram yêu cầu rồi gửi lại chat đó.
+    - Tiến độ báo về `on_progress` theo lô `progress_batch` chat đã xử lý (gửi được, bị chặn hoặc đã giao cho
+      `on_failure`); người gọi ghi nhận trong DB -> crash / restart / replica khác nhận job không gửi lại các chat đó.
+      on_progress raise thì dừng gửi.
+    """
+
+    def __init__(self, bot, global_rate=25, per_chat_rate=1.0, concurrency=20, max_attempts=3,
+                 progress_batch=100, on_failure=None, on_progress=None):
+        self.bot = bot
+        self.global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.progress_batch = progress_batch
+        self.on_failure = on_failure  # callback(chat_id, text, error) cho lỗi tạm thời (ví dụ: đẩy vào RetryManager)
+        self.on_progress = on_progress  # async callback([(chat_id, status), ...])
+        self._chat_buckets = {}
+        self._bucket_lock = asyncio.Lock()
+        self._progress_lock = asyncio.Lock()
+        self._paused_until = 0.0
+
+    async def _report(self, results):
+        if self.on_progress and results:
+            async with self._progress_lock:
+                await self.on_progress(results)
+
+    # --- GỬI ---
+    async def _wait_turn(self, chat_id):
+        async with self._bucket_lock:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.global_bucket.acquire(1)
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate=self.per_chat_rate, capacity=1)
+        await bucket.acquire(1)
+
+    async def _send_one(self, chat_id, text, parse_mode, stats):
+        last_error = None
+        for attempt in range(1, self.max_attempts + 1):
+            await self._wait_turn(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                return "sent"
+            except RetryAfter as e:
+                last_error = e
+                wait = retry_after_seconds(e)
+                stats["retry_after"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + wait)
+                logger.warning(f"BROADCAST: Bị flood limit, tạm dừng {wait}s.")
+            except (Forbidden, BadRequest) as e:
+                # User chặn bot / chat không tồn tại -> gửi lại cũng vô ích
+                logger.info(f"BROADCAST: Bỏ qua {chat_id}: {e}")
+                return "blocked"
+            except Exception as e:
+                last_error = e
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(attempt)
+
+        logger.error(f"BROADCAST: Gửi thất bại cho {chat_id}: {last_error}")
+        if self.on_failure:
+            self.on_failure(chat_id, text, last_error)
+        return "failed"
+
+    async def run(self, job_id, chat_ids, text, parse_mode=None):
+        """Gửi `text` tới toàn bộ `chat_ids`, trả về thống kê"""
+        started = time.monotonic()
+        stats = {"job_id": job_id, "total": len(chat_ids), "sent": 0, "blocked": 0, "failed": 0, "retry_after": 0}
+        queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+        processed = []
+
+        async def worker():
+            nonlocal processed
+            while True:
+                try:
+                    chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                status = await self._send_one(chat_id, text, parse_mode, stats)
+                stats[status] += 1
+                processed.append((chat_id, status))
+                if len(processed) >= self.progress_batch:
+                    batch, processed = processed, []
+                    await self._report(batch)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, queue.qsize()) or 1)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._chat_buckets.clear()
+            # Cả khi bị hủy / lỗi giữa chừng: các chat đã gửi xong vẫn được ghi nhận
+            try:
+                await self._report(processed)
+            except Exception as e:
+                logger.error(f"BROADCAST: Không ghi nhận được {len(processed)} chat cuối của job {job_id}: {e}")
+
+        duration = time.monotonic() - started
+        stats["duration"] = round(duration, 2)
+        stats["throughput"] = round(stats["sent"] / duration, 2) if duration > 0 else 0.0
+        return stats
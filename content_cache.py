@@ -0,0 +1,189 @@
+# content_cache.py
+# [DAY 22] Cache gợi ý trong RAM, cập nhật theo delta thay vì tải lại toàn bộ content_db
+
+import datetime
+import gzip
+import json
+import logging
+import os
+from keyword_index import KeywordIndex
+from bm25_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+# [DAY 39] Snapshot cục bộ: chỉ giữ các cột mà cache dùng, lưu theo cột (fields + rows) cho gọn
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FIELDS = ("suggestion_id", "keyword", "suggestion_text", "suggestion_link", "rating_score", "updated_at")
+
+
+class ContentCache:
+    """
+    Giữ bản sao content_db trong RAM (dict theo suggestion_id) cùng automaton từ khóa.
+    - load(): nạp toàn bộ (lúc khởi động).
+    - apply_changes(): chỉ áp dụng các dòng thêm/sửa/xóa lấy từ db.get_content_changes().
+    - save_snapshot() / load_snapshot(): file cục bộ để khởi động không cần chờ DB (Day 39).
+    """
+
+    def __init__(self, bm25_threshold=0.3, vectors=None, semantic_threshold=0.5):
+        self.records = {}
+        self.index = KeywordIndex()
+        self.bm25 = BM25Index([])
+        self.bm25_threshold = bm25_threshold
+        # [DAY 32] Index vector (VectorIndex) trên đĩa, None = tắt tìm kiếm ngữ nghĩa
+        self.vectors = vectors
+        self.semantic_threshold = semantic_threshold
+        self.bm25_dirty = False
+        self.watermark = None
+
+    def load(self, records, watermark=None, build_bm25=True):
+        """build_bm25=False: để BM25 rỗng + bm25_dirty, dựng sau bằng rebuild_bm25() (Day 39)"""
+        new_records = {rec['suggestion_id']: rec for rec in records}
+        new_index = KeywordIndex(new_records.values())
+        new_bm25 = BM25Index(new_records.values() if build_bm25 else [])
+        # Gán lại cùng lúc -> handler luôn thấy bộ (records, index, bm25) nhất quán
+        self.records, self.index, self.bm25, self.watermark = new_records, new_index, new_bm25, watermark
+        self.bm25_dirty = not build_bm25
+
+    def save_snapshot(self, path, records, watermark):
+        """
+        Ghi `records` (bản chụp list(records.values()) lấy trên event loop) ra file gzip JSON (Day 39).
+        Ghi file tạm rồi os.replace -> crash giữa chừng không làm hỏng snapshot cũ. Chạy trong thread.
+        """
+        payload = {
+            "version": SNAPSHOT_VERSION,
+            "watermark": watermark.isoformat() if watermark else None,
+            "fields": SNAPSHOT_FIELDS,
+            "rows": [
+                [rec.get(field).isoformat() if isinstance(rec.get(field), datetime.datetime) else rec.get(field)
+                 for field in SNAPSHOT_FIELDS]
+                for rec in records
+            ],
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=1) as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        return len(records)
+
+    def load_snapshot(self, path):
+        """
+        Nạp cache từ snapshot (Day 39). Trả về số gợi ý đã nạp, 0 nếu chưa có / hỏng / khác phiên bản.
+        Mốc (watermark) lấy theo snapshot -> lần refresh sau chỉ kéo phần thay đổi kể từ lúc ghi snapshot.
+        Chỉ dựng automaton từ khóa; BM25 (chậm gấp đôi) để bm25_dirty, người gọi dựng lại ở nền.
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") != SNAPSHOT_VERSION:
+                logger.warning(f"CACHE: Snapshot {path} khác phiên bản, bỏ qua.")
+                return 0
+            fields = payload["fields"]
+            records = [dict(zip(fields, row)) for row in payload["rows"]]
+            for rec in records:
+                if rec.get("updated_at"):
+                    rec["updated_at"] = datetime.datetime.fromisoformat(rec["updated_at"])
+            watermark = payload.get("watermark")
+            self.load(records, datetime.datetime.fromisoformat(watermark) if watermark else None, build_bm25=False)
+            return len(records)
+        except Exception as e:
+            logger.error(f"CACHE: Lỗi đọc snapshot {path}: {e}")
+            return 0
+
+    def rebuild_bm25(self, records=None):
+        """
+        Dựng lại BM25 (Day 31). Có thể chạy trong thread: truyền vào `records` là bản chụp list(records.values())
+        lấy trên event loop, index mới chỉ được gán khi đã dựng xong.
+        """
+        self.bm25_dirty = False
+        new_bm25 = BM25Index(records if records is not None else list(self.records.values()))
+        self.bm25 = new_bm25
+
+    def sync_vectors(self, records):
+        """
+        Embed + ghi nối các gợi ý mới / đổi text vào index vector (Day 32). Chạy trong thread,
+        `records` là bản chụp list(records.values()) lấy trên event loop. Trả về số vector đã thêm.
+        """
+        if self.vectors is None:
+            return 0
+        return self.vectors.append(self.vectors.stale_records(records))
+
+    def apply_changes(self, changes, watermark=None, score_offsets=None):
+        """
+        Áp dụng delta, trả về số dòng đã thay đổi trong cache.
+        score_offsets: điểm vote còn nằm trong RAM chưa ghi xuống DB (Day 30), cộng bù vào dòng mới nhận.
+        """
+        need_rebuild = False
+        applied = 0
+        for rec in changes:
+            sugg_id = rec['suggestion_id']
+            if rec.get('is_deleted'):
+                if self.records.pop(sugg_id, None) is not None:
+                    self.index.remove(sugg_id)
+                    self.bm25_dirty = True
+                    applied += 1
+                continue
+
+            old = self.records.get(sugg_id)
+            if old is not None and old.get('updated_at') == rec.get('updated_at'):
+                continue  # Dòng đã áp dụng ở lần trước (truy vấn dùng >= mốc và đọc lùi thêm khoảng overlap)
+            if score_offsets and sugg_id in score_offsets:
+                rec['rating_score'] = (rec.get('rating_score') or 0) + score_offsets[sugg_id]
+            self.records[sugg_id] = rec
+            applied += 1
+            if old is None or (old.get('keyword'), old.get('suggestion_text')) != (rec.get('keyword'), rec.get('suggestion_text')):
+                self.bm25_dirty = True
+            else:
+                self.bm25.set_rating(sugg_id, rec.get('rating_score'))
+            # Từ khóa mới -> phải thêm nhánh vào automaton, gom lại dựng 1 lần ở cuối
+            if not need_rebuild and not self.index.upsert(rec):
+                need_rebuild = True
+
+        if need_rebuild:
+            self.index = KeywordIndex(self.records.values())
+        if watermark is not None:
+            self.watermark = watermark
+        return applied
+
+    def adjust_score(self, sugg_id, delta):
+        """Cộng điểm trực tiếp vào bản ghi trong RAM và cập nhật lại thứ hạng (Day 30)"""
+        rec = self.records.get(sugg_id)
+        if rec is None:
+            return False
+        rec['rating_score'] = (rec.get('rating_score') or 0) + delta
+        self.index.upsert(rec)
+        self.bm25.set_rating(sugg_id, rec['rating_score'])
+        return True
+
+    def search(self, message_text):
+        """
+        1. Từ khóa xuất hiện nguyên văn trong tin nhắn (automaton).
+        2. [DAY 31] Không có -> BM25 trên keyword + suggestion_text, chỉ nhận khi đủ tự tin.
+        3. [DAY 32] Vẫn không có -> tìm theo vector (câu hỏi diễn đạt khác), cosine >= semantic_threshold.
+        Trả về None -> để Gemini trả lời.
+        """
+        best = self.index.search(message_text)
+        if best is not None:
+            return best
+        record, confidence = self.bm25.search(message_text)
+        if record is not None and confidence >= self.bm25_threshold:
+            # Index có thể dựng từ bản chụp cũ -> lấy bản ghi mới nhất (và bỏ qua nếu đã bị xóa)
+            current = self.records.get(record['suggestion_id'])
+            if current is not None:
+                return current
+        if self.vectors is not None:
+            for sugg_id, score in self.vectors.search(message_text):
+                if score < self.semantic_threshold:
+                    break
+                # Top-k có thể chứa gợi ý đã xóa (vector không bị gỡ khỏi file) -> lấy kết quả kế tiếp
+                current = self.records.get(sugg_id)
+                if current is not None:
+                    return current
+        return None
+
+    def __len__(self):
+        return len(self.records)
@@ -0,0 +1,139 @@
+# conversation_memory.py
+# [DAY 33] Bộ nhớ hội thoại: ring buffer mỗi user trong RAM, user rảnh lâu bị đẩy xuống DB, ngữ cảnh cắt theo token
+
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+
+from db_collector import run_db
+from text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Lưu role dạng 1 ký tự cho gọn (mỗi lượt là tuple (role, text, tokens))
+_ROLE_CODES = {"user": "u", "ai": "a"}
+_ROLE_NAMES = {"u": "user", "a": "ai"}
+
+
+class ConversationMemory:
+    """
+    - RAM: OrderedDict user_id -> (deque tối đa `max_turns` lượt, lần truy cập cuối), sắp theo LRU.
+      Vượt `max_users` -> đẩy user lâu nhất xuống DB; evict_idle() đẩy user rảnh quá `idle_seconds`.
+    - DB (tùy chọn): bảng conversation_state, nạp lại khi user quay lại.
+    - window(): lấy các lượt mới nhất vừa đủ `token_budget` (ước lượng), thay cho cắt cố định N tin nhắn.
+    """
+
+    def __init__(self, db=None, max_users=5000, max_turns=20, idle_seconds=1800, token_budget=2000):
+        self.db = db
+        self.max_users = max_users
+        self.max_turns = max_turns
+        self.idle_seconds = idle_seconds
+        self.token_budget = token_budget
+        self._users = OrderedDict()  # user_id -> [deque, last_access, dirty]
+        self._evicting = {}          # user_id -> JSON đang ghi xuống DB (user quay lại giữa chừng vẫn đọc được)
+        self.stats = {"loads": 0, "evictions": 0}
+
+    # --- NẠP / ĐẨY XUỐNG DB ---
+    async def load(self, user_id):
+        """Đảm bảo lịch sử của user đã nằm trong RAM (đọc DB ở thread nếu cần)"""
+        if user_id in self._users:
+            return
+        raw = self._evicting.get(user_id)
+        if raw is None and self.db is not None:
+            raw = await run_db(self.db.load_conversation, user_id)
+            if user_id in self._users:
+                return  # Tin nhắn khác của cùng user đã nạp trong lúc chờ DB
+        turns = deque(maxlen=self.max_turns)
+        if raw:
+            try:
+                for role, content in json.loads(raw):
+                    turns.append((role, content, estimate_tokens(content)))
+                self.stats["loads"] += 1
+            except (ValueError, TypeError) as e:
+                logger.warning(f"MEMORY: Lịch sử của {user_id} bị hỏng, bỏ qua: {e}")
+        self._users[user_id] = [turns, time.monotonic(), False]
+        await self._evict_overflow()
+
+    async def _evict_overflow(self):
+        evicted = {}
+        while len(self._users) > self.max_users:
+            user_id, entry = self._users.popitem(last=False)
+            self.stats["evictions"] += 1
+            if entry[2]:
+                evicted[user_id] = self._serialize(entry[0])
+        await self._persist(evicted)
+
+    async def evict_idle(self):
+        """Đẩy các user không nhắn tin trong `idle_seconds` xuống DB, trả về số user đã giải phóng"""
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [user_id for user_id, entry in self._users.items() if entry[1] < cutoff]
+        self.stats["evictions"] += len(idle)
+        evicted = {}
+        for user_id in idle:
+            entry = self._users.pop(user_id)
+            if entry[2]:
+                evicted[user_id] = self._serialize(entry[0])
+        await self._persist(evicted)
+        return len(idle)
+
+    async def flush_all(self):
+        """Ghi toàn bộ lịch sử đã thay đổi xuống DB (lúc tắt bot), vẫn giữ trong RAM"""
+        dirty = {user_id: self._serialize(entry[0]) for user_id, entry in self._users.items() if entry[2]}
+        for entry in self._users.values():
+            entry[2] = False
+        await self._persist(dirty)
+
+    async def _persist(self, histories):
+        if not histories or self.db is None:
+            return
+        self._evicting.update(histories)
+        try:
+            await run_db(self.db.save_conversations, histories)
+        except Exception as e:
+            logger.error(f"MEMORY: Lỗi lưu lịch sử xuống DB: {e}")
+        finally:
+            for user_id, raw in histories.items():
+                if self._evicting.get(user_id) is raw:
+                    del self._evicting[user_id]
+
+    @staticmethod
+    def _serialize(turns):
+        return json.dumps([(role, content) for role, content, _ in turns], ensure_ascii=False)
+
+    # --- ĐỌC / GHI LƯỢT HỘI THOẠI ---
+    def append(self, user_id, role, content):
+        entry = self._users.get(user_id)
+        if entry is None:
+            # Chưa load() (ví dụ gọi từ nơi khác) -> bắt đầu lịch sử mới
+            entry = self._users[user_id] = [deque(maxlen=self.max_turns), 0.0, False]
+        entry[0].append((_ROLE_CODES.get(role, role), content, estimate_tokens(content)))
+        entry[1] = time.monotonic()
+        entry[2] = True
+        self._users.move_to_end(user_id)
+
+    def window(self, user_id, reserve_tokens=0, token_budget=None):
+        """
+        Các lượt gần nhất (cũ -> mới) dạng [{"role", "content"}] sao cho tổng token ước lượng
+        + `reserve_tokens` (câu hỏi hiện tại) không vượt `token_budget`.
+        """
+        entry = self._users.get(user_id)
+        if entry is None:
+            return []
+        entry[1] = time.monotonic()
+        self._users.move_to_end(user_id)
+        budget = (token_budget or self.token_budget) - reserve_tokens
+        selected = []
+        for role, content, tokens in reversed(entry[0]):
+            if tokens > budget:
+                break
+            budget -= tokens
+            selected.append({"role": _ROLE_NAMES.get(role, role), "content": content})
+        selected.reverse()
+        # Gemini yêu cầu lịch sử bắt đầu bằng lượt của user
+        while selected and selected[0]["role"] != "user":
+            selected.pop(0)
+        return selected
+
+    def __len__(self):
+        return len(self._users)
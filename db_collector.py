@@ -1,11 +1,17 @@
 # db_collector.py (PHIÊN BẢN DAY 18 - Maintenance)
 
+import asyncio
 import datetime
 import logging
+import uuid
 # Thêm 'delete' vào import
-from sqlalchemy import create_engine, Column, String, Integer, BigInteger, Text, DateTime, func, delete
+from sqlalchemy import (
+    create_engine, Column, String, Integer, BigInteger, Text, DateTime, Boolean, func, delete, inspect, text, update,
+    insert, select, case, bindparam, or_
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError, OperationalError, InterfaceError, DBAPIError
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +24,7 @@ Base = declarative_base()
 class MessageLog(Base):
     __tablename__ = "message_logs"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    timestamp = Column(DateTime, default=datetime.datetime.now)
+    timestamp = Column(DateTime, default=datetime.datetime.now, index=True)  # [DAY 34] Index cho dọn log theo lô
     user_id = Column(BigInteger, nullable=False, index=True)
     username = Column(String)
     message_text = Column(Text)
@@ -28,7 +34,7 @@ class MessageLog(Base):
 class FeedbackLog(Base):
     __tablename__ = "feedback_logs"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    timestamp = Column(DateTime, default=datetime.datetime.now)
+    timestamp = Column(DateTime, default=datetime.datetime.now, index=True)
     user_id = Column(BigInteger, nullable=False, index=True)
     ai_feedback_text = Column(Text)
     rating = Column(String(10))
@@ -40,19 +46,72 @@ class ContentDB(Base):
     suggestion_id = Column(String(50), primary_key=True)
     keyword = Column(String, nullable=False, index=True)
     suggestion_text = Column(Text)
-    suggestion_link = Column(Text)
+    suggestion_link = Column(Text, index=True, unique=True)  # [DAY 24] Khóa chống trùng khi import
     rating_score = Column(Integer, default=0)
+    # [DAY 22] Phục vụ delta refresh: mỗi lần ghi đều đẩy updated_at lên, xóa = xóa mềm
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, index=True)
+    is_deleted = Column(Boolean, default=False, nullable=False)
 
 
 class SystemHealth(Base):
     __tablename__ = "system_health"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    timestamp = Column(DateTime, default=datetime.datetime.now)
+    timestamp = Column(DateTime, default=datetime.datetime.now, index=True)
     component = Column(String(50))  # Ví dụ: "Scheduler", "Scraper", "Bot"
     status = Column(String(20))  # "OK", "ERROR", "WARNING", "ALIVE"
     message = Column(Text)
 
 
+class UserActivity(Base):
+    """[DAY 28] Mỗi user 1 dòng: lần nhắn cuối + lần được nhắc cuối (thay cho GROUP BY message_logs)"""
+    __tablename__ = "user_activity"
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    last_seen = Column(DateTime, nullable=False, index=True)
+    last_reminded_at = Column(DateTime)
+
+
+class AnswerCacheEntry(Base):
+    """[DAY 25] Tầng lưu trữ bền của cache câu trả lời Gemini"""
+    __tablename__ = "answer_cache"
+    cache_key = Column(String(64), primary_key=True)  # sha256 của câu hỏi đã chuẩn hóa + ngữ cảnh
+    answer = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.now, index=True)
+
+
+class ConversationState(Base):
+    """[DAY 33] Lịch sử hội thoại của user đã bị đẩy khỏi RAM (JSON các lượt gần nhất)"""
+    __tablename__ = "conversation_state"
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    history = Column(Text)
+    updated_at = Column(DateTime, default=datetime.datetime.now, index=True)
+
+
+class MetricRollup(Base):
+    """[DAY 35] Bộ đếm gộp theo giờ (messages, gemini, feedback_good, error:<component>...)"""
+    __tablename__ = "metric_rollups"
+    hour = Column(DateTime, primary_key=True)
+    metric = Column(String(100), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+
+class JobLease(Base):
+    """[DAY 41] Quyền chạy job định kỳ khi có nhiều replica: ai giữ lease, tới khi nào, lần chạy xong gần nhất"""
+    __tablename__ = "job_leases"
+    job_name = Column(String(50), primary_key=True)
+    holder = Column(String(100))
+    acquired_at = Column(DateTime)
+    expires_at = Column(DateTime, nullable=False)
+    last_run_at = Column(DateTime)  # Thời điểm bắt đầu của lần chạy xong gần nhất
+
+
+# [DAY 22] Khoảng đọc lùi của delta refresh: phải lớn hơn transaction ghi content_db dài nhất + độ lệch giờ giữa các replica
+CONTENT_CHANGE_OVERLAP = datetime.timedelta(minutes=5)
+
+# Các bảng log theo "loại" (dùng cho ghi batch và dọn log)
+LOG_MODELS = {"message": MessageLog, "feedback": FeedbackLog, "health": SystemHealth}
+
+
 # --- CLASS COLLECTOR V2.2 ---
 class CollectorV2:
     def __init__(self, database_url):
@@ -72,9 +131,125 @@ class CollectorV2:
     def setup_database(self):
         try:
             Base.metadata.create_all(self.engine)
+            self._migrate_database()
             logger.info("SQLAlchemy: Đã tạo/kiểm tra các bảng thành công.")
+            return True
         except Exception as e:
             logger.error(f"Lỗi setup_database (SQLAlchemy): {e}", exc_info=True)
+            return False
+
+    def _migrate_database(self):
+        """Các bước sau create_all (dùng chung với AsyncCollector)"""
+        self._dedupe_content_links()
+        self._upgrade_schema()
+        self._backfill_user_activity()
+
+    def _upgrade_schema(self):
+        """Bổ sung cột/index mới cho các bảng đã có sẵn (create_all không tự ALTER) (Day 22)"""
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col['name'] for col in inspector.get_columns(table.name)}
+            with self.engine.begin() as conn:
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    col_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+                    # Điền giá trị mặc định cho các dòng cũ
+                    if isinstance(column.type, DateTime):
+                        value = datetime.datetime.now()
+                    elif column.default is not None and column.default.is_scalar:
+                        value = column.default.arg
+                    else:
+                        value = None
+                    if value is not None:
+                        conn.execute(
+                            text(f"UPDATE {table.name} SET {column.name} = :v WHERE {column.name} IS NULL"),
+                            {"v": value}
+                        )
+                    logger.info(f"SCHEMA: Đã thêm cột {table.name}.{column.name}")
+            for index in table.indexes:
+                try:
+                    index.create(self.engine, checkfirst=True)
+                except SQLAlchemyError as e:
+                    logger.error(f"SCHEMA: Không tạo được index {index.name}: {e}")
+
+    def _backfill_user_activity(self):
+        """Dựng bảng user_activity từ message_logs (chỉ chạy khi bảng còn trống) (Day 28)"""
+        session = self._get_session()
+        try:
+            if session.query(UserActivity.user_id).first() is not None:
+                return
+            result = session.execute(
+                insert(UserActivity).from_select(
+                    ["user_id", "last_seen"],
+                    select(MessageLog.user_id, func.max(MessageLog.timestamp))
+                    .where(MessageLog.timestamp.is_not(None))
+                    .group_by(MessageLog.user_id)
+                )
+            )
+            session.commit()
+            if result.rowcount:
+                logger.info(f"SCHEMA: Đã backfill user_activity cho {result.rowcount} user.")
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi backfill user_activity: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def _touch_user_activity(self, session, message_rows):
+        """Cập nhật last_seen cho các user vừa nhắn tin, trong cùng transaction với log (Day 28)"""
+        last_seen = {}
+        for row in message_rows:
+            ts = row.get("timestamp") or datetime.datetime.now()
+            if row["user_id"] not in last_seen or ts > last_seen[row["user_id"]]:
+                last_seen[row["user_id"]] = ts
+        if not last_seen:
+            return
+        values = [{"user_id": uid, "last_seen": ts} for uid, ts in last_seen.items()]
+
+        dialect = self.engine.dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            stmt = dialect_insert(UserActivity).values(values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[UserActivity.user_id],
+                set_={"last_seen": case(
+                    (stmt.excluded.last_seen > UserActivity.last_seen, stmt.excluded.last_seen),
+                    else_=UserActivity.last_seen
+                )}
+            )
+            session.execute(stmt)
+        else:
+            for value in values:
+                current = session.get(UserActivity, value["user_id"])
+                if current is None:
+                    session.add(UserActivity(**value))
+                elif value["last_seen"] > current.last_seen:
+                    current.last_seen = value["last_seen"]
+
+    def _dedupe_content_links(self):
+        """Xóa các dòng trùng suggestion_link (giữ dòng điểm cao nhất) trước khi tạo unique index (Day 24)"""
+        inspector = inspect(self.engine)
+        if not inspector.has_table(ContentDB.__tablename__):
+            return
+        if any(ix['name'] == "ix_content_db_suggestion_link" for ix in inspector.get_indexes(ContentDB.__tablename__)):
+            return
+        with self.engine.begin() as conn:
+            result = conn.execute(text("""
+                DELETE FROM content_db WHERE suggestion_id IN (
+                    SELECT suggestion_id FROM (
+                        SELECT suggestion_id, ROW_NUMBER() OVER (
+                            PARTITION BY suggestion_link ORDER BY rating_score DESC, suggestion_id
+                        ) AS rn
+                        FROM content_db WHERE suggestion_link IS NOT NULL
+                    ) ranked WHERE rn > 1
+                )
+            """))
+            if result.rowcount:
+                logger.warning(f"SCHEMA: Đã xóa {result.rowcount} gợi ý trùng link trước khi tạo unique index.")
 
     def _get_session(self):
         return self.Session()
@@ -87,9 +262,11 @@ class CollectorV2:
                 user_id=user_id,
                 username=username,
                 message_text=message_text,
-                ai_feedback_text=ai_feedback
+                ai_feedback_text=ai_feedback,
+                timestamp=datetime.datetime.now()
             )
             session.add(new_log)
+            self._touch_user_activity(session, [{"user_id": user_id, "timestamp": new_log.timestamp}])
             session.commit()
             return True
         except SQLAlchemyError as e:
@@ -134,11 +311,37 @@ class CollectorV2:
         finally:
             session.close()
 
+    def bulk_insert_logs(self, rows_by_kind):
+        """
+        Ghi nhiều dòng log trong 1 transaction (Day 23).
+        rows_by_kind: {"message": [...], "feedback": [...], "health": [...]}
+        Trả về False khi DB không truy cập được (mất kết nối, timeout) -> người gọi giữ batch để thử lại.
+        Lỗi do dữ liệu (vi phạm ràng buộc, sai kiểu...) được raise lại để LogWriter tách dòng hỏng.
+        """
+        session = self._get_session()
+        try:
+            for kind, rows in rows_by_kind.items():
+                if rows:
+                    # executemany -> SQLAlchemy gộp thành INSERT ... VALUES (...), (...) nhiều dòng
+                    session.execute(insert(LOG_MODELS[kind]), rows)
+            self._touch_user_activity(session, rows_by_kind.get("message", []))
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi bulk_insert_logs: {e}")
+            session.rollback()
+            if isinstance(e, (OperationalError, InterfaceError)) or (
+                    isinstance(e, DBAPIError) and e.connection_invalidated):
+                return False
+            raise
+        finally:
+            session.close()
+
     # --- CÁC HÀM CONTENT & LEARNING ---
     def get_all_content(self):
         session = self._get_session()
         try:
-            records = session.query(ContentDB).all()
+            records = session.query(ContentDB).filter(ContentDB.is_deleted.is_(False)).all()
             return [rec.__dict__ for rec in records]
         except SQLAlchemyError as e:
             logger.error(f"Lỗi get_all_content: {e}", exc_info=True)
@@ -146,78 +349,362 @@ class CollectorV2:
         finally:
             session.close()
 
-    def update_suggestion_score(self, sugg_id, rating):
+    def get_content_changes(self, since=None, overlap=CONTENT_CHANGE_OVERLAP):
+        """
+        Lấy các dòng content_db thay đổi từ mốc `since` (Day 22).
+        Trả về (danh sách dict, mốc mới). since=None -> lấy toàn bộ (lần tải đầu).
+        Dòng có is_deleted=True nghĩa là cache phải xóa gợi ý đó.
+        [DAY 39] Đọc bằng Core select (dict thuần), không dựng object ORM cho từng dòng.
+        updated_at lấy giờ phía app lúc bắt đầu transaction: transaction commit muộn (hoặc replica lệch giờ)
+        có thể ghi dòng cũ hơn mốc đã trả về -> đọc lùi thêm `overlap`, dòng đã áp dụng được
+        ContentCache.apply_changes() bỏ qua theo (suggestion_id, updated_at).
+        """
         session = self._get_session()
         try:
-            record = session.query(ContentDB).filter_by(suggestion_id=sugg_id).first()
-            if record:
-                value_change = 1 if rating == "good" else -1
-                record.rating_score = (record.rating_score or 0) + value_change
-                session.commit()
-                logger.info(f"Đã cập nhật điểm (thay đổi {value_change}) cho {sugg_id}")
-                return True
+            query = select(ContentDB.__table__)
+            if since is None:
+                query = query.where(ContentDB.is_deleted.is_(False))
             else:
-                logger.warning(f"Không tìm thấy Sugg_ID {sugg_id} để cập nhật điểm.")
-                return False
+                query = query.where(ContentDB.updated_at >= since - overlap)
+            records = [dict(row) for row in session.execute(query.order_by(ContentDB.updated_at)).mappings()]
+            # Dòng đọc lại trong khoảng overlap có thể cũ hơn `since` -> mốc không bao giờ lùi
+            watermark = max((rec['updated_at'] for rec in records if rec['updated_at']), default=since)
+            if since is not None and watermark < since:
+                watermark = since
+            return records, watermark
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi get_content_changes: {e}", exc_info=True)
+            return [], since
+        finally:
+            session.close()
+
+    def delete_content(self, sugg_id):
+        """Xóa mềm một gợi ý để các cache khác nhận được qua delta (Day 22)"""
+        session = self._get_session()
+        try:
+            result = session.execute(
+                update(ContentDB)
+                .where(ContentDB.suggestion_id == sugg_id)
+                .values(is_deleted=True, updated_at=datetime.datetime.now())
+            )
+            session.commit()
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi delete_content: {e}", exc_info=True)
+            session.rollback()
+            return False
+        finally:
+            session.close()
+
+    def update_suggestion_score(self, sugg_id, rating):
+        value_change = 1 if rating == "good" else -1
+        if self.apply_score_deltas({sugg_id: value_change}):
+            logger.info(f"Đã cập nhật điểm (thay đổi {value_change}) cho {sugg_id}")
+            return True
+        return False
+
+    def apply_score_deltas(self, deltas):
+        """
+        Cộng dồn điểm cho nhiều gợi ý trong 1 transaction (Day 30).
+        UPDATE ... SET rating_score = rating_score + :d -> không bị mất vote khi nhiều người bấm cùng lúc.
+        """
+        if not deltas:
+            return True
+        table = ContentDB.__table__
+        stmt = (
+            table.update()
+            .where(table.c.suggestion_id == bindparam("sid"))
+            .values(
+                rating_score=func.coalesce(table.c.rating_score, 0) + bindparam("delta"),
+                updated_at=bindparam("now")
+            )
+        )
+        now = datetime.datetime.now()
+        session = self._get_session()
+        try:
+            session.connection().execute(
+                stmt, [{"sid": sugg_id, "delta": delta, "now": now} for sugg_id, delta in deltas.items()]
+            )
+            session.commit()
+            return True
         except SQLAlchemyError as e:
-            logger.error(f"Lỗi update_suggestion_score: {e}", exc_info=True)
+            logger.error(f"Lỗi apply_score_deltas: {e}", exc_info=True)
             session.rollback()
             return False
         finally:
             session.close()
 
-    def import_content_batch(self, items):
-        """Lưu nội dung mới, check trùng lặp (Day 17)"""
+    def import_content_batch(self, items, chunk_size=1000):
+        """
+        Lưu nội dung mới, bỏ qua link đã có (Day 17).
+        [DAY 24] Dùng 1 câu INSERT ... ON CONFLICT DO NOTHING ... RETURNING cho mỗi chunk
+        thay vì SELECT từng link -> số round trip không phụ thuộc số bài.
+        Trả về số bài mới, None nếu lỗi (0 = mọi link đều đã có).
+        """
+        now = datetime.datetime.now()
+        rows = []
+        seen_links = set()
+        for item in items:
+            link = item.get('link')
+            if not link or link in seen_links:
+                continue
+            seen_links.add(link)
+            rows.append({
+                "suggestion_id": f"AUTO_{uuid.uuid4().hex}",  # Không trùng giữa các batch như int(timestamp)
+                "keyword": item['keyword'],
+                "suggestion_text": item['text'],
+                "suggestion_link": link,
+                "rating_score": 0,
+                "created_at": now,
+                "updated_at": now,
+                "is_deleted": False,
+            })
+        if not rows:
+            return 0
+
         session = self._get_session()
-        count_new = 0
         try:
-            for item in items:
-                exists = session.query(ContentDB).filter_by(suggestion_link=item['link']).first()
-                if not exists:
-                    new_id = f"AUTO_{int(datetime.datetime.now().timestamp())}_{count_new}"
-                    new_content = ContentDB(
-                        suggestion_id=new_id,
-                        keyword=item['keyword'],
-                        suggestion_text=item['text'],
-                        suggestion_link=item['link'],
-                        rating_score=0
-                    )
-                    session.add(new_content)
-                    count_new += 1
+            count_new = 0
+            for start in range(0, len(rows), chunk_size):
+                count_new += len(self._insert_new_content(session, rows[start:start + chunk_size]))
             session.commit()
             return count_new
         except Exception as e:
             logger.error(f"Lỗi import_content_batch: {e}")
             session.rollback()
-            return 0
+            return None
         finally:
             session.close()
 
-    # --- CÁC HÀM QUẢN TRỊ & BÁO CÁO (DAY 18) ---
+    def _insert_new_content(self, session, rows):
+        """Insert các dòng chưa có suggestion_link trong DB, trả về danh sách ID vừa thêm."""
+        dialect = self.engine.dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            stmt = (
+                dialect_insert(ContentDB)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=[ContentDB.suggestion_link])
+                .returning(ContentDB.suggestion_id)
+            )
+            return session.execute(stmt).scalars().all()
+
+        # DB khác: 1 truy vấn lấy các link đã tồn tại + 1 lệnh insert nhiều dòng
+        links = [row["suggestion_link"] for row in rows]
+        existing = set(
+            session.execute(
+                select(ContentDB.suggestion_link).where(ContentDB.suggestion_link.in_(links))
+            ).scalars()
+        )
+        new_rows = [row for row in rows if row["suggestion_link"] not in existing]
+        if new_rows:
+            session.execute(insert(ContentDB), new_rows)
+        return [row["suggestion_id"] for row in new_rows]
 
-    def clean_old_logs(self, days_keep=30):
-        """Xóa log cũ (Day 18)"""
+    # --- CACHE CÂU TRẢ LỜI GEMINI (DAY 25) ---
+    def get_cached_answer(self, cache_key, max_age_seconds):
         session = self._get_session()
         try:
-            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days_keep)
+            cutoff = datetime.datetime.now() - datetime.timedelta(seconds=max_age_seconds)
+            return session.execute(
+                select(AnswerCacheEntry.answer).where(
+                    AnswerCacheEntry.cache_key == cache_key,
+                    AnswerCacheEntry.created_at > cutoff
+                )
+            ).scalar()
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi get_cached_answer: {e}")
+            return None
+        finally:
+            session.close()
 
-            stmt1 = delete(MessageLog).where(MessageLog.timestamp < cutoff_date)
-            result1 = session.execute(stmt1)
+    def save_cached_answer(self, cache_key, answer):
+        session = self._get_session()
+        try:
+            session.merge(AnswerCacheEntry(cache_key=cache_key, answer=answer, created_at=datetime.datetime.now()))
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi save_cached_answer: {e}")
+            session.rollback()
+            return False
+        finally:
+            session.close()
 
-            stmt2 = delete(SystemHealth).where(SystemHealth.timestamp < cutoff_date)
-            result2 = session.execute(stmt2)
+    def purge_answer_cache(self, max_age_seconds):
+        """Xóa các câu trả lời đã hết hạn trong bảng answer_cache"""
+        session = self._get_session()
+        try:
+            cutoff = datetime.datetime.now() - datetime.timedelta(seconds=max_age_seconds)
+            result = session.execute(delete(AnswerCacheEntry).where(AnswerCacheEntry.created_at < cutoff))
+            session.commit()
+            return result.rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi purge_answer_cache: {e}")
+            session.rollback()
+            return 0
+        finally:
+            session.close()
 
+    # --- BỘ NHỚ HỘI THOẠI (DAY 33) ---
+    def load_conversation(self, user_id):
+        """Trả về chuỗi JSON lịch sử đã lưu của user, hoặc None"""
+        session = self._get_session()
+        try:
+            return session.execute(
+                select(ConversationState.history).where(ConversationState.user_id == user_id)
+            ).scalar()
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi load_conversation: {e}")
+            return None
+        finally:
+            session.close()
+
+    def save_conversations(self, histories):
+        """Lưu nhiều user 1 lượt: {user_id: chuỗi JSON lịch sử}"""
+        if not histories:
+            return 0
+        session = self._get_session()
+        try:
+            now = datetime.datetime.now()
+            for user_id, history in histories.items():
+                session.merge(ConversationState(user_id=user_id, history=history, updated_at=now))
             session.commit()
-            deleted_count = result1.rowcount + result2.rowcount
-            logger.info(f"DỌN RÁC: Đã xóa {deleted_count} dòng log cũ.")
-            return deleted_count
-        except Exception as e:
-            logger.error(f"Lỗi clean_old_logs: {e}")
+            return len(histories)
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi save_conversations: {e}")
+            session.rollback()
+            return 0
+        finally:
+            session.close()
+
+    def purge_conversations(self, days_keep=30):
+        """Xóa lịch sử hội thoại của user không quay lại trong `days_keep` ngày"""
+        session = self._get_session()
+        try:
+            cutoff = datetime.datetime.now() - datetime.timedelta(days=days_keep)
+            result = session.execute(delete(ConversationState).where(ConversationState.updated_at < cutoff))
+            session.commit()
+            return result.rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi purge_conversations: {e}")
             session.rollback()
             return 0
         finally:
             session.close()
 
+    # --- BỘ ĐẾM THEO GIỜ (DAY 35) ---
+    def add_metric_counts(self, counts):
+        """
+        Cộng dồn bộ đếm: {(giờ, metric): số lượng}. 1 transaction, upsert count = count + :n
+        (nhiều tiến trình cùng ghi 1 giờ vẫn cộng đúng).
+        """
+        if not counts:
+            return True
+        values = [{"hour": hour, "metric": metric, "count": n} for (hour, metric), n in counts.items()]
+        session = self._get_session()
+        try:
+            dialect = self.engine.dialect.name
+            if dialect in ("postgresql", "sqlite"):
+                dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+                stmt = dialect_insert(MetricRollup).values(values)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[MetricRollup.hour, MetricRollup.metric],
+                    set_={"count": MetricRollup.count + stmt.excluded.count}
+                )
+                session.execute(stmt)
+            else:
+                for value in values:
+                    current = session.get(MetricRollup, (value["hour"], value["metric"]))
+                    if current is None:
+                        session.add(MetricRollup(**value))
+                    else:
+                        current.count += value["count"]
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi add_metric_counts: {e}")
+            session.rollback()
+            return False
+        finally:
+            session.close()
+
+    def get_metric_totals(self, hours=24):
+        """Tổng từng metric trong `hours` giờ gần nhất (GROUP BY trên bảng rollup nhỏ, không quét bảng log)"""
+        session = self._get_session()
+        try:
+            since = datetime.datetime.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=hours - 1)
+            rows = session.execute(
+                select(MetricRollup.metric, func.sum(MetricRollup.count))
+                .where(MetricRollup.hour >= since)
+                .group_by(MetricRollup.metric)
+            ).all()
+            return {metric: int(total) for metric, total in rows}
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi get_metric_totals: {e}")
+            return {}
+        finally:
+            session.close()
+
+    # --- CÁC HÀM QUẢN TRỊ & BÁO CÁO (DAY 18) ---
+
+    def clean_old_logs(self, days_keep=30, batch_size=5000):
+        """
+        Xóa log cũ (Day 18).
+        [DAY 34] Xóa theo lô `batch_size` dòng (range scan trên index timestamp), mỗi lô 1 transaction ngắn
+        -> không giữ lock lâu / không đẩy WAL tăng vọt. Dọn cả feedback_logs.
+        Muốn lưu trữ dữ liệu trước khi xóa: dùng retention.LogRetention.
+        """
+        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days_keep)
+        deleted_count = 0
+        for kind in LOG_MODELS:
+            while True:
+                deleted = self.delete_expired_logs(kind, cutoff_date, batch_size)
+                deleted_count += deleted
+                if deleted < batch_size:
+                    break
+        logger.info(f"DỌN RÁC: Đã xóa {deleted_count} dòng log cũ.")
+        return deleted_count
+
+    def get_expired_logs(self, kind, cutoff, limit=5000):
+        """Lô dòng log cũ hơn `cutoff` (cũ nhất trước), dạng dict thuần để ghi ra file lưu trữ (Day 34)"""
+        model = LOG_MODELS[kind]
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(
+                    select(model.__table__)
+                    .where(model.timestamp < cutoff)
+                    .order_by(model.timestamp, model.id)
+                    .limit(limit)
+                ).mappings().all()
+            return [dict(row) for row in rows]
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi get_expired_logs ({kind}): {e}")
+            return []
+
+    def delete_logs_by_id(self, kind, ids):
+        """Xóa đúng các dòng đã lưu trữ (Day 34)"""
+        if not ids:
+            return 0
+        model = LOG_MODELS[kind]
+        try:
+            with self.engine.begin() as conn:
+                return conn.execute(delete(model).where(model.id.in_(ids))).rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi delete_logs_by_id ({kind}): {e}")
+            return 0
+
+    def delete_expired_logs(self, kind, cutoff, limit=5000):
+        """Xóa tối đa `limit` dòng log cũ hơn `cutoff` trong 1 transaction, trả về số dòng đã xóa (Day 34)"""
+        model = LOG_MODELS[kind]
+        try:
+            with self.engine.begin() as conn:
+                oldest = select(model.id).where(model.timestamp < cutoff).order_by(model.timestamp).limit(limit)
+                return conn.execute(delete(model).where(model.id.in_(oldest))).rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi delete_expired_logs ({kind}): {e}")
+            return 0
+
     def get_recent_errors(self, hours=24):
         """Lấy báo cáo lỗi (Day 18)"""
         session = self._get_session()
@@ -235,13 +722,17 @@ class CollectorV2:
             session.close()
 
     def get_inactive_users(self, days_inactive=3):
+        """
+        User không nhắn tin trong `days_inactive` ngày và chưa được nhắc kể từ lần nhắn cuối.
+        [DAY 28] Đọc bảng user_activity (range scan trên index last_seen) thay vì GROUP BY message_logs.
+        """
         session = self._get_session()
         try:
             cutoff_time = datetime.datetime.now() - datetime.timedelta(days=days_inactive)
             users = (
-                session.query(MessageLog.user_id)
-                .group_by(MessageLog.user_id)
-                .having(func.max(MessageLog.timestamp) < cutoff_time)
+                session.query(UserActivity.user_id)
+                .filter(UserActivity.last_seen < cutoff_time)
+                .filter((UserActivity.last_reminded_at.is_(None)) | (UserActivity.last_reminded_at < UserActivity.last_seen))
                 .all()
             )
             user_list = [{"user_id": user[0]} for user in users]
@@ -250,4 +741,121 @@ class CollectorV2:
             logger.error(f"Lỗi get_inactive_users: {e}", exc_info=True)
             return []
         finally:
-            session.close()
\ No newline at end of file
+            session.close()
+
+    def mark_reminded(self, user_ids, chunk_size=1000):
+        """Ghi nhận đã nhắc các user này -> lần quét sau bỏ qua tới khi họ nhắn tin lại (Day 28)"""
+        if not user_ids:
+            return 0
+        session = self._get_session()
+        try:
+            now = datetime.datetime.now()
+            updated = 0
+            user_ids = list(user_ids)
+            for start in range(0, len(user_ids), chunk_size):
+                result = session.execute(
+                    update(UserActivity)
+                    .where(UserActivity.user_id.in_(user_ids[start:start + chunk_size]))
+                    .values(last_reminded_at=now)
+                )
+                updated += result.rowcount
+            session.commit()
+            return updated
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi mark_reminded: {e}", exc_info=True)
+            session.rollback()
+            return 0
+        finally:
+            session.close()
+
+    # --- [DAY 41] LEASE CHO JOB ĐỊNH KỲ (NHIỀU REPLICA) ---
+    def acquire_job_lease(self, job_name, holder, ttl_seconds, min_interval_seconds=0):
+        """
+        Giành quyền chạy `job_name` trong `ttl_seconds` giây. Chỉ thành công khi lease đang trống / đã hết hạn và chưa
+        replica nào chạy xong job này trong `min_interval_seconds` giây qua.
+        1 câu UPDATE có điều kiện (+ INSERT ... DO NOTHING cho lần đầu) -> nhiều replica tranh nhau chỉ 1 bên thắng.
+        """
+        now = datetime.datetime.now()
+        values = {"holder": holder, "acquired_at": now, "expires_at": now + datetime.timedelta(seconds=ttl_seconds)}
+        session = self._get_session()
+        try:
+            result = session.execute(
+                update(JobLease)
+                .where(JobLease.job_name == job_name)
+                .where(JobLease.expires_at <= now)
+                .where(or_(
+                    JobLease.last_run_at.is_(None),
+                    JobLease.last_run_at <= now - datetime.timedelta(seconds=min_interval_seconds)
+                ))
+                .values(**values)
+            )
+            acquired = result.rowcount == 1
+            if not acquired and session.get(JobLease, job_name) is None:
+                # Job chưa có dòng nào -> tạo luôn ở trạng thái đang giữ
+                dialect = self.engine.dialect.name
+                if dialect in ("postgresql", "sqlite"):
+                    dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+                    stmt = dialect_insert(JobLease).values(job_name=job_name, **values).on_conflict_do_nothing()
+                    acquired = session.execute(stmt).rowcount == 1
+                else:
+                    session.add(JobLease(job_name=job_name, **values))
+                    session.flush()
+                    acquired = True
+            session.commit()
+            return acquired
+        except IntegrityError:
+            session.rollback()  # Replica khác vừa tạo dòng này trước
+            return False
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi acquire_job_lease ({job_name}): {e}")
+            session.rollback()
+            return False
+        finally:
+            session.close()
+
+    def renew_job_lease(self, job_name, holder, ttl_seconds):
+        """Gia hạn lease đang giữ. False -> đã mất lease (hết hạn và replica khác đã nhận)"""
+        session = self._get_session()
+        try:
+            result = session.execute(
+                update(JobLease)
+                .where(JobLease.job_name == job_name, JobLease.holder == holder)
+                .values(expires_at=datetime.datetime.now() + datetime.timedelta(seconds=ttl_seconds))
+            )
+            session.commit()
+            return result.rowcount == 1
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi renew_job_lease ({job_name}): {e}")
+            session.rollback()
+            return False
+        finally:
+            session.close()
+
+    def release_job_lease(self, job_name, holder, completed=True):
+        """Trả lease ngay (không chờ hết hạn). completed=True -> ghi last_run_at để replica khác không chạy lại"""
+        values = {"holder": None, "expires_at": datetime.datetime.now()}
+        if completed:
+            values["last_run_at"] = JobLease.acquired_at
+        session = self._get_session()
+        try:
+            result = session.execute(
+                update(JobLease).where(JobLease.job_name == job_name, JobLease.holder == holder).values(**values)
+            )
+            session.commit()
+            return result.rowcount == 1
+        except SQLAlchemyError as e:
+            logger.error(f"Lỗi release_job_lease ({job_name}): {e}")
+            session.rollback()
+            return False
+        finally:
+            session.close()
+
+
+async def run_db(method, *args, **kwargs):
+    """
+    [DAY 42] Gọi method của CollectorV2 / AsyncCollector từ event loop:
+    AsyncCollector -> await thẳng (driver async), CollectorV2 -> chạy trong thread (asyncio.to_thread)
+    """
+    if getattr(method, "__async_collector__", False):
+        return await method.__self__.run_async(method.__name__, *args, **kwargs)
+    return await asyncio.to_thread(method, *args, **kwargs)
@@ -0,0 +1,249 @@
+# instrumentation.py
+# [DAY 38] Histogram / counter độ trễ các đường nóng + endpoint /metrics (định dạng text của Prometheus)
+#
+# Ghi số đo chỉ là tìm bucket + cộng trong RAM; chuỗi text chỉ được dựng khi có người gọi /metrics.
+
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Bucket (giây) phủ từ tra cứu trong RAM (~0.1ms) tới lời gọi Gemini / job quét web (vài chục giây)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histogram tích lũy kiểu Prometheus; mỗi bộ nhãn giữ [đếm theo bucket..., tổng, số lần]"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1  # index == len(buckets) -> chỉ rơi vào +Inf
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Đo khối lệnh (dùng được cả trong hàm async: `with HIST.time(stage="x"): await ...`)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            plain = _format_labels(self.labelnames, key)
+            inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {state[-1]}")
+            lines.append(f"{self.name}_sum{plain} {state[-2]}")
+            lines.append(f"{self.name}_count{plain} {state[-1]}")
+        return lines
+
+
+class Gauge:
+    """Giá trị đọc tại thời điểm scrape qua `function` (ví dụ độ dài hàng đợi); chưa gán function -> không xuất"""
+
+    def __init__(self, name, documentation, function=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def set_function(self, function):
+        self.function = function
+
+    def render(self):
+        if self.function is None:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.function()}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, documentation, function=None):
+        metric = Gauge(name, documentation, function)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# --- CÁC METRIC CỦA BOT ---
+REGISTRY = Registry()
+HANDLER_STAGE_SECONDS = REGISTRY.histogram(
+    "aimentor_handler_stage_seconds", "Thời gian từng bước của handle_message / button_click", ["stage"])
+MESSAGES_TOTAL = REGISTRY.counter("aimentor_messages_total", "Số tin nhắn theo cách trả lời", ["outcome"])
+JOB_SECONDS = REGISTRY.histogram("aimentor_job_seconds", "Thời gian chạy của từng job định kỳ", ["job"])
+JOB_ERRORS = REGISTRY.counter("aimentor_job_errors_total", "Số lần job định kỳ ném exception", ["job"])
+SCRAPER_SOURCE_SECONDS = REGISTRY.histogram(
+    "aimentor_scraper_source_seconds", "Thời gian quét từng nguồn", ["source", "result"])
+DB_METHOD_SECONDS = REGISTRY.histogram("aimentor_db_method_seconds", "Thời gian từng method CollectorV2", ["method"])
+DB_METHOD_ERRORS = REGISTRY.counter("aimentor_db_method_errors_total", "Số lần method CollectorV2 ném exception",
+                                    ["method"])
+WEBHOOK_REQUESTS_TOTAL = REGISTRY.counter("aimentor_webhook_requests_total", "Số request webhook theo mã HTTP trả về",
+                                          ["status"])
+WEBHOOK_BACKLOG = REGISTRY.gauge("aimentor_webhook_backlog", "Số update webhook đã nhận nhưng chưa bắt đầu xử lý")
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "aimentor_db_pool_wait_seconds", "Thời gian chờ lấy connection từ pool của AsyncCollector (gồm cả pre-ping)")
+DB_POOL_IN_USE = REGISTRY.gauge("aimentor_db_pool_in_use", "Số connection của AsyncCollector đang được dùng")
+
+
+def timed(histogram, errors=None, **labels):
+    """Decorator đo thời gian hàm sync hoặc async (exception vẫn được ghi nhận rồi ném tiếp)"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def instrument_methods(cls, histogram=DB_METHOD_SECONDS, errors=DB_METHOD_ERRORS):
+    """Bọc mọi method public của `cls` bằng timed(method=<tên>) (gọi 1 lần lúc khởi động)"""
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.isfunction(func) or getattr(func, "__instrumented__", False):
+            continue
+        wrapped = timed(histogram, errors, method=name)(func)
+        wrapped.__instrumented__ = True
+        setattr(cls, name, wrapped)
+    return cls
+
+
+class MetricsServer:
+    """HTTP server tối giản trên asyncio: GET /metrics -> REGISTRY.render(), còn lại 404"""
+
+    def __init__(self, registry=REGISTRY, host="0.0.0.0", port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Bỏ qua phần header còn lại của request
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status, body, content_type = "404 Not Found", b"not found\n", "text/plain"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"METRICS: Bỏ qua request lỗi: {e}")
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"METRICS: Đang phục vụ http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,126 @@
+# job_coordinator.py
+# [DAY 41] Điều phối job định kỳ giữa nhiều replica bằng bảng job_leases (Postgres / SQLite), thay cho job_locks
+
+import asyncio
+import functools
+import logging
+import os
+import socket
+import time
+import uuid
+
+from db_collector import run_db
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """Replica không còn chắc chắn giữ lease của job -> dừng trước khi ghi thêm tác dụng phụ."""
+
+
+class JobCoordinator:
+    """
+    - exclusive(name, min_interval): decorator cho job của JobQueue. Mỗi lần tới lịch, replica phải giành lease
+      trong DB; lease đang bị giữ hoặc job đã được replica khác chạy xong trong `min_interval` giây -> bỏ qua lượt này.
+    - Lease được gia hạn mỗi ttl/3 giây khi job còn chạy. Replica chết giữa chừng -> lease hết hạn sau `ttl` giây,
+      lần chạy đó không được tính (last_run_at không đổi) nên replica khác sẽ chạy lại ở lượt kế tiếp.
+    - Gia hạn thất bại thì thử lại liên tục; quá 2/3 ttl kể từ lần gia hạn được gần nhất (trước khi lease có thể
+      hết hạn và replica khác nhận) mà vẫn chưa gia hạn được -> hủy task của job. Job nên gọi assert_owner(name)
+      (hoặc still_owner, dùng được cả trong thread) trước mỗi lô có tác dụng phụ để dừng sớm, kể cả phần đang
+      chạy trong thread mà việc hủy task không dừng được.
+    - Job trả về False = "bỏ qua / thất bại" (ví dụ ngoài giờ gửi nhắc nhở, import lỗi) -> không ghi nhận là đã chạy.
+    - Replica đang chạy job khác chờ thêm `busy_delay` giây cho mỗi job đó rồi mới tranh lease
+      -> replica rảnh thắng trước, các job tự dàn đều ra các replica.
+    """
+
+    def __init__(self, db, holder=None, ttl=120, busy_delay=2.0):
+        self.db = db
+        # Duy nhất cho từng tiến trình (kể cả khi 2 replica cùng hostname / cùng pid trong container)
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.ttl = ttl
+        self.busy_delay = busy_delay
+        self.running = set()
+        # Job đang giữ lease -> hạn (time.monotonic) mà replica này còn chắc chắn là chủ
+        self._owned_until = {}
+        self.stats = {"ran": 0, "skipped": 0, "lost": 0}
+
+    def still_owner(self, name):
+        return time.monotonic() < self._owned_until.get(name, 0.0)
+
+    def assert_owner(self, name):
+        """Raise LeaseLost nếu không còn chắc giữ lease `name` (gọi trước mỗi lô ghi / gửi)"""
+        if not self.still_owner(name):
+            raise LeaseLost(f"Mất lease job '{name}'")
+
+    async def _renew_loop(self, name, job_task):
+        interval = self.ttl / 3
+        retry_delay = min(5.0, interval)
+        delay = interval
+        while True:
+            await asyncio.sleep(delay)
+            started = time.monotonic()
+            try:
+                renewed = await run_db(self.db.renew_job_lease, name, self.holder, self.ttl)
+            except Exception as e:
+                logger.error(f"JOB LEASE: Lỗi gia hạn '{name}': {e}")
+                renewed = False
+            if renewed:
+                self._owned_until[name] = started + self.ttl * 2 / 3
+                delay = interval
+            elif not self.still_owner(name):
+                logger.warning(f"JOB LEASE: Mất lease '{name}' khi đang chạy, hủy job để replica khác không chạy trùng.")
+                job_task.cancel()
+                return
+            else:
+                delay = retry_delay
+
+    async def run(self, name, job, min_interval=0):
+        """Chạy coroutine function `job()` nếu giành được lease. Trả về True nếu replica này đã chạy job tới cùng"""
+        if name in self.running:
+            self.stats["skipped"] += 1
+            logger.warning(f"JOB LEASE: '{name}' lần trước chưa xong. Bỏ qua.")
+            return False
+        if self.running:
+            await asyncio.sleep(self.busy_delay * len(self.running))
+        if not await run_db(self.db.acquire_job_lease, name, self.holder, self.ttl, min_interval):
+            self.stats["skipped"] += 1
+            logger.info(f"JOB LEASE: '{name}' đang/đã được replica khác chạy. Bỏ qua.")
+            return False
+
+        self.running.add(name)
+        self._owned_until[name] = time.monotonic() + self.ttl * 2 / 3
+        job_task = asyncio.create_task(job())
+        renew_task = asyncio.create_task(self._renew_loop(name, job_task))
+        completed = False
+        lost = False
+        try:
+            completed = await job_task is not False
+        except LeaseLost:
+            # Job tự dừng sau assert_owner() -> lượt này không tính là đã chạy
+            lost = True
+            logger.warning(f"JOB LEASE: Job '{name}' đã dừng giữa chừng do mất lease.")
+        except asyncio.CancelledError:
+            if not renew_task.done() or asyncio.current_task().cancelling():
+                raise  # Bản thân lời gọi run() bị hủy (ví dụ khi tắt bot)
+            lost = True
+            logger.warning(f"JOB LEASE: Đã hủy job '{name}' giữa chừng do mất lease.")
+        finally:
+            renew_task.cancel()
+            self.running.discard(name)
+            self._owned_until.pop(name, None)
+            await run_db(self.db.release_job_lease, name, self.holder, completed)
+        # Mỗi lượt mất lease chỉ đếm 1 lần vào "lost" (dù do assert_owner hay do _renew_loop hủy task)
+        if lost:
+            self.stats["lost"] += 1
+            return False
+        self.stats["ran"] += 1
+        return True
+
+    def exclusive(self, name, min_interval=0):
+        """Decorator: `async def job(context)` chỉ chạy trên 1 replica mỗi lượt"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(context):
+                await self.run(name, lambda: func(context), min_interval)
+            return wrapper
+        return decorator
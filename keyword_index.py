@@ -0,0 +1,174 @@
+# keyword_index.py
+# [DAY 22] Bộ so khớp từ khóa Aho-Corasick cho get_suggestion_engine
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class KeywordIndex:
+    """
+    Automaton Aho-Corasick dựng một lần từ cột `keyword` của content_db.
+    Chỉ cần quét tin nhắn đúng 1 lượt để tìm mọi từ khóa xuất hiện trong đó,
+    rồi chọn bản ghi có rating_score cao nhất mà không phải sort.
+    """
+
+    # Mỗi cạnh chuyển trạng thái được mã hóa thành 1 số nguyên: (state << 21) | ord(ký tự)
+    # -> dùng 1 dict phẳng thay cho hàng trăm nghìn dict con (tiết kiệm RAM khi có 100k+ từ khóa)
+    _CHAR_BITS = 21
+
+    def __init__(self, records=None):
+        self._goto = {}
+        self._fail = [0]
+        self._out = [-1]        # id từ khóa kết thúc tại state (-1 = không có)
+        self._dict_link = [-1]  # state gần nhất trên chuỗi fail có output
+        self._keyword_ids = {}  # keyword (đã lower) -> id
+        self._groups = []       # id -> {suggestion_id: (order, record)}
+        self._best = []         # id -> (score, -order, record) tốt nhất của từ khóa
+        self._where = {}        # suggestion_id -> id từ khóa đang chứa nó
+        self._next_order = 0
+        self.size = 0
+
+        if records:
+            self._build(records)
+
+    # --- DỰNG AUTOMATON ---
+    def _build(self, records):
+        for record in records:
+            keyword = _keyword_of(record)
+            if not keyword:
+                continue
+            kid = self._keyword_ids.get(keyword)
+            if kid is None:
+                kid = len(self._groups)
+                self._keyword_ids[keyword] = kid
+                self._groups.append({})
+                self._insert(keyword, kid)
+            self._add_to_group(kid, record)
+
+        self._best = [self._pick_best(group) for group in self._groups]
+        self._link()
+
+    def _add_to_group(self, kid, record):
+        sugg_id = record.get('suggestion_id')
+        self._groups[kid][sugg_id] = (self._next_order, record)
+        self._where[sugg_id] = kid
+        self._next_order += 1
+        self.size += 1
+
+    def _insert(self, keyword, kid):
+        goto = self._goto
+        state = 0
+        for ch in keyword:
+            key = (state << self._CHAR_BITS) | ord(ch)
+            nxt = goto.get(key)
+            if nxt is None:
+                nxt = len(self._fail)
+                goto[key] = nxt
+                self._fail.append(0)
+                self._out.append(-1)
+                self._dict_link.append(-1)
+            state = nxt
+        self._out[state] = kid
+
+    def _link(self):
+        """Tính fail link / dictionary link theo BFS (độ sâu tăng dần)."""
+        children = [[] for _ in self._fail]
+        mask = (1 << self._CHAR_BITS) - 1
+        for key, child in self._goto.items():
+            children[key >> self._CHAR_BITS].append((key & mask, child))
+
+        goto, fail, out, dict_link = self._goto, self._fail, self._out, self._dict_link
+        queue = [child for _, child in children[0]]
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for code, child in children[state]:
+                f = fail[state]
+                while True:
+                    nxt = goto.get((f << self._CHAR_BITS) | code)
+                    if nxt is not None and nxt != child:
+                        break
+                    if f == 0:
+                        nxt = 0
+                        break
+                    f = fail[f]
+                fail[child] = nxt
+                dict_link[child] = nxt if out[nxt] >= 0 else dict_link[nxt]
+                queue.append(child)
+
+    @staticmethod
+    def _pick_best(group):
+        if not group:
+            return None
+        order, record = max(group.values(), key=lambda x: (x[1].get('rating_score') or 0, -x[0]))
+        return (record.get('rating_score') or 0, -order, record)
+
+    # --- CẬP NHẬT TẠI CHỖ (Day 22) ---
+    def upsert(self, record):
+        """
+        Thêm/cập nhật 1 bản ghi mà không dựng lại automaton.
+        Trả về False nếu từ khóa chưa có trong automaton -> phía gọi cần dựng lại index.
+        """
+        kid = self._keyword_ids.get(_keyword_of(record))
+        if kid is None:
+            return False
+        sugg_id = record.get('suggestion_id')
+        old_kid = self._where.get(sugg_id)
+        if old_kid is not None:
+            order, _ = self._groups[old_kid].pop(sugg_id)
+            self.size -= 1
+            if old_kid != kid:
+                self._best[old_kid] = self._pick_best(self._groups[old_kid])
+        self._add_to_group(kid, record)
+        if old_kid is not None:
+            # Giữ nguyên thứ tự cũ để kết quả hòa điểm không bị đảo
+            self._groups[kid][sugg_id] = (order, record)
+        self._best[kid] = self._pick_best(self._groups[kid])
+        return True
+
+    def remove(self, sugg_id):
+        kid = self._where.pop(sugg_id, None)
+        if kid is None:
+            return
+        self._groups[kid].pop(sugg_id, None)
+        self._best[kid] = self._pick_best(self._groups[kid])
+        self.size -= 1
+
+    # --- TRA CỨU ---
+    def search(self, message_text):
+        """Trả về bản ghi tốt nhất khớp với tin nhắn (hoặc None)."""
+        if not self.size or not message_text:
+            return None
+
+        goto, fail, out, dict_link, best = self._goto, self._fail, self._out, self._dict_link, self._best
+        bits = self._CHAR_BITS
+        winner = None
+        state = 0
+        for ch in message_text.lower():
+            code = ord(ch)
+            while True:
+                nxt = goto.get((state << bits) | code)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+
+            hit = state if out[state] >= 0 else dict_link[state]
+            while hit > 0:
+                candidate = best[out[hit]]
+                if candidate and (winner is None or candidate[:2] > winner[:2]):
+                    winner = candidate
+                hit = dict_link[hit]
+
+        return winner[2] if winner else None
+
+    def __len__(self):
+        return self.size
+
+
+def _keyword_of(record):
+    return str(record.get('keyword') or '').lower()
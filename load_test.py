@@ -0,0 +1,306 @@
+# load_test.py
+# [DAY 37] Bơm Update giả qua đúng các handler của bot (handle_message, button_click) để đo sức chịu tải
+#
+#   python load_test.py                                      -> tăng dần 2,5,10,20,40 update/giây, mỗi mức 20s
+#   python load_test.py --rates 10,50 --duration 30 --gemini-latency 2.5 --concurrent-updates 64
+#   python load_test.py --gemini-rpm 15 --out load.json       -> dùng quota Gemini thật để xem lúc nào bot báo "bận"
+#
+# Bot API giả chạy trong tiến trình (BaseRequest), Gemini được thay bằng model giả có độ trễ cấu hình được.
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest
+
+from benchmark import StubGemini, import_bot, summarize
+
+QUESTIONS = [
+    "Mình bị lỗi IndexError trong python, sửa sao ạ?",
+    "giải thích giúp mình về decorator trong python",
+    "làm sao tối ưu câu truy vấn sql chạy chậm",
+    "pandas dataframe lọc dữ liệu theo điều kiện thế nào",
+    "mạng nơ ron tích chập hoạt động ra sao",
+    "git merge bị conflict phải làm gì",
+    "khác nhau giữa list và tuple là gì",
+]
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    Bot API giả: trả lời mọi method bằng JSON hợp lệ sau `latency` giây, đếm số lần gọi từng method.
+    Đủ cho getMe / sendMessage / editMessageText / answerCallbackQuery mà bot dùng.
+    """
+
+    BOT_USER = {"id": 123456, "is_bot": True, "first_name": "AI Mentor", "username": "ai_mentor_load_bot"}
+
+    def __init__(self, latency=0.03):
+        self.latency = latency
+        self.calls = {}
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    def _message(self, params):
+        self._message_id += 1
+        return {
+            "message_id": int(params.get("message_id") or self._message_id),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": self.BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if api_method == "getMe":
+            result = self.BOT_USER
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = self._message(params)
+        else:
+            result = True  # answerCallbackQuery, deleteWebhook, setMyCommands...
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+def make_update_payload(rng, update_id, users=500, feedback_ratio=0.2, repeat_ratio=0.3):
+    """
+    JSON của 1 Update giả như Bot API gửi (tin nhắn hỏi bài hoặc bấm nút 👍/👎) -> (loại, dict).
+    Dùng chung cho LoadGenerator và webhook_client.py (Day 40).
+    """
+    uid = 10_000_000 + rng.randrange(users)
+    user = {"id": uid, "is_bot": False, "first_name": "Load", "username": f"load_{uid}"}
+    chat = {"id": uid, "type": "private"}
+    now = int(time.time())
+    if rng.random() < feedback_ratio:
+        kind = "feedback"
+        payload = {"callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(uid),
+            "data": f"fb_std__{rng.choice(['good', 'bad'])}",
+            "message": {"message_id": update_id, "date": now, "chat": chat,
+                        "from": FakeTelegramRequest.BOT_USER, "text": "Câu trả lời trước đó"},
+        }}
+    else:
+        kind = "message"
+        text = rng.choice(QUESTIONS)
+        if rng.random() >= repeat_ratio:
+            text = f"{text} (#{update_id})"  # Câu hỏi mới -> không trúng AnswerCache
+        payload = {"message": {"message_id": update_id, "date": now, "chat": chat, "from": user, "text": text}}
+    payload["update_id"] = update_id
+    return kind, payload
+
+
+class LoopLagMonitor:
+    """Đo độ trễ event loop: task ngủ `interval` giây, thức dậy muộn bao nhiêu = loop bị chặn bấy nhiêu"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def take(self):
+        samples, self.samples = self.samples, []
+        return samples
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class LoadGenerator:
+    """Sinh Update giả theo quá trình Poisson, ghi lại thời điểm đến và thời điểm handler xử lý xong"""
+
+    def __init__(self, application, users=500, feedback_ratio=0.2, repeat_ratio=0.3, seed=7):
+        self.application = application
+        self.users = users
+        self.feedback_ratio = feedback_ratio
+        self.repeat_ratio = repeat_ratio
+        self.rng = random.Random(seed)
+        self._update_id = 0
+        self.arrived = {}   # update_id -> (loại, thời điểm đến)
+        self.finished = {}  # update_id -> thời điểm xử lý xong
+        # Group rất lớn -> chạy sau khi handler chính của update đã xong
+        application.add_handler(TypeHandler(Update, self._on_done), group=1000)
+
+    async def _on_done(self, update, context):
+        self.finished[update.update_id] = time.perf_counter()
+
+    def _next_update(self):
+        self._update_id += 1
+        kind, payload = make_update_payload(self.rng, self._update_id, self.users, self.feedback_ratio,
+                                            self.repeat_ratio)
+        return kind, Update.de_json(payload, self.application.bot)
+
+    async def run_stage(self, rate, duration):
+        """Bơm update với tốc độ trung bình `rate`/giây trong `duration` giây"""
+        ids = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            kind, update = self._next_update()
+            self.arrived[update.update_id] = (kind, time.perf_counter())
+            ids.append(update.update_id)
+            await self.application.update_queue.put(update)
+            await asyncio.sleep(self.rng.expovariate(rate))
+        return ids
+
+
+def stage_report(generator, ids, rate, duration, lag_samples, drain_seconds):
+    done = [i for i in ids if i in generator.finished]
+    latencies = {"message": [], "feedback": []}
+    for i in done:
+        kind, arrived = generator.arrived[i]
+        latencies[kind].append(generator.finished[i] - arrived)
+    all_latencies = latencies["message"] + latencies["feedback"]
+    report = {
+        "offered_rate": rate,
+        "sent": len(ids),
+        "completed": len(done),
+        "completed_rate": round(len(done) / (duration + drain_seconds), 2),
+        "backlog": len(ids) - len(done),
+        "loop_lag_p50_ms": round(float(np.percentile(lag_samples, 50)) * 1000, 3) if lag_samples else 0.0,
+        "loop_lag_p99_ms": round(float(np.percentile(lag_samples, 99)) * 1000, 3) if lag_samples else 0.0,
+        "loop_lag_max_ms": round(max(lag_samples) * 1000, 3) if lag_samples else 0.0,
+    }
+    if all_latencies:
+        report["e2e"] = summarize(all_latencies, duration + drain_seconds)
+    for kind, values in latencies.items():
+        if values:
+            report[f"e2e_{kind}"] = summarize(values)
+    return report
+
+
+async def run(args):
+    out = os.path.abspath(args.out) if args.out else None
+    workdir = tempfile.mkdtemp(prefix="aimentor-load-")
+    env = {"GEMINI_RPM": str(args.gemini_rpm)} if args.gemini_rpm else {}
+    # import_bot gọi db.setup_database() đồng bộ -> chạy trong thread, không chặn (và không lỗi với DB_ASYNC=1) loop này
+    bot = await asyncio.to_thread(import_bot, workdir, **env)
+    bot.model_v3 = StubGemini(latency=args.gemini_latency, jitter=args.gemini_jitter)
+
+    fake_api = FakeTelegramRequest(latency=args.api_latency)
+    application = bot.build_application(token="123456:load-test", request=fake_api, with_jobs=False,
+                                        concurrent_updates=args.concurrent_updates)
+    generator = LoadGenerator(application, users=args.users, feedback_ratio=args.feedback_ratio,
+                              repeat_ratio=args.repeat_ratio)
+    monitor = LoopLagMonitor()
+
+    await application.initialize()
+    await bot.on_startup(application)
+    await application.start()
+    monitor.start()
+
+    stages = []
+    saturation = None
+    try:
+        for rate in [float(r) for r in args.rates.split(",")]:
+            print(f"▶ {rate:g} update/s trong {args.duration}s...", flush=True)
+            ids = await generator.run_stage(rate, args.duration)
+            # Chờ xử lý nốt (tối đa --drain giây) -> phần còn lại là backlog của mức tải này
+            drain_start = time.perf_counter()
+            while time.perf_counter() - drain_start < args.drain and any(i not in generator.finished for i in ids):
+                await asyncio.sleep(0.05)
+            drain_seconds = time.perf_counter() - drain_start
+            report = stage_report(generator, ids, rate, args.duration, monitor.take(), drain_seconds)
+            stages.append(report)
+            e2e = report.get("e2e", {})
+            print(f"  xong {report['completed']}/{report['sent']} | p50 {e2e.get('p50_ms', 0):.0f}ms "
+                  f"p95 {e2e.get('p95_ms', 0):.0f}ms p99 {e2e.get('p99_ms', 0):.0f}ms | "
+                  f"loop lag p99 {report['loop_lag_p99_ms']:.1f}ms | backlog {report['backlog']}")
+            saturated = report["backlog"] > 0 or e2e.get("p95_ms", 0) > args.slo * 1000
+            if saturated and saturation is None:
+                saturation = rate
+                if not args.keep_going:
+                    break
+            # Mức sau bắt đầu với hàng đợi sạch
+            while any(i not in generator.finished for i in ids):
+                await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+        await application.stop()
+        await bot.on_shutdown(application)
+        await application.shutdown()
+
+    result = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "concurrent_updates": args.concurrent_updates,
+            "gemini_latency_s": args.gemini_latency,
+            "gemini_rpm": args.gemini_rpm,
+            "api_latency_s": args.api_latency,
+            "users": args.users,
+            "slo_p95_s": args.slo,
+        },
+        "stages": stages,
+        "saturation_rate": saturation,
+        "bot_api_calls": fake_api.calls,
+        "gemini_governor": bot.gemini_governor.metrics(),
+    }
+    if saturation is None:
+        print(f"\n✅ Chưa bão hòa tới {stages[-1]['offered_rate']:g} update/s (SLO p95 ≤ {args.slo}s).")
+    else:
+        print(f"\n⚠️ Bão hòa ở ~{saturation:g} update/s (backlog hoặc p95 > {args.slo}s).")
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"💾 Đã ghi kết quả: {out}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test AI Mentor Bot với Bot API + Gemini giả")
+    parser.add_argument("--rates", default="2,5,10,20,40", help="Các mức tải (update/giây), chạy lần lượt")
+    parser.add_argument("--duration", type=float, default=20, help="Số giây cho mỗi mức tải")
+    parser.add_argument("--drain", type=float, default=10, help="Số giây chờ xử lý nốt sau mỗi mức")
+    parser.add_argument("--slo", type=float, default=5.0, help="p95 end-to-end tối đa chấp nhận được (giây)")
+    parser.add_argument("--keep-going", action="store_true", help="Vẫn chạy các mức sau khi đã bão hòa")
+    parser.add_argument("--users", type=int, default=500, help="Số học viên giả")
+    parser.add_argument("--feedback-ratio", type=float, default=0.2, help="Tỉ lệ update là bấm nút 👍/👎")
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="Tỉ lệ câu hỏi lặp lại (trúng cache)")
+    parser.add_argument("--concurrent-updates", type=int, default=None, help="Mặc định: CONCURRENT_UPDATES")
+    parser.add_argument("--gemini-latency", type=float, default=2.0, help="Độ trễ trung bình của Gemini giả (giây)")
+    parser.add_argument("--gemini-jitter", type=float, default=0.5, help="Dao động độ trễ Gemini (tỉ lệ ±)")
+    parser.add_argument("--gemini-rpm", type=int, default=None, help="Quota Gemini (mặc định: không giới hạn)")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="Độ trễ mỗi lời gọi Bot API giả (giây)")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# log_writer.py
+# [DAY 23] Ghi log kiểu write-behind: gom nhiều dòng rồi insert 1 lần, không chặn event loop
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+JOURNAL_FILE = "LogJournal.jsonl"
+
+_STOP = object()
+
+
+class LogWriter:
+    """
+    Hàng đợi async đứng trước CollectorV2 cho log_message / log_feedback / log_health.
+    - Handler chỉ put_nowait() vào queue (không chờ DB).
+    - Task nền gom batch, flush khi đủ `batch_size` dòng hoặc sau `flush_interval` giây.
+    - Mỗi batch là 1 transaction multi-row INSERT chạy trong thread riêng.
+    - Postgres lỗi -> batch được ghi ra file journal, tự replay khi DB hoạt động lại.
+    - Dòng bị DB từ chối (dữ liệu hỏng) được tách bằng cách chia đôi batch, lưu riêng ra file .rejected.jsonl.
+    """
+
+    def __init__(self, db, batch_size=500, flush_interval=2.0, max_queue=20000, journal_file=JOURNAL_FILE):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal_file = journal_file
+        # Vị trí (byte) đã replay xong trong journal, lưu kèm file .offset để restart không ghi trùng
+        self.offset_file = journal_file + ".offset"
+        # Dòng DB từ chối (dữ liệu hỏng) -> để riêng, không replay lại mãi
+        self.reject_file = os.path.splitext(journal_file)[0] + ".rejected.jsonl"
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        self._journal_lock = threading.Lock()
+        self._journal_offset = self._load_offset()
+        self._journal_pending = self._journal_backlog()
+        self.stats = {"written": 0, "spilled": 0, "replayed": 0, "rejected": 0, "batches": 0}
+
+    # --- API CHO HANDLER (KHÔNG BLOCK) ---
+    def log_message(self, user_id, username, message_text, ai_feedback):
+        self._enqueue("message", {
+            "user_id": user_id,
+            "username": username,
+            "message_text": message_text,
+            "ai_feedback_text": ai_feedback,
+        })
+
+    def log_feedback(self, user_id, ai_text, rating, sugg_id):
+        self._enqueue("feedback", {
+            "user_id": user_id,
+            "ai_feedback_text": ai_text,
+            "rating": rating,
+            "suggestion_id": sugg_id,
+        })
+
+    def log_health(self, component, status, message):
+        self._enqueue("health", {
+            "component": component,
+            "status": status,
+            "message": message,
+        })
+
+    def _enqueue(self, kind, row):
+        # Lấy thời gian lúc sự kiện xảy ra, không phải lúc batch được ghi
+        row["timestamp"] = datetime.datetime.now()
+        if self._task is None:
+            # Writer chưa chạy / đã dừng -> ghi thẳng ra journal, lần khởi động sau sẽ replay
+            self._spill([(kind, row)])
+            return
+        try:
+            self._queue.put_nowait((kind, row))
+        except asyncio.QueueFull:
+            logger.warning("LOG WRITER: Hàng đợi đầy, ghi tạm ra journal.")
+            self._spill([(kind, row)])
+
+    # --- VÒNG ĐỜI ---
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("LOG WRITER: Đã khởi động.")
+
+    async def stop(self):
+        """Dừng writer, flush hết các dòng còn trong queue trước khi thoát."""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        # Dòng do handler đẩy vào sau _STOP (đang xử lý dở khi tắt) -> ghi nốt, không bỏ mất
+        leftover = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.batch_size):
+            await self._flush_safe(leftover[start:start + self.batch_size])
+        logger.info(f"LOG WRITER: Đã dừng. Thống kê: {self.stats}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        if self._journal_pending:
+            await asyncio.to_thread(self._replay_journal)
+
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush_safe(batch)
+
+    async def _flush_safe(self, batch):
+        try:
+            await asyncio.to_thread(self._flush, batch)
+        except Exception as e:
+            # Không để 1 batch lỗi làm chết task ghi log -> đẩy ra journal, tiếp tục vòng lặp
+            logger.error(f"LOG WRITER: Lỗi flush batch {len(batch)} dòng, ghi tạm ra journal: {e!r}")
+            self._spill(batch)
+
+    # --- GHI DB ---
+    def _flush(self, batch):
+        rejected_before = self.stats["rejected"]
+        pending = self._write(batch)
+        written = len(batch) - len(pending) - (self.stats["rejected"] - rejected_before)
+        self.stats["written"] += written
+        if pending:
+            self._spill(pending)
+            return
+
+        self.stats["batches"] += 1
+        # DB đã ghi được -> tranh thủ replay phần journal còn tồn
+        if written and self._journal_pending:
+            self._replay_journal()
+
+    def _write(self, batch):
+        """
+        Ghi batch, trả về phần chưa ghi được vì DB không truy cập được (luôn là phần đuôi của batch, [] = xong).
+        Lỗi khác (dòng hỏng, lỗi bất ngờ) -> chia đôi batch để tách dòng hỏng ra reject_file, phần còn lại vẫn ghi.
+        """
+        rows_by_kind = {}
+        for kind, row in batch:
+            rows_by_kind.setdefault(kind, []).append(row)
+        try:
+            return [] if self.db.bulk_insert_logs(rows_by_kind) else batch
+        except Exception as e:
+            if len(batch) == 1:
+                self._reject(batch, e)
+                return []
+        mid = len(batch) // 2
+        pending = self._write(batch[:mid])
+        if pending:
+            # DB mất kết nối giữa chừng -> nửa sau chưa thử
+            return pending + batch[mid:]
+        return self._write(batch[mid:])
+
+    def _reject(self, batch, error):
+        logger.error(f"LOG WRITER: DB từ chối {len(batch)} dòng log ({error!r}), lưu vào {self.reject_file}")
+        try:
+            with open(self.reject_file, "a", encoding="utf-8") as f:
+                for kind, row in batch:
+                    f.write(json.dumps({"kind": kind, "row": row, "error": repr(error)},
+                                       ensure_ascii=False, default=str) + "\n")
+        except Exception as e:
+            logger.error(f"LOG WRITER: Lỗi ghi file reject, mất {len(batch)} dòng log: {e}")
+        self.stats["rejected"] += len(batch)
+
+    # --- JOURNAL (KHI DB KHÔNG TRUY CẬP ĐƯỢC) ---
+    def _spill(self, batch):
+        with self._journal_lock:
+            try:
+                with open(self.journal_file, "a", encoding="utf-8") as f:
+                    for kind, row in batch:
+                        f.write(json.dumps({"kind": kind, "row": row}, ensure_ascii=False, default=str) + "\n")
+                self._journal_pending = True
+                self.stats["spilled"] += len(batch)
+            except Exception as e:
+                logger.error(f"LOG WRITER: Lỗi ghi journal, mất {len(batch)} dòng log: {e}")
+
+    def _journal_backlog(self):
+        """Journal còn phần chưa replay?"""
+        try:
+            return os.path.getsize(self.journal_file) > self._journal_offset
+        except OSError:
+            return False
+
+    def _load_offset(self):
+        try:
+            with open(self.offset_file, "r", encoding="utf-8") as f:
+                offset = int(f.read().strip() or 0)
+            # File vị trí còn sót từ journal cũ đã xóa (crash giữa 2 lần os.remove) -> đọc lại từ đầu
+            return offset if offset <= os.path.getsize(self.journal_file) else 0
+        except (OSError, ValueError):
+            return 0
+
+    def _save_offset(self, offset):
+        self._journal_offset = offset
+        try:
+            tmp_file = self.offset_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(str(offset))
+            os.replace(tmp_file, self.offset_file)
+        except Exception as e:
+            logger.error(f"LOG WRITER: Lỗi lưu vị trí journal: {e}")
+
+    def _replay_journal(self):
+        """
+        Ghi lại phần journal từ vị trí đã replay tới cuối file, theo từng chunk batch_size dòng.
+        Mỗi chunk ghi xong thì lưu vị trí -> DB lỗi giữa chừng chỉ dừng lại, lần sau đọc tiếp từ đó.
+        Đọc hết file thì xóa journal + file vị trí.
+        """
+        # Chỉ đọc phần mới trong lúc giữ lock, phần ghi DB làm ngoài lock (_spill vẫn nối thêm được vào file)
+        with self._journal_lock:
+            if not self._journal_backlog():
+                self._journal_pending = False
+                return
+            try:
+                with open(self.journal_file, "rb") as f:
+                    f.seek(self._journal_offset)
+                    data = f.read()
+            except Exception as e:
+                logger.error(f"LOG WRITER: Lỗi đọc journal: {e}")
+                return
+            self._journal_pending = False
+
+        entries = []  # (kind, row, vị trí cuối dòng trong file)
+        offset = self._journal_offset
+        for line in data.splitlines(keepends=True):
+            offset += len(line)
+            try:
+                entry = json.loads(line)
+                row = entry["row"]
+                row["timestamp"] = datetime.datetime.fromisoformat(row["timestamp"])
+                entries.append((entry["kind"], row, offset))
+            except Exception:
+                continue  # Dòng hỏng (ví dụ bị cắt ngang khi crash)
+
+        replayed = 0
+        for start in range(0, len(entries), self.batch_size):
+            chunk = entries[start:start + self.batch_size]
+            rejected_before = self.stats["rejected"]
+            pending = self._write([(kind, row) for kind, row, _ in chunk])
+            done = len(chunk) - len(pending)
+            replayed += done - (self.stats["rejected"] - rejected_before)
+            if done:
+                self._save_offset(chunk[done - 1][2])
+            if pending:
+                # DB lại lỗi -> dừng ở sau dòng cuối đã ghi, phần còn lại vẫn nằm trong journal
+                with self._journal_lock:
+                    self._journal_pending = True
+                break
+        else:
+            with self._journal_lock:
+                self._save_offset(offset)
+                if self._journal_backlog():
+                    self._journal_pending = True  # Có dòng mới spill vào trong lúc replay
+                else:
+                    self._truncate_journal()
+        self.stats["replayed"] += replayed
+
+        if replayed:
+            logger.info(f"LOG WRITER: Đã replay {replayed} dòng từ journal.")
+
+    def _truncate_journal(self):
+        """Journal đã replay hết (gọi khi giữ _journal_lock)"""
+        try:
+            os.remove(self.journal_file)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"LOG WRITER: Lỗi xóa journal: {e}")
+            return  # Giữ nguyên vị trí đã lưu -> không replay lại từ đầu
+        self._journal_offset = 0
+        try:
+            os.remove(self.offset_file)
+        except FileNotFoundError:
+            pass
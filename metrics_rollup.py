@@ -0,0 +1,64 @@
+# metrics_rollup.py
+# [DAY 35] Bộ đếm sự kiện trong RAM, định kỳ cộng dồn vào bảng metric_rollups (1 dòng / giờ / metric)
+
+import asyncio
+import datetime
+import logging
+import threading
+
+from db_collector import run_db
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsRollup:
+    """
+    - incr(): +n cho metric của giờ hiện tại (chỉ cộng dict, gọi được từ mọi thread).
+    - flush(): ghi toàn bộ bộ đếm tích lũy bằng 1 upsert count = count + n; DB lỗi thì giữ lại cho lần sau.
+    - error_handler(): logging.Handler đếm mọi log ERROR thành metric "error:<tên logger>".
+    Báo cáo đọc bảng rollup (vài chục dòng / ngày) thay vì quét message_logs / system_health.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = {}  # (giờ, metric) -> số lượng chưa ghi
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+
+    def incr(self, metric, n=1):
+        hour = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+        key = (hour, metric)
+        with self._lock:
+            self.pending[key] = self.pending.get(key, 0) + n
+
+    def error_handler(self):
+        rollup = self
+
+        class _ErrorCounter(logging.Handler):
+            def emit(self, record):
+                rollup.incr(f"error:{record.name}")
+
+        return _ErrorCounter(level=logging.ERROR)
+
+    async def flush(self):
+        async with self._flush_lock:
+            with self._lock:
+                counts, self.pending = self.pending, {}
+            if not counts:
+                return 0
+            ok = await run_db(self.db.add_metric_counts, counts)
+            if not ok:
+                # Trả bộ đếm về hàng chờ, lần flush sau thử lại
+                with self._lock:
+                    for key, n in counts.items():
+                        self.pending[key] = self.pending.get(key, 0) + n
+                return 0
+            return len(counts)
+
+    def snapshot(self):
+        """Tổng theo metric của các bộ đếm chưa ghi (cộng vào số liệu đọc từ DB khi báo cáo)"""
+        totals = {}
+        with self._lock:
+            for (_, metric), n in self.pending.items():
+                totals[metric] = totals.get(metric, 0) + n
+        return totals
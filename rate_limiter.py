@@ -0,0 +1,143 @@
+# rate_limiter.py
+# [DAY 26] Giới hạn tốc độ gọi Gemini phía client (RPM + TPM + số lời gọi đồng thời)
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Hàng chờ đã đầy -> phía gọi nên trả lời dự phòng ngay thay vì chờ."""
+
+
+class RateLimitTimeout(Exception):
+    """Không lấy được lượt gọi trước deadline."""
+
+
+class TokenBucket:
+    """Token bucket cổ điển: nạp `rate` token/giây, chứa tối đa `capacity` token."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount=1):
+        """Số giây cần chờ để có đủ `amount` token (0 = có ngay)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount=1):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    async def acquire(self, amount=1, deadline=None):
+        """Chờ tới khi lấy được `amount` token; vượt deadline (monotonic) thì raise RateLimitTimeout."""
+        while True:
+            wait = self.wait_time(amount)
+            if wait <= 0:
+                self.take(amount)
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise RateLimitTimeout(f"Cần chờ {wait:.1f}s, vượt deadline.")
+            await asyncio.sleep(wait)
+
+
+class GeminiGovernor:
+    """
+    Điều phối mọi lời gọi Gemini trong 1 process:
+    - Bucket RPM (request/phút) và TPM (token/phút) theo quota của API key.
+    - Tối đa `max_concurrency` lời gọi chạy cùng lúc.
+    - Hàng chờ có giới hạn `max_queue`: đầy thì báo QueueFullError ngay để bot trả lời dự phòng.
+    - Mỗi lời gọi chờ tối đa `max_wait` giây (hoặc timeout truyền vào).
+    """
+
+    def __init__(self, rpm=15, tpm=1_000_000, max_concurrency=4, max_queue=50, max_wait=15.0):
+        self.request_bucket = TokenBucket(rate=rpm / 60.0, capacity=max(1, rpm // 4))
+        self.token_bucket = TokenBucket(rate=tpm / 60.0, capacity=max(1, tpm // 4))
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket_lock = asyncio.Lock()  # FIFO -> người đến trước được cấp trước
+        self._paused_until = 0.0
+        self.waiting = 0
+        self.in_flight = 0
+        self._recent_waits = deque(maxlen=500)
+        self.stats = {"granted": 0, "rejected": 0, "timeouts": 0, "max_queue_depth": 0, "total_wait": 0.0}
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens=1, timeout=None):
+        """
+        Dùng: async with governor.slot(tokens): await gọi_gemini()
+        """
+        if self.waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise QueueFullError(f"Đang có {self.waiting} yêu cầu Gemini chờ.")
+
+        started = time.monotonic()
+        deadline = started + (timeout if timeout is not None else self.max_wait)
+        self.waiting += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.waiting)
+        acquired = False
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+            acquired = True
+            async with self._bucket_lock:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    if time.monotonic() + pause > deadline:
+                        raise RateLimitTimeout("Gemini đang tạm dừng do bị 429.")
+                    await asyncio.sleep(pause)
+                await self.request_bucket.acquire(1, deadline)
+                await self.token_bucket.acquire(estimated_tokens, deadline)
+        except (asyncio.TimeoutError, RateLimitTimeout) as e:
+            if acquired:
+                self._semaphore.release()
+            self.stats["timeouts"] += 1
+            raise RateLimitTimeout(str(e) or "Hết thời gian chờ lượt gọi Gemini.")
+        except BaseException:
+            if acquired:
+                self._semaphore.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self._recent_waits.append(waited)
+        self.stats["granted"] += 1
+        self.stats["total_wait"] += waited
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def backoff(self, seconds):
+        """Google đã trả 429 -> tạm dừng cấp lượt mới trong `seconds` giây."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f"GEMINI: Bị giới hạn (429), tạm dừng {seconds}s.")
+
+    def metrics(self):
+        waits = sorted(self._recent_waits)
+        p95 = waits[int(len(waits) * 0.95) - 1] if waits else 0.0
+        return {
+            **self.stats,
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "avg_wait": self.stats["total_wait"] / self.stats["granted"] if self.stats["granted"] else 0.0,
+            "p95_wait": p95,
+        }
@@ -0,0 +1,87 @@
+# retention.py
+# [DAY 34] Dọn log theo lô: lưu trữ ra file JSONL nén (gzip) theo tháng trước khi xóa khỏi bảng "nóng"
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import time
+
+from db_collector import LOG_MODELS
+
+logger = logging.getLogger(__name__)
+
+
+class LogRetention:
+    """
+    Mỗi lần run():
+    - Với từng bảng log: lấy lô `batch_size` dòng cũ hơn `days_keep` ngày (cũ nhất trước, dùng index timestamp).
+    - Bảng thuộc `archive_kinds` (dữ liệu huấn luyện: tin nhắn, feedback): ghi nối lô vào
+      `archive_dir/<bảng>-<YYYY-MM>.jsonl.gz` + fsync, rồi mới xóa đúng các id vừa ghi.
+    - Bảng còn lại (system_health): xóa thẳng theo lô.
+    Crash giữa lúc ghi file và xóa -> lần sau lô đó được ghi lại (trùng dòng, không mất dòng); lọc trùng theo `id`.
+    """
+
+    def __init__(self, db, archive_dir="archive", days_keep=30, batch_size=5000, pause=0.05,
+                 kinds=("message", "feedback", "health"), archive_kinds=("message", "feedback")):
+        self.db = db
+        self.archive_dir = archive_dir
+        self.days_keep = days_keep
+        self.batch_size = batch_size
+        self.pause = pause  # Nghỉ giữa các lô, nhường DB cho luồng ghi log
+        self.kinds = kinds
+        self.archive_kinds = archive_kinds
+
+    def _archive(self, kind, rows):
+        """Ghi lô vào file của từng tháng (theo timestamp của dòng)"""
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row["timestamp"].strftime("%Y-%m"), []).append(row)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for month, month_rows in by_month.items():
+            path = os.path.join(self.archive_dir, f"{LOG_MODELS[kind].__tablename__}-{month}.jsonl.gz")
+            # Mở chế độ append -> mỗi lô là 1 gzip member, gunzip / gzip.open đọc nối tiếp bình thường
+            with open(path, "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="ab") as f:
+                    for row in month_rows:
+                        f.write((json.dumps(row, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def _run_kind(self, kind, cutoff, should_continue):
+        archive = kind in self.archive_kinds
+        total = 0
+        while should_continue():
+            if archive:
+                rows = self.db.get_expired_logs(kind, cutoff, self.batch_size)
+                if not rows:
+                    break
+                self._archive(kind, rows)
+                deleted = self.db.delete_logs_by_id(kind, [row["id"] for row in rows])
+                batch = len(rows)
+            else:
+                deleted = batch = self.db.delete_expired_logs(kind, cutoff, self.batch_size)
+            total += deleted
+            if batch < self.batch_size or not deleted:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def run(self, should_continue=None):
+        """
+        Chạy đồng bộ (gọi qua asyncio.to_thread). Trả về {loại log: số dòng đã xóa}.
+        should_continue(): kiểm tra trước mỗi lô, False -> dừng (ví dụ job mất lease, Day 41).
+        """
+        should_continue = should_continue or (lambda: True)
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=self.days_keep)
+        counts = {}
+        for kind in self.kinds:
+            try:
+                counts[kind] = self._run_kind(kind, cutoff, should_continue)
+            except Exception as e:
+                # Ví dụ: hết dung lượng đĩa khi ghi file -> dừng bảng này, chưa xóa lô đang dở
+                logger.error(f"RETENTION: Lỗi dọn log '{kind}': {e}")
+                counts[kind] = 0
+        logger.info(f"RETENTION: Đã lưu trữ/xóa {counts} (giữ {self.days_keep} ngày).")
+        return counts
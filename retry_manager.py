@@ -2,55 +2,123 @@ import json
 import os
 import logging
 import datetime
+import sqlite3
+import threading
+import time
 
 logger = logging.getLogger(__name__)
-RETRY_FILE = "LogRetry.json"
+RETRY_FILE = "LogRetry.json"  # Định dạng cũ, chỉ còn dùng để chuyển dữ liệu sang RETRY_DB
+RETRY_DB = "LogRetry.db"
 
 
 class RetryManager:
-    def __init__(self):
-        # Nếu file chưa tồn tại thì tạo file rỗng
-        if not os.path.exists(RETRY_FILE):
-            self.save_queue([])
+    """
+    Hàng đợi tin nhắn gửi lỗi (Day 25: lưu bằng SQLite WAL thay vì ghi đè cả file JSON).
+    - add_message(): 1 lệnh INSERT, O(1) bất kể hàng đợi dài bao nhiêu.
+    - pop_batch(): lấy tin trong 1 transaction và "cho mượn" (lease) chúng một thời gian.
+    - ack(): xóa tin đã gửi thành công. Tin không được ack sẽ tự xuất hiện lại khi hết lease,
+      nên bot có crash giữa chừng cũng không mất tin.
+    """
+
+    def __init__(self, db_file=RETRY_DB, lease_seconds=600, max_attempts=10):
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS retry_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                added_at TEXT NOT NULL,
+                reason TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                visible_at REAL NOT NULL DEFAULT 0
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_retry_visible ON retry_queue (visible_at, id)")
+        self._migrate_json_queue()
 
-    def load_queue(self):
-        """Đọc danh sách tin nhắn đang chờ thử lại"""
+    def _migrate_json_queue(self):
+        """Chuyển hàng đợi LogRetry.json cũ (nếu có) sang SQLite, chỉ chạy 1 lần"""
+        if not os.path.exists(RETRY_FILE):
+            return
         try:
             with open(RETRY_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
+                old_queue = json.load(f)
+            with self._lock:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.executemany(
+                    "INSERT INTO retry_queue (chat_id, text, added_at, reason, attempts) VALUES (?, ?, ?, ?, ?)",
+                    [(m['chat_id'], m['text'], m.get('added_at', ''), m.get('reason'), m.get('attempts', 0))
+                     for m in old_queue]
+                )
+                self.conn.execute("COMMIT")
+            os.replace(RETRY_FILE, RETRY_FILE + ".migrated")
+            logger.info(f"RETRY: Đã chuyển {len(old_queue)} tin nhắn từ {RETRY_FILE} sang {self.db_file}.")
         except Exception as e:
-            logger.error(f"Lỗi đọc Retry Queue: {e}")
-            return []
+            logger.error(f"Lỗi chuyển Retry Queue cũ: {e}")
 
-    def save_queue(self, queue_data):
-        """Lưu danh sách xuống file"""
+    def add_message(self, chat_id, text, reason):
+        """Thêm một tin nhắn thất bại vào hàng đợi"""
         try:
-            with open(RETRY_FILE, "w", encoding="utf-8") as f:
-                json.dump(queue_data, f, ensure_ascii=False, indent=4)
+            with self._lock:
+                self.conn.execute(
+                    "INSERT INTO retry_queue (chat_id, text, added_at, reason) VALUES (?, ?, ?, ?)",
+                    (chat_id, text, str(datetime.datetime.now()), str(reason))
+                )
+            logger.warning(f"RETRY: Đã thêm tin nhắn gửi cho {chat_id} vào hàng đợi.")
         except Exception as e:
             logger.error(f"Lỗi ghi Retry Queue: {e}")
 
-    def add_message(self, chat_id, text, reason):
-        """Thêm một tin nhắn thất bại vào hàng đợi"""
-        queue = self.load_queue()
-        queue.append({
-            "chat_id": chat_id,
-            "text": text,
-            "added_at": str(datetime.datetime.now()),
-            "reason": str(reason),
-            "attempts": 0  # Số lần đã thử lại
-        })
-        self.save_queue(queue)
-        logger.warning(f"RETRY: Đã thêm tin nhắn gửi cho {chat_id} vào hàng đợi.")
-
     def pop_batch(self, limit=5):
-        """Lấy ra một nhóm tin nhắn để thử gửi lại"""
-        queue = self.load_queue()
-        if not queue:
+        """Lấy ra một nhóm tin nhắn để thử gửi lại (phải gọi ack() khi gửi thành công)"""
+        now = time.time()
+        try:
+            with self._lock:
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Tin đã thử quá nhiều lần -> bỏ hẳn
+                    dropped = self.conn.execute(
+                        "DELETE FROM retry_queue WHERE attempts >= ? AND visible_at <= ?",
+                        (self.max_attempts, now)
+                    ).rowcount
+                    rows = self.conn.execute(
+                        "SELECT id, chat_id, text, added_at, reason, attempts FROM retry_queue "
+                        "WHERE visible_at <= ? ORDER BY id LIMIT ?",
+                        (now, limit)
+                    ).fetchall()
+                    if rows:
+                        self.conn.executemany(
+                            "UPDATE retry_queue SET attempts = attempts + 1, visible_at = ? WHERE id = ?",
+                            [(now + self.lease_seconds, row[0]) for row in rows]
+                        )
+                    self.conn.execute("COMMIT")
+                except Exception:
+                    self.conn.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            logger.error(f"Lỗi đọc Retry Queue: {e}")
             return []
 
-        batch = queue[:limit]  # Lấy 5 tin đầu tiên
-        remaining = queue[limit:]  # Giữ lại phần còn lại
+        if dropped:
+            logger.warning(f"RETRY: Bỏ {dropped} tin nhắn đã thử quá {self.max_attempts} lần.")
+        return [
+            {"id": r[0], "chat_id": r[1], "text": r[2], "added_at": r[3], "reason": r[4], "attempts": r[5] + 1}
+            for r in rows
+        ]
+
+    def ack(self, item_id):
+        """Xác nhận đã gửi thành công -> xóa khỏi hàng đợi"""
+        try:
+            with self._lock:
+                self.conn.execute("DELETE FROM retry_queue WHERE id = ?", (item_id,))
+        except Exception as e:
+            logger.error(f"Lỗi ack Retry Queue: {e}")
 
-        self.save_queue(remaining)  # Lưu lại danh sách đã bớt
-        return batch
\ No newline at end of file
+    def size(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM retry_queue").fetchone()[0]
@@ -1,9 +1,19 @@
 import requests
+import httpx
+import asyncio
 from bs4 import BeautifulSoup
+from urllib.parse import urlsplit
+import hashlib
+import json
 import logging
+import os
 import random
+import time
+
+from instrumentation import SCRAPER_SOURCE_SECONDS
 
 logger = logging.getLogger(__name__)
+CACHE_FILE = "ScraperCache.json"
 
 # Giả lập trình duyệt thật để tránh bị chặn (User-Agent Rotation)
 USER_AGENTS = [
@@ -97,64 +107,221 @@ SOURCES = [
 ]
 
 
-def scrape_all_sources():
-    """Hàm chính để chạy qua 10 nguồn và lấy dữ liệu"""
+# --- [DAY 24] CACHE CONDITIONAL REQUEST (ETag / Last-Modified / hash nội dung) ---
+class ResponseCache:
+    """
+    Lưu ETag, Last-Modified và hash HTML của từng nguồn giữa các lượt quét.
+    Lượt sau gửi If-None-Match / If-Modified-Since; nhận 304 hoặc HTML y hệt thì bỏ qua bước parse.
+    Validator mới chỉ được stage(); người gọi commit() sau khi đã import xong các bài của lượt quét,
+    nên parse / import lỗi hoặc job bị hủy thì lượt sau vẫn tải và parse lại trang.
+    """
+
+    def __init__(self, cache_file=CACHE_FILE):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.staged = {}
+        self.dirty = False
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.warning(f"Không đọc được cache scraper, bỏ qua: {e}")
+
+    def request_headers(self, url):
+        headers = get_headers()
+        entry = self.entries.get(url, {})
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def is_unchanged(self, url, status_code, response_headers, content):
+        """True nếu nguồn không đổi so với lượt trước (304 hoặc cùng hash với bản đã import)"""
+        if status_code == 304:
+            return True
+        return self.entries.get(url, {}).get("hash") == hashlib.sha256(content).hexdigest()
+
+    def stage(self, url, response_headers, content):
+        """Ghi nhận validator của response vừa xử lý xong, chưa có hiệu lực cho tới commit()"""
+        self.staged[url] = {
+            "etag": response_headers.get("ETag"),
+            "last_modified": response_headers.get("Last-Modified"),
+            "hash": hashlib.sha256(content).hexdigest(),
+        }
+
+    def commit(self):
+        """Gọi sau khi import thành công: áp dụng các validator đã stage"""
+        for url, entry in self.staged.items():
+            if self.entries.get(url) != entry:
+                self.entries[url] = entry
+                self.dirty = True
+        self.staged = {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            tmp_file = self.cache_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_file, self.cache_file)
+            self.dirty = False
+        except Exception as e:
+            logger.error(f"Lỗi ghi cache scraper: {e}")
+
+
+def parse_source(source, html):
+    """Bóc tách tối đa 3 bài (title + link) từ HTML của một nguồn"""
+    results = []
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Tìm các container
+    containers = soup.find_all(source['container'].get('tag'), class_=source['container'].get('class_'))
+
+    for item in containers[:3]:  # Lấy tối đa 3 bài mỗi web
+        try:
+            # Tìm Link
+            link_node = item
+            if source['link']:
+                link_node = item.find(source['link'].get('tag'), class_=source['link'].get('class_'))
+
+            if not link_node or not link_node.has_attr('href'): continue
+
+            url_link = link_node['href']
+            # Xử lý link tương đối (/news/...)
+            if url_link.startswith("/"):
+                base_url = "/".join(source['url'].split("/")[:3])
+                url_link = base_url + url_link
+
+            # Tìm Title
+            title_text = ""
+            if source['title']:
+                title_node = item.find(source['title'].get('tag'), class_=source['title'].get('class_'))
+                if title_node: title_text = title_node.get_text().strip()
+            else:
+                # Nếu không cấu hình title, lấy text của chính link_node
+                title_text = link_node.get_text().strip()
+
+            if title_text and url_link:
+                results.append({
+                    'keyword': source['name'],  # Dùng tên web làm keyword
+                    'text': f"[{source['name']}] {title_text}",
+                    'link': url_link
+                })
+        except Exception as e:
+            continue  # Bỏ qua bài lỗi, sang bài tiếp
+
+    return results
+
+
+def scrape_all_sources(cache=None):
+    """
+    Hàm chính để chạy qua 10 nguồn và lấy dữ liệu (bản đồng bộ, dùng cho script chạy tay).
+    cache: ResponseCache để gửi request có điều kiện; người gọi commit() + save() sau khi import xong.
+    """
     all_results = []
     logger.info(f"SCRAPER: Bắt đầu quét {len(SOURCES)} nguồn dữ liệu...")
 
     for source in SOURCES:
         try:
             logger.info(f"Scraping: {source['name']}...")
-            response = requests.get(source['url'], headers=get_headers(), timeout=15)
+            headers = cache.request_headers(source['url']) if cache else get_headers()
+            response = requests.get(source['url'], headers=headers, timeout=15)
 
-            if response.status_code != 200:
+            if response.status_code not in (200, 304):
                 logger.warning(f"-> Thất bại {source['name']} (Status {response.status_code})")
                 continue
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # Tìm các container
-            containers = soup.find_all(source['container'].get('tag'), class_=source['container'].get('class_'))
-
-            count_per_site = 0
-            for item in containers[:3]:  # Lấy tối đa 3 bài mỗi web
-                try:
-                    # Tìm Link
-                    link_node = item
-                    if source['link']:
-                        link_node = item.find(source['link'].get('tag'), class_=source['link'].get('class_'))
-
-                    if not link_node or not link_node.has_attr('href'): continue
-
-                    url_link = link_node['href']
-                    # Xử lý link tương đối (/news/...)
-                    if url_link.startswith("/"):
-                        base_url = "/".join(source['url'].split("/")[:3])
-                        url_link = base_url + url_link
-
-                    # Tìm Title
-                    title_text = ""
-                    if source['title']:
-                        title_node = item.find(source['title'].get('tag'), class_=source['title'].get('class_'))
-                        if title_node: title_text = title_node.get_text().strip()
-                    else:
-                        # Nếu không cấu hình title, lấy text của chính link_node
-                        title_text = link_node.get_text().strip()
-
-                    if title_text and url_link:
-                        all_results.append({
-                            'keyword': source['name'],  # Dùng tên web làm keyword
-                            'text': f"[{source['name']}] {title_text}",
-                            'link': url_link
-                        })
-                        count_per_site += 1
-                except Exception as e:
-                    continue  # Bỏ qua bài lỗi, sang bài tiếp
-
-            logger.info(f"-> {source['name']}: Lấy được {count_per_site} bài.")
+            if cache and cache.is_unchanged(source['url'], response.status_code, response.headers, response.content):
+                if response.status_code == 200:
+                    cache.stage(source['url'], response.headers, response.content)
+                logger.info(f"-> {source['name']}: Không có gì mới, bỏ qua.")
+                continue
+
+            items = parse_source(source, response.content)
+            if cache:
+                cache.stage(source['url'], response.headers, response.content)
+            all_results.extend(items)
+            logger.info(f"-> {source['name']}: Lấy được {len(items)} bài.")
 
         except Exception as e:
             logger.error(f"-> Lỗi nguồn {source['name']}: {e}")
 
     logger.info(f"SCRAPER: Tổng cộng thu thập được {len(all_results)} bài viết.")
-    return all_results
\ No newline at end of file
+    return all_results
+
+
+# ==============================================================================
+# [DAY 23] SCRAPER BẤT ĐỒNG BỘ (không chặn event loop của bot)
+# ==============================================================================
+
+async def _scrape_source_async(client, source, host_limits, per_host_limit, cache=None):
+    host = urlsplit(source['url']).netloc
+    semaphore = host_limits.setdefault(host, asyncio.Semaphore(per_host_limit))
+    start = time.perf_counter()
+    result = "cancelled"  # [DAY 38] Bị hủy do hết deadline -> không vào nhánh nào bên dưới
+    try:
+        headers = cache.request_headers(source['url']) if cache else get_headers()
+        async with semaphore:
+            response = await client.get(source['url'], headers=headers)
+
+        if response.status_code not in (200, 304):
+            result = "http_error"
+            logger.warning(f"-> Thất bại {source['name']} (Status {response.status_code})")
+            return []
+
+        if cache and cache.is_unchanged(source['url'], response.status_code, response.headers, response.content):
+            result = "unchanged"
+            if response.status_code == 200:
+                cache.stage(source['url'], response.headers, response.content)  # Cùng nội dung, validator mới
+            logger.info(f"-> {source['name']}: Không có gì mới, bỏ qua.")
+            return []
+
+        # BeautifulSoup tốn CPU -> đẩy sang thread, event loop vẫn trả lời người dùng
+        items = await asyncio.to_thread(parse_source, source, response.content)
+        if cache:
+            cache.stage(source['url'], response.headers, response.content)
+        result = "ok"
+        logger.info(f"-> {source['name']}: Lấy được {len(items)} bài.")
+        return items
+    except Exception as e:
+        result = "error"
+        logger.error(f"-> Lỗi nguồn {source['name']}: {e!r}")
+        return []
+    finally:
+        SCRAPER_SOURCE_SECONDS.observe(time.perf_counter() - start, source=source['name'], result=result)
+
+
+async def scrape_all_sources_async(deadline=60, per_host_limit=2, timeout=15, cache=None):
+    """
+    Quét song song toàn bộ SOURCES qua 1 AsyncClient dùng chung (keep-alive pool).
+    - per_host_limit: số request đồng thời tối đa tới cùng 1 host.
+    - deadline: tổng thời gian tối đa cho cả lượt quét, nguồn nào chưa xong thì bỏ.
+    - cache: ResponseCache (Day 24); nguồn bị hủy do hết deadline không được stage.
+      Người gọi commit() + save() sau khi import thành công.
+    """
+    logger.info(f"SCRAPER: Bắt đầu quét song song {len(SOURCES)} nguồn dữ liệu...")
+    limits = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+    host_limits = {}
+    all_results = []
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True) as client:
+        tasks = [
+            asyncio.create_task(_scrape_source_async(client, source, host_limits, per_host_limit, cache))
+            for source in SOURCES
+        ]
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"SCRAPER: Hết thời gian {deadline}s, bỏ qua {len(pending)} nguồn chưa xong.")
+
+        for task in tasks:
+            if task in done and not task.cancelled():
+                all_results.extend(task.result())
+
+    logger.info(f"SCRAPER: Tổng cộng thu thập được {len(all_results)} bài viết.")
+    return all_results
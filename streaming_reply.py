@@ -0,0 +1,107 @@
+# streaming_reply.py
+# [DAY 27] Trả lời dần dần: gửi placeholder ngay, sau đó edit tin nhắn khi Gemini stream từng đoạn
+
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MAX_LEN = 4096
+
+
+def retry_after_seconds(error):
+    """RetryAfter.retry_after có thể là int hoặc timedelta tùy phiên bản python-telegram-bot"""
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class ProgressiveReply:
+    """
+    Một tin nhắn trả lời được cập nhật nhiều lần.
+    - start(): gửi placeholder ngay khi bắt đầu gọi Gemini.
+    - update(): edit nội dung tạm, tối đa 1 lần / `min_interval` giây (giới hạn edit của Telegram).
+    - finish(): edit lần cuối với nội dung đầy đủ + bàn phím feedback (bị flood-wait thì chờ rồi edit lại,
+      tối đa `final_attempts` lần; vẫn không edit được thì xóa placeholder, gửi tin mới).
+    """
+
+    def __init__(self, message, placeholder="⏳ Mình đang suy nghĩ...", min_interval=1.5, min_new_chars=30,
+                 final_attempts=3):
+        self.message = message
+        self.final_attempts = final_attempts
+        self.placeholder = placeholder
+        self.min_interval = min_interval
+        self.min_new_chars = min_new_chars
+        self.sent = None
+        self._last_edit = 0.0
+        self._last_len = 0
+        self._next_allowed = 0.0
+
+    async def start(self):
+        if self.sent is None:
+            self.sent = await self.message.reply_text(self.placeholder)
+            self._last_edit = time.monotonic()
+
+    async def update(self, partial_text):
+        if self.sent is None:
+            await self.start()
+        now = time.monotonic()
+        if now < self._next_allowed or now - self._last_edit < self.min_interval:
+            return
+        if len(partial_text) - self._last_len < self.min_new_chars:
+            return
+        # Bản tạm gửi dạng text thường: markdown đang dở (thiếu ``` hay **) sẽ bị Telegram từ chối
+        preview = partial_text[:TELEGRAM_MAX_LEN - 2] + " ▌"
+        try:
+            await self.sent.edit_text(preview)
+            self._last_len = len(partial_text)
+        except RetryAfter as e:
+            self._next_allowed = now + retry_after_seconds(e)
+        except BadRequest as e:
+            logger.debug(f"Bỏ qua edit tạm: {e}")
+        self._last_edit = time.monotonic()
+
+    async def finish(self, text, reply_markup=None, parse_mode="Markdown"):
+        """Gửi nội dung cuối. Chưa start (ví dụ trả lời từ cache) thì gửi tin nhắn mới như bình thường."""
+        if self.sent is None:
+            return await self.message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        try:
+            try:
+                return await self._edit_final(text, reply_markup, parse_mode)
+            except BadRequest as e:
+                if parse_mode is None:
+                    raise
+                # Markdown do Gemini sinh ra không hợp lệ -> edit lại dạng text thường
+                logger.warning(f"Edit cuối lỗi ({e}), thử lại không parse_mode.")
+            return await self._edit_final(text, reply_markup, None)
+        except (BadRequest, RetryAfter) as e:
+            # Không edit được -> xóa placeholder (đang chứa câu trả lời dở) rồi gửi tin mới
+            logger.warning(f"Không edit được tin trả lời ({e}), gửi tin mới.")
+            await self._delete_placeholder()
+            return await self.message.reply_text(text, reply_markup=reply_markup)
+
+    async def _edit_final(self, text, reply_markup, parse_mode):
+        """Edit cuối: flood-wait -> chờ rồi edit lại; "message is not modified" coi như đã xong"""
+        for attempt in range(self.final_attempts):
+            wait = self._next_allowed - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await self.sent.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+            except RetryAfter as e:
+                if attempt == self.final_attempts - 1:
+                    raise
+                self._next_allowed = time.monotonic() + retry_after_seconds(e)
+                logger.warning(f"Edit cuối bị giới hạn, chờ {retry_after_seconds(e):.0f}s rồi edit lại.")
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return self.sent
+                raise
+
+    async def _delete_placeholder(self):
+        try:
+            await self.sent.delete()
+        except Exception as e:
+            logger.debug(f"Không xóa được placeholder: {e}")
@@ -2,8 +2,10 @@ import time
 import random
 import logging
 import os
+import asyncio
 from dotenv import load_dotenv
 from db_collector import CollectorV2
+from log_writer import LogWriter
 
 # Cấu hình logging chỉ hiện Info
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
@@ -36,7 +38,7 @@ def run_stress_test(num_records=1000):
             user_id=user_id,
             username=f"User_{i}",
             message_text=f"Stress test message {i} - Load testing...",
-            ai_feedback_text="Stress test AI response"
+            ai_feedback="Stress test AI response"
         )
         if res: success_count += 1
 
@@ -59,6 +61,33 @@ def run_stress_test(num_records=1000):
     print(f"⏱️ Thời gian Query: {read_duration:.4f}s")
 
 
+async def run_batched_write_test(num_records=5000):
+    """[DAY 23] Đo tốc độ ghi qua LogWriter (gom batch, multi-row INSERT)"""
+    print(f"\n📦 BẮT ĐẦU TEST GHI THEO BATCH: {num_records} log giả...")
+
+    db = CollectorV2(DATABASE_URL)
+    writer = LogWriter(db, journal_file="StressJournal.jsonl")
+    await writer.start()
+
+    start_time = time.time()
+    for i in range(num_records):
+        writer.log_message(
+            user_id=random.randint(1000000, 9999999),
+            username=f"User_{i}",
+            message_text=f"Stress test message {i} - Batched...",
+            ai_feedback="Stress test AI response"
+        )
+    enqueue_duration = time.time() - start_time
+
+    # stop() chờ flush hết queue -> tính luôn thời gian ghi xuống DB
+    await writer.stop()
+    duration = time.time() - start_time
+    print(f"✅ KẾT THÚC GHI BATCH. Thống kê: {writer.stats}")
+    print(f"⏱️ Đẩy vào queue: {enqueue_duration:.3f}s | Tổng (tới khi flush xong): {duration:.2f}s "
+          f"(Trung bình: {num_records / duration:.0f} req/s)")
+
+
 if __name__ == "__main__":
     # Chạy thử với 500 dòng (bạn có thể tăng lên 1000, 5000 nếu muốn thử thách Render)
-    run_stress_test(num_records=500)
\ No newline at end of file
+    run_stress_test(num_records=500)
+    asyncio.run(run_batched_write_test(num_records=5000))
\ No newline at end of file
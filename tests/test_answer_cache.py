@@ -0,0 +1,32 @@
+# tests/test_answer_cache.py
+# [DAY 25] Khóa cache câu trả lời Gemini: giữ dấu tiếng Việt, chỉ bỏ khác biệt về hoa/thường, khoảng trắng, dạng Unicode
+
+import os
+import sys
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answer_cache import AnswerCache
+
+
+def test_tone_marks_give_different_keys():
+    cache = AnswerCache()
+    keys = {cache.make_key(q) for q in ("bạn là ai", "bán là ai", "ban la ai")}
+    assert len(keys) == 3
+    keys = {cache.make_key(q) for q in ("Đá có cứng không?", "dạ có cưng không?", "da co cung khong?")}
+    assert len(keys) == 3
+
+
+def test_case_whitespace_and_unicode_form_are_normalized():
+    cache = AnswerCache()
+    key = cache.make_key("bạn là ai")
+    assert cache.make_key("  BẠN   là\tAI ") == key
+    assert cache.make_key(unicodedata.normalize("NFD", "bạn là ai")) == key
+
+
+def test_history_tone_marks_are_part_of_key():
+    cache = AnswerCache()
+    question = "giải thích thêm"
+    assert (cache.make_key(question, [{"role": "user", "content": "bán là ai"}])
+            != cache.make_key(question, [{"role": "user", "content": "bạn là ai"}]))
@@ -0,0 +1,76 @@
+# tests/test_async_collector.py
+# [DAY 42] AsyncCollector: gọi đồng bộ trên event loop phải báo lỗi, run_db / thread khác chạy được.
+# Phần Postgres thật (asyncpg) chỉ chạy khi có TEST_POSTGRES_URL, ví dụ:
+#   TEST_POSTGRES_URL=postgresql://postgres@/postgres?host=/tmp/pgdata python -m pytest -q tests
+
+import asyncio
+import datetime
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_collector import AsyncCollector
+from db_collector import run_db
+
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    db = AsyncCollector(f"sqlite:///{tmp_path / 'test.db'}")
+    yield db
+    db.close()
+
+
+def test_sync_call_on_running_loop_raises(sqlite_db):
+    async def main():
+        with pytest.raises(RuntimeError, match="run_db"):
+            sqlite_db.setup_database()
+        assert await run_db(sqlite_db.setup_database)
+        # Thread khác (không có event loop) vẫn gọi đồng bộ được
+        return await asyncio.to_thread(sqlite_db.import_content_batch, [
+            {"keyword": "Test", "text": "Bài 1", "link": "https://example.com/1"},
+        ])
+
+    assert asyncio.run(main()) == 1
+    assert sqlite_db.import_content_batch([{"keyword": "Test", "text": "Bài 1", "link": "https://example.com/1"}]) == 0
+
+
+@pytest.mark.skipif(not POSTGRES_URL, reason="Cần TEST_POSTGRES_URL (Postgres thật, chạy qua asyncpg)")
+def test_postgres_roundtrip():
+    db = AsyncCollector(POSTGRES_URL, pool_size=2, max_overflow=0)
+    suffix = uuid.uuid4().hex[:8]
+    job = f"test-job-{suffix}"
+
+    async def main():
+        assert await run_db(db.setup_database)
+        assert await run_db(db.setup_database)  # Chạy lại trên bảng đã có: không lỗi
+
+        items = [{"keyword": "Test", "text": f"Bài {i}", "link": f"https://example.com/{suffix}/{i}"} for i in range(5)]
+        assert await run_db(db.import_content_batch, items) == 5
+        # ON CONFLICT DO NOTHING ... RETURNING: chỉ đếm link mới
+        items.append({"keyword": "Test", "text": "Bài mới", "link": f"https://example.com/{suffix}/new"})
+        assert await run_db(db.import_content_batch, items) == 1
+
+        now = datetime.datetime.now()
+        rows = {"message": [{"timestamp": now, "user_id": 42, "username": "test",
+                             "message_text": f"hi {suffix}", "ai_feedback_text": "ok"}]}
+        assert await run_db(db.bulk_insert_logs, rows) is True
+
+        assert await run_db(db.acquire_job_lease, job, "replica-a", 60)
+        assert not await run_db(db.acquire_job_lease, job, "replica-b", 60)
+        assert await run_db(db.renew_job_lease, job, "replica-a", 60)
+        assert not await run_db(db.renew_job_lease, job, "replica-b", 60)
+        assert await run_db(db.release_job_lease, job, "replica-a", True)
+        # Vừa chạy xong -> min_interval chặn replica khác chạy lại
+        assert not await run_db(db.acquire_job_lease, job, "replica-b", 60, 3600)
+        assert await run_db(db.acquire_job_lease, job, "replica-b", 60, 0)
+
+    try:
+        asyncio.run(main())
+    finally:
+        db.close()
@@ -0,0 +1,39 @@
+# text_utils.py
+# [DAY 25] Các hàm chuẩn hóa văn bản tiếng Việt dùng chung (cache câu trả lời, tìm kiếm...)
+
+import re
+import unicodedata
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def fold_diacritics(text):
+    """Bỏ dấu tiếng Việt: 'Lỗi Python đây' -> 'Loi Python day'"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    # 'đ/Đ' không tách được bằng NFKD
+    return stripped.replace("đ", "d").replace("Đ", "D")
+
+
+def normalize_text(text):
+    """Chữ thường + bỏ dấu + gộp khoảng trắng, dùng cho tìm kiếm (BM25, vector)"""
+    if not text:
+        return ""
+    text = fold_diacritics(text.casefold())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def normalize_key(text):
+    """
+    Chữ thường + gộp khoảng trắng, GIỮ dấu (chỉ chuẩn hóa về NFC): dùng làm khóa cache câu trả lời.
+    Bỏ dấu sẽ gộp "bán là ai" với "bạn là ai" -> trả nhầm câu trả lời của câu hỏi khác.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFC", text).casefold()
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def estimate_tokens(text):
+    """Ước lượng nhanh số token (~4 ký tự / token), đủ dùng cho rate limit và cắt ngữ cảnh"""
+    return len(text or "") // 4 + 1
@@ -0,0 +1,334 @@
+# vector_index.py
+# [DAY 32] Tìm kiếm ngữ nghĩa (gần đúng) cho content_db: vector n-gram ký tự băm, ma trận float32 memory-map
+#
+# Dựng offline:   python vector_index.py build            (đọc DATABASE_URL, ghi lại toàn bộ file index)
+# Thử truy vấn:   python vector_index.py query "sửa bug python"
+
+import argparse
+import json
+import logging
+import os
+import threading
+import zlib
+
+import numpy as np
+
+from bm25_index import tokenize
+
+logger = logging.getLogger(__name__)
+INDEX_PREFIX = "SuggestionVectors"
+
+
+def _fingerprint(record):
+    """Dấu vân tay nội dung đã embed -> biết bản ghi nào đổi text cần embed lại"""
+    raw = f"{record.get('keyword') or ''}\x00{record.get('suggestion_text') or ''}"
+    return zlib.crc32(raw.encode("utf-8"))
+
+
+class HashingEncoder:
+    """
+    Encoder chạy CPU, không cần model: từ (đã bỏ dấu, bỏ hư từ) + n-gram ký tự trong từng từ,
+    băm vào `dim` chiều có dấu (+/-), chuẩn hóa L2 -> tích vô hướng = cosine.
+    "python bị lỗi" và "sửa lỗi python" chung nhiều n-gram ("pyt", "hon", "loi"...) nên vẫn gần nhau.
+    """
+
+    def __init__(self, dim=256, ngram_range=(3, 4), word_weight=2.0):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.word_weight = word_weight
+
+    def _features(self, text):
+        buckets, weights = [], []
+        for word in tokenize(text):
+            features = [(word, self.word_weight)]
+            padded = f"<{word}>"
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                features.extend((padded[i:i + n], 1.0) for i in range(len(padded) - n + 1))
+            for feature, weight in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                buckets.append(h % self.dim)
+                weights.append(weight if h & 0x80000000 else -weight)  # bit cao làm dấu -> giảm va chạm cộng dồn
+        return buckets, weights
+
+    def encode(self, text):
+        buckets, weights = self._features(text)
+        if not buckets:
+            return np.zeros(self.dim, dtype=np.float32)
+        vec = np.bincount(buckets, weights=weights, minlength=self.dim).astype(np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+    def encode_records(self, records):
+        matrix = np.zeros((len(records), self.dim), dtype=np.float32)
+        for i, rec in enumerate(records):
+            matrix[i] = self.encode(f"{rec.get('keyword') or ''} {rec.get('suggestion_text') or ''}")
+        return matrix
+
+
+def _train_centroids(matrix, n_lists, iters=10, sample_per_list=64, seed=0):
+    """K-means cầu (cosine) trên một mẫu hàng -> `n_lists` tâm đã chuẩn hóa L2"""
+    rng = np.random.default_rng(seed)
+    n_rows = len(matrix)
+    picked = np.sort(rng.choice(n_rows, min(n_rows, n_lists * sample_per_list), replace=False))
+    sample = np.asarray(matrix[picked], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=n_lists) == 0
+        if empty.any():
+            # Tâm không có hàng nào -> gieo lại bằng hàng ngẫu nhiên
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.where(norms > 0, norms, 1.0)
+    return centroids.astype(np.float32)
+
+
+def _assign(vectors, centroids, chunk_size=8192):
+    """Tâm gần nhất (cosine) của từng hàng, tính theo chunk để không dựng ma trận N x n_lists"""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        out[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+class VectorIndex:
+    """
+    File trên đĩa (cùng tiền tố `path_prefix`):
+    - .f32   : ma trận float32 liên tục (N x dim), mở bằng np.memmap -> khởi động không phải đọc hết vào RAM.
+    - .rows  : mỗi dòng "suggestion_id<TAB>fingerprint" tương ứng 1 hàng ma trận.
+    - .json  : dim + tham số encoder (đổi tham số -> phải build lại) + số tâm IVF.
+    - .ivf / .lists : tâm cụm float32 (n_lists x dim) + tâm của từng hàng (int32), có khi index >= `ivf_min_rows`.
+    Thêm mới / sửa text = ghi nối hàng mới vào cuối file (hàng cũ của cùng id bị bỏ khỏi danh sách tìm kiếm).
+    Tìm kiếm: index nhỏ -> nhân ma trận-vector trên các hàng còn hiệu lực; index lớn -> chỉ chấm điểm các hàng
+    thuộc `nprobe` cụm có tâm gần câu hỏi nhất (IVF, gần đúng), rồi argpartition lấy top-k.
+    Tâm cụm được train lại khi số hàng gấp `retrain_factor` lần lúc train.
+    """
+
+    def __init__(self, path_prefix=INDEX_PREFIX, encoder=None, ivf_min_rows=20000, nprobe=24, retrain_factor=4):
+        self.path_prefix = path_prefix
+        self.encoder = encoder or HashingEncoder()
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self.retrain_factor = retrain_factor
+        self._write_lock = threading.Lock()
+        self._trained_rows = 0
+        # (matrix, rows, live_pos, row_of, centroids, lists) được thay cùng lúc -> luồng tìm kiếm luôn thấy bản
+        # nhất quán. live_pos: vị trí các hàng còn hiệu lực; lists[c]: các hàng còn hiệu lực thuộc tâm c
+        self._state = self._make_state(np.zeros((0, self.encoder.dim), dtype=np.float32), [])
+        self.load()
+
+    @property
+    def _paths(self):
+        return self.path_prefix + ".f32", self.path_prefix + ".rows", self.path_prefix + ".json"
+
+    @property
+    def _ivf_paths(self):
+        return self.path_prefix + ".ivf", self.path_prefix + ".lists"
+
+    # --- ĐỌC ---
+    def load(self):
+        matrix_path, rows_path, meta_path = self._paths
+        if not os.path.exists(meta_path):
+            return False
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dim") != self.encoder.dim or meta.get("ngram_range") != list(self.encoder.ngram_range):
+                logger.warning("VECTOR: Tham số encoder đã đổi, cần build lại index.")
+                return False
+            with open(rows_path, "r", encoding="utf-8") as f:
+                rows = [line.rstrip("\n").split("\t") for line in f if line.strip()]
+            # Crash giữa lúc append có thể làm 2 file lệch nhau -> chỉ dùng phần chung
+            n_rows = min(len(rows), os.path.getsize(matrix_path) // (4 * self.encoder.dim))
+            rows = rows[:n_rows]
+            matrix = (np.memmap(matrix_path, dtype=np.float32, mode="r", shape=(n_rows, self.encoder.dim))
+                      if n_rows else np.zeros((0, self.encoder.dim), dtype=np.float32))
+            centroids, assign = self._load_ivf(meta, matrix)
+            self._trained_rows = meta.get("trained_rows", 0) if centroids is not None else 0
+            self._state = self._make_state(matrix, [(sid, int(fp)) for sid, fp in rows], centroids, assign)
+            logger.info(f"VECTOR: Đã map {n_rows} vector từ {matrix_path}"
+                        f"{f' ({len(centroids)} cụm IVF)' if centroids is not None else ''}.")
+            return True
+        except Exception as e:
+            logger.error(f"VECTOR: Lỗi đọc index: {e}")
+            return False
+
+    def _load_ivf(self, meta, matrix):
+        """Tâm cụm + tâm của từng hàng; hàng ghi nối chưa kịp có tâm (crash) thì gán lại trong RAM"""
+        n_lists = meta.get("n_lists")
+        ivf_path, lists_path = self._ivf_paths
+        if not n_lists or not os.path.exists(ivf_path) or not os.path.exists(lists_path):
+            return None, None
+        centroids = np.fromfile(ivf_path, dtype=np.float32)
+        if centroids.size != n_lists * self.encoder.dim:
+            logger.warning("VECTOR: File tâm IVF không khớp, tìm kiếm quét toàn bộ tới khi train lại.")
+            return None, None
+        centroids = centroids.reshape(n_lists, self.encoder.dim)
+        assign = np.fromfile(lists_path, dtype=np.int32)[:len(matrix)]
+        if len(assign) < len(matrix):
+            assign = np.concatenate([assign, _assign(matrix[len(assign):], centroids)])
+        return centroids, assign
+
+    @staticmethod
+    def _make_state(matrix, rows, centroids=None, assign=None):
+        row_of = {}
+        for pos, (sugg_id, fingerprint) in enumerate(rows):
+            row_of[sugg_id] = (pos, fingerprint)  # Hàng sau ghi đè hàng trước của cùng id
+        live_pos = np.sort(np.fromiter((pos for pos, _ in row_of.values()), dtype=np.int64, count=len(row_of)))
+        lists = None
+        if centroids is not None:
+            # Nhóm các hàng còn hiệu lực theo tâm; sort ổn định -> trong mỗi cụm vị trí tăng dần (đọc memmap tuần tự)
+            live_assign = assign[live_pos]
+            order = np.argsort(live_assign, kind="stable")
+            lists = np.split(live_pos[order], np.cumsum(np.bincount(live_assign, minlength=len(centroids)))[:-1])
+        return matrix, rows, live_pos, row_of, centroids, lists
+
+    def stale_records(self, records):
+        """Các bản ghi chưa có vector hoặc đã đổi text kể từ lần embed trước"""
+        row_of = self._state[3]
+        stale = []
+        for rec in records:
+            entry = row_of.get(rec['suggestion_id'])
+            if entry is None or entry[1] != _fingerprint(rec):
+                stale.append(rec)
+        return stale
+
+    # --- GHI ---
+    def _write_meta(self, n_lists=0, trained_rows=0):
+        _, _, meta_path = self._paths
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"dim": self.encoder.dim, "ngram_range": list(self.encoder.ngram_range),
+                       "n_lists": n_lists, "trained_rows": trained_rows}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _train(self, matrix):
+        """Train tâm cụm trên `matrix` (toàn bộ các hàng hiện có), ghi .ivf + .lists (gọi khi giữ _write_lock)"""
+        n_lists = max(16, int(np.sqrt(len(matrix))))
+        centroids = _train_centroids(matrix, n_lists)
+        assign = _assign(matrix, centroids)
+        ivf_path, lists_path = self._ivf_paths
+        centroids.tofile(ivf_path + ".tmp")
+        assign.tofile(lists_path + ".tmp")
+        os.replace(ivf_path + ".tmp", ivf_path)
+        os.replace(lists_path + ".tmp", lists_path)
+        self._write_meta(n_lists, len(matrix))
+        self._trained_rows = len(matrix)
+        logger.info(f"VECTOR: Đã train {n_lists} cụm IVF trên {len(matrix)} vector.")
+        return centroids, assign
+
+    def build(self, records):
+        """Ghi lại toàn bộ index (bỏ luôn các hàng cũ đã bị thay thế)"""
+        records = list(records)
+        with self._write_lock:
+            matrix_path, rows_path, meta_path = self._paths
+            matrix = self.encoder.encode_records(records)
+            # Ghi ra file tạm rồi rename -> tiến trình khác đang đọc không thấy file dở dang
+            matrix.tofile(matrix_path + ".tmp")
+            with open(rows_path + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines(f"{rec['suggestion_id']}\t{_fingerprint(rec)}\n" for rec in records)
+            for path in (matrix_path, rows_path):
+                os.replace(path + ".tmp", path)
+            if len(records) >= self.ivf_min_rows:
+                self._train(matrix)
+            else:
+                self._write_meta()
+        self.load()
+        return len(records)
+
+    def append(self, records):
+        """Embed và ghi nối các bản ghi mới/đổi text (gọi trong thread: có encode + I/O)"""
+        records = list(records)
+        if not records:
+            return 0
+        matrix_path, rows_path, meta_path = self._paths
+        if not os.path.exists(meta_path):
+            logger.info("VECTOR: Chưa có index trên đĩa, dựng mới.")
+            return self.build(records)
+
+        with self._write_lock:
+            vectors = self.encoder.encode_records(records)
+            _, old_rows, _, _, centroids, _ = self._state
+            rows = list(old_rows)
+            # Ma trận ghi trước, tâm cụm + danh sách id ghi sau -> crash giữa chừng chỉ để thừa hàng không có id
+            with open(matrix_path, "r+b") as f:
+                f.seek(len(rows) * 4 * self.encoder.dim)
+                f.truncate()
+                f.write(vectors.tobytes())
+            rows.extend((rec['suggestion_id'], _fingerprint(rec)) for rec in records)
+            matrix = np.memmap(matrix_path, dtype=np.float32, mode="r", shape=(len(rows), self.encoder.dim))
+
+            if len(rows) >= self.ivf_min_rows and (
+                    centroids is None or len(rows) >= self._trained_rows * self.retrain_factor):
+                centroids, assign = self._train(matrix)
+            elif centroids is not None:
+                _, lists_path = self._ivf_paths
+                assign = np.fromfile(lists_path, dtype=np.int32)[:len(old_rows)]
+                if len(assign) < len(old_rows):
+                    assign = np.concatenate([assign, _assign(matrix[len(assign):len(old_rows)], centroids)])
+                new_assign = _assign(vectors, centroids)
+                with open(lists_path, "r+b") as f:
+                    f.seek(len(old_rows) * 4)
+                    f.truncate()
+                    f.write(new_assign.tobytes())
+                assign = np.concatenate([assign, new_assign])
+            else:
+                assign = None
+
+            with open(rows_path, "a", encoding="utf-8") as f:
+                f.writelines(f"{rec['suggestion_id']}\t{_fingerprint(rec)}\n" for rec in records)
+            self._state = self._make_state(matrix, rows, centroids, assign)
+        return len(records)
+
+    # --- TÌM KIẾM ---
+    def search(self, message_text, top_k=5):
+        """Trả về [(suggestion_id, cosine)] giảm dần, tối đa `top_k` phần tử"""
+        matrix, rows, live_pos, _, centroids, lists = self._state
+        if not len(live_pos):
+            return []
+        query = self.encoder.encode(message_text)
+        if not query.any():
+            return []
+        if lists is not None:
+            nprobe = min(self.nprobe, len(lists))
+            probe = np.argpartition(centroids @ query, -nprobe)[-nprobe:]
+            candidates = np.sort(np.concatenate([lists[c] for c in probe]))
+        else:
+            candidates = live_pos
+        if not len(candidates):
+            return []
+        # Chỉ đọc + chấm điểm hàng còn hiệu lực; không có hàng bị thay thế thì nhân thẳng trên memmap
+        scores = (matrix @ query) if len(candidates) == len(rows) else (matrix[candidates] @ query)
+        k = min(top_k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(rows[candidates[i]][0], float(scores[i])) for i in top if scores[i] > 0]
+
+    def __len__(self):
+        return len(self._state[3])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dựng / thử index vector cho content_db")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("text", nargs="?", default="")
+    parser.add_argument("--prefix", default=INDEX_PREFIX)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", level=logging.INFO)
+
+    index = VectorIndex(args.prefix)
+    if args.command == "build":
+        from db_collector import CollectorV2
+        db = CollectorV2(os.getenv("DATABASE_URL", "sqlite:///aimentor.db"))
+        records = db.get_all_content()
+        print(f"Đã dựng index {index.build(records)} vector -> {args.prefix}.f32")
+    else:
+        for sugg_id, score in index.search(args.text, top_k=args.top_k):
+            print(f"{score:.3f}\t{sugg_id}")
+
+
+if __name__ == "__main__":
+    main()
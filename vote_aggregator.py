@@ -0,0 +1,57 @@
+# vote_aggregator.py
+# [DAY 30] Gom điểm 👍/👎 trong RAM, cập nhật ranking ngay và ghi xuống DB theo batch
+
+import asyncio
+import logging
+
+from db_collector import run_db
+
+logger = logging.getLogger(__name__)
+
+
+class VoteAggregator:
+    """
+    - add_vote(): cộng điểm thẳng vào ContentCache (lần gợi ý sau thấy điểm mới ngay) và ghi nhận delta.
+    - flush(): ghi toàn bộ delta tích lũy bằng các lệnh UPDATE ... SET rating_score = rating_score + :d
+      trong 1 transaction (nguyên tử, không có read-modify-write).
+    """
+
+    def __init__(self, db, content_cache):
+        self.db = db
+        self.content_cache = content_cache
+        self.pending = {}     # sugg_id -> delta chưa ghi
+        self._in_flight = {}  # delta đang được flush (chưa commit)
+        self._flush_lock = asyncio.Lock()
+
+    def add_vote(self, sugg_id, rating):
+        delta = 1 if rating == "good" else -1
+        self.pending[sugg_id] = self.pending.get(sugg_id, 0) + delta
+        self.content_cache.adjust_score(sugg_id, delta)
+        return delta
+
+    def unflushed(self):
+        """Delta mà DB chưa có -> cache cộng bù khi nhận dòng mới từ delta refresh"""
+        if not self._in_flight:
+            return self.pending
+        merged = dict(self._in_flight)
+        for sugg_id, delta in self.pending.items():
+            merged[sugg_id] = merged.get(sugg_id, 0) + delta
+        return merged
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            self._in_flight, self.pending = self.pending, {}
+            deltas = {sugg_id: delta for sugg_id, delta in self._in_flight.items() if delta}
+            ok = True
+            if deltas:
+                ok = await run_db(self.db.apply_score_deltas, deltas)
+            if not ok:
+                # DB lỗi -> trả delta về hàng chờ, lần flush sau thử lại
+                for sugg_id, delta in self._in_flight.items():
+                    self.pending[sugg_id] = self.pending.get(sugg_id, 0) + delta
+            self._in_flight = {}
+            if ok and deltas:
+                logger.info(f"VOTES: Đã ghi điểm cho {len(deltas)} gợi ý.")
+            return len(deltas) if ok else 0
@@ -0,0 +1,212 @@
+# webhook_client.py
+# [DAY 40] Gửi lại các Update đã ghi (JSONL, mỗi dòng 1 Update như Bot API gửi) tới webhook để đo thông lượng
+#
+#   python webhook_client.py record --count 2000 --out updates.jsonl     -> sinh Update giả (giống load_test.py)
+#   python webhook_client.py post --url http://127.0.0.1:8443/telegram --secret S --file updates.jsonl
+#   python webhook_client.py local --file updates.jsonl --rate 200 --concurrent-updates 64
+#       -> chạy bot trong tiến trình ở chế độ webhook (Bot API + Gemini giả), đo cả lúc nhận lẫn lúc xử lý xong
+#
+# File JSONL cũng có thể lấy từ kết quả getUpdates thật (mỗi phần tử "result" là 1 dòng).
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+import httpx
+from telegram import Update
+from telegram.ext import TypeHandler
+
+from benchmark import StubGemini, import_bot, summarize
+from load_test import FakeTelegramRequest, make_update_payload
+from webhook_server import WebhookServer
+
+LOCAL_SECRET = "webhook-client-secret"
+
+
+def record_updates(path, count, users=500, feedback_ratio=0.2, repeat_ratio=0.3, seed=7):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for update_id in range(1, count + 1):
+            _, payload = make_update_payload(rng, update_id, users, feedback_ratio, repeat_ratio)
+            f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    return count
+
+
+def load_updates(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def post_updates(url, secret, payloads, concurrency=32, rate=None):
+    """
+    POST từng Update qua `concurrency` kết nối keep-alive. rate=None -> gửi nhanh nhất có thể,
+    ngược lại update thứ i được gửi không sớm hơn i/rate giây tính từ lúc bắt đầu.
+    Trả về (báo cáo, {update_id: thời điểm gửi}, danh sách update_id được nhận 200).
+    """
+    bodies = [(payload.get("update_id"), json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+              for payload in payloads]
+    headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    statuses, latencies, sent_at, accepted = {}, [], {}, []
+    next_index = 0
+    start = time.perf_counter()
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def worker():
+            nonlocal next_index
+            while next_index < len(bodies):
+                index = next_index
+                next_index += 1
+                if rate:
+                    delay = start + index / rate - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                update_id, body = bodies[index]
+                sent = sent_at[update_id] = time.perf_counter()
+                try:
+                    response = await client.post(url, content=body, headers=headers)
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - sent)
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == "200":
+                    accepted.append(update_id)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    duration = time.perf_counter() - start
+    report = {
+        "sent": len(bodies),
+        "duration_s": round(duration, 3),
+        "statuses": statuses,
+        "ack": summarize(latencies, duration) if latencies else {},
+    }
+    return report, sent_at, accepted
+
+
+async def run_local(args, payloads):
+    """Bot thật (handler, cache, governor...) + WebhookServer trên 127.0.0.1, chỉ Bot API và Gemini là giả"""
+    workdir = tempfile.mkdtemp(prefix="aimentor-webhook-")
+    # import_bot gọi db.setup_database() đồng bộ -> chạy trong thread, không chặn (và không lỗi với DB_ASYNC=1) loop này
+    bot = await asyncio.to_thread(import_bot, workdir, METRICS_PORT="0")
+    bot.model_v3 = StubGemini(latency=args.gemini_latency, jitter=args.gemini_jitter)
+    fake_api = FakeTelegramRequest(latency=args.api_latency)
+    application = bot.build_application(token="123456:webhook-test", request=fake_api, with_jobs=False,
+                                        concurrent_updates=args.concurrent_updates)
+    finished = {}
+
+    async def on_done(update, context):
+        finished[update.update_id] = time.perf_counter()
+
+    # Group rất lớn -> chạy sau khi handler chính của update đã xong
+    application.add_handler(TypeHandler(Update, on_done), group=1000)
+    server = WebhookServer(application, secret_token=LOCAL_SECRET, path="/telegram", host="127.0.0.1", port=0,
+                           max_pending=args.max_pending)
+
+    await application.initialize()
+    await bot.on_startup(application)
+    await application.start()
+    await server.start()
+    try:
+        url = f"http://127.0.0.1:{server.bound_port}/telegram"
+        start = time.perf_counter()
+        report, sent_at, accepted = await post_updates(url, LOCAL_SECRET, payloads, args.concurrency, args.rate)
+        deadline = time.perf_counter() + args.drain
+        while time.perf_counter() < deadline and any(i not in finished for i in accepted):
+            await asyncio.sleep(0.05)
+        done = [i for i in accepted if i in finished]
+        wall = (max(finished[i] for i in done) - start) if done else 0.0
+        report["processed"] = len(done)
+        report["backlog"] = len(accepted) - len(done)
+        if done:
+            report["e2e"] = summarize([finished[i] - sent_at[i] for i in done], wall)
+        report["bot_api_calls"] = fake_api.calls
+    finally:
+        await server.stop()
+        await application.stop()
+        await bot.on_shutdown(application)
+        await application.shutdown()
+    return report
+
+
+def print_report(report):
+    ack = report.get("ack", {})
+    print(f"Gửi {report['sent']} update trong {report['duration_s']}s | mã trả về {report['statuses']}")
+    if ack:
+        print(f"  nhận (ack): {ack['throughput_per_s']:g}/s | p50 {ack['p50_ms']:.1f}ms p95 {ack['p95_ms']:.1f}ms "
+              f"p99 {ack['p99_ms']:.1f}ms")
+    if "processed" in report:
+        e2e = report.get("e2e", {})
+        print(f"  xử lý xong: {report['processed']} (còn tồn {report['backlog']}) | "
+              f"{e2e.get('throughput_per_s', 0):g}/s | p50 {e2e.get('p50_ms', 0):.0f}ms "
+              f"p95 {e2e.get('p95_ms', 0):.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client test webhook AI Mentor Bot (không cần Telegram)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Sinh file JSONL chứa Update giả")
+    rec.add_argument("--count", type=int, default=2000)
+    rec.add_argument("--out", default="updates.jsonl")
+    rec.add_argument("--users", type=int, default=500)
+    rec.add_argument("--feedback-ratio", type=float, default=0.2)
+    rec.add_argument("--repeat-ratio", type=float, default=0.3)
+    rec.add_argument("--seed", type=int, default=7)
+
+    for name, help_text in (("post", "Gửi tới webhook đang chạy"), ("local", "Chạy bot webhook trong tiến trình rồi gửi")):
+        cmd = sub.add_parser(name, help=help_text)
+        cmd.add_argument("--file", help="JSONL Update (mặc định: sinh --count update giả)")
+        cmd.add_argument("--count", type=int, default=2000)
+        cmd.add_argument("--concurrency", type=int, default=32, help="Số kết nối gửi song song")
+        cmd.add_argument("--rate", type=float, default=None, help="Update/giây (mặc định: nhanh nhất có thể)")
+        cmd.add_argument("--out")
+        if name == "post":
+            cmd.add_argument("--url", required=True)
+            cmd.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+        else:
+            cmd.add_argument("--max-pending", type=int, default=1000, help="WEBHOOK_MAX_PENDING của bot")
+            cmd.add_argument("--concurrent-updates", type=int, default=64)
+            cmd.add_argument("--drain", type=float, default=30, help="Số giây chờ xử lý nốt sau khi gửi xong")
+            cmd.add_argument("--gemini-latency", type=float, default=2.0)
+            cmd.add_argument("--gemini-jitter", type=float, default=0.5)
+            cmd.add_argument("--api-latency", type=float, default=0.03)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_updates(args.out, args.count, args.users, args.feedback_ratio, args.repeat_ratio, args.seed)
+        print(f"💾 Đã ghi {args.count} update: {args.out}")
+        return
+
+    out = os.path.abspath(args.out) if args.out else None
+    if args.file:
+        payloads = load_updates(args.file)
+    else:
+        rng = random.Random(7)
+        payloads = [make_update_payload(rng, update_id)[1] for update_id in range(1, args.count + 1)]
+
+    if args.command == "post":
+        report = asyncio.run(post_updates(args.url, args.secret, payloads, args.concurrency, args.rate))[0]
+    else:
+        report = asyncio.run(run_local(args, payloads))
+    report["meta"] = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "command": args.command,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+    }
+    print_report(report)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Đã ghi kết quả: {out}")
+
+
+if __name__ == "__main__":
+    main()
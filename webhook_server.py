@@ -0,0 +1,161 @@
+# webhook_server.py
+# [DAY 40] Nhận update qua webhook: HTTP server asyncio tối giản, kiểm tra secret token,
+# đẩy Update vào update_queue của Application (thay cho vòng getUpdates của run_polling), giới hạn số update tồn đọng.
+
+import asyncio
+import hmac
+import json
+import logging
+from http import HTTPStatus
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+from instrumentation import WEBHOOK_BACKLOG, WEBHOOK_REQUESTS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class WebhookServer:
+    """
+    POST `path` + header X-Telegram-Bot-Api-Secret-Token đúng -> Update.de_json -> update_queue.put_nowait -> 200.
+    - Sai secret: 403 (so sánh hằng thời gian). Sai path: 404, sai method: 405, JSON hỏng: 400, body quá lớn: 413.
+    - Tồn đọng >= max_pending: 503 ngay -> Telegram tự gửi lại sau, RAM không phình khi handler chậm hơn tốc độ nhận.
+      Tồn đọng = đã nhận nhưng chưa bắt đầu xử lý. Không giới hạn bằng maxsize của update_queue được: với
+      concurrent_updates > 1, Application lấy update ra khỏi queue ngay và tạo task chờ semaphore.
+    - Giữ kết nối (keep-alive) giữa các request như Telegram / webhook_client.py vẫn làm.
+    - GET /healthz -> 200 (health check của Render / load balancer).
+    """
+
+    def __init__(self, application, secret_token, path="/telegram", host="0.0.0.0", port=8443,
+                 max_pending=1000, max_body=1_048_576, idle_timeout=60):
+        self.application = application
+        self.secret_token = secret_token.encode("utf-8")
+        self.path = path
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self._server = None
+        self._writers = set()
+        self.accepted = 0
+        self.started = 0
+        # Group nhỏ nhất -> chạy đầu tiên khi update bắt đầu được xử lý (đã qua semaphore concurrent_updates)
+        application.add_handler(TypeHandler(Update, self._on_started), group=-1000)
+
+    async def _on_started(self, update, context):
+        self.started += 1
+
+    @property
+    def backlog(self):
+        return self.accepted - self.started
+
+    @property
+    def bound_port(self):
+        """Cổng thật đang nghe (port=0 -> hệ điều hành tự chọn, dùng cho test)"""
+        if self._server is None or not self._server.sockets:
+            return None
+        return self._server.sockets[0].getsockname()[1]
+
+    def _dispatch(self, method, target, headers, body):
+        """Xử lý 1 request (đồng bộ, không await) -> mã HTTP"""
+        if method == "GET" and target == "/healthz":
+            return HTTPStatus.OK
+        if target != self.path:
+            return HTTPStatus.NOT_FOUND
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode("utf-8"), self.secret_token):
+            return HTTPStatus.FORBIDDEN
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            logger.warning(f"WEBHOOK: Update không hợp lệ: {e}")
+            return HTTPStatus.BAD_REQUEST
+        if update is None:
+            return HTTPStatus.BAD_REQUEST
+        if self.backlog >= self.max_pending:
+            return HTTPStatus.SERVICE_UNAVAILABLE
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return HTTPStatus.SERVICE_UNAVAILABLE
+        self.accepted += 1
+        return HTTPStatus.OK
+
+    @staticmethod
+    def _respond(writer, status, keep_alive):
+        body = status.phrase.encode("latin-1")
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+        )
+        WEBHOOK_REQUESTS_TOTAL.inc(status=status.value)
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), timeout=10)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    self._respond(writer, HTTPStatus.BAD_REQUEST, keep_alive=False)
+                    break
+                method, target, version = parts[0], parts[1].split("?")[0], parts[2]
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                if "transfer-encoding" in headers:
+                    # Telegram luôn gửi Content-Length; không hỗ trợ chunked
+                    self._respond(writer, HTTPStatus.LENGTH_REQUIRED, keep_alive=False)
+                    break
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    self._respond(writer, HTTPStatus.BAD_REQUEST, keep_alive=False)
+                    break
+                if length > self.max_body:
+                    self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, keep_alive=False)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b""
+
+                self._respond(writer, self._dispatch(method, target, headers, body), keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"WEBHOOK: Đóng kết nối: {e!r}")
+        except Exception as e:
+            logger.error(f"WEBHOOK: Lỗi xử lý kết nối: {e}")
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        WEBHOOK_BACKLOG.set_function(lambda: self.backlog)
+        logger.info(f"WEBHOOK: Đang nghe http://{self.host}:{self.bound_port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Đóng cả các kết nối keep-alive đang rảnh, không chờ hết idle_timeout
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None